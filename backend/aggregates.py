@@ -0,0 +1,231 @@
+"""
+Incremental rolling statistics for sensor readings.
+Per-zone sums are updated as readings are ingested, so a stats query costs
+the same regardless of how many readings are stored.
+"""
+
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from storage import CHANNELS, CHANNEL_INDEX, OUTPUT_DECIMALS
+
+DEFAULT_WINDOWS_HOURS = (1, 24, 168)
+
+# Each window is split into this many time buckets. Readings leave the window
+# a whole bucket at a time, i.e. with 1/96 of the window length granularity.
+BUCKETS_PER_WINDOW = 96
+
+
+def _round(value: float) -> float:
+    return round(float(value), OUTPUT_DECIMALS)
+
+
+def summarize(readings: int, count: np.ndarray, total: np.ndarray,
+              sumsq: np.ndarray, minimum: np.ndarray,
+              maximum: np.ndarray) -> Dict:
+    """Build the per-zone stats dict from per-channel accumulators."""
+    channels = {}
+    for i, name in enumerate(CHANNELS):
+        n = int(count[i])
+        if n:
+            mean = total[i] / n
+            variance = max(sumsq[i] / n - mean * mean, 0.0)
+            channels[name] = {
+                'count': n,
+                'mean': _round(mean),
+                'min': _round(minimum[i]),
+                'max': _round(maximum[i]),
+                'variance': _round(variance),
+            }
+        else:
+            channels[name] = {'count': 0, 'mean': 0, 'min': None,
+                              'max': None, 'variance': None}
+
+    return {
+        'readings': readings,
+        'avg_soil_moisture': channels['soil_moisture']['mean'],
+        'avg_temperature': channels['temperature']['mean'],
+        'avg_humidity': channels['humidity']['mean'],
+        'total_water_applied': _round(total[CHANNEL_INDEX['water_applied']]),
+        'channels': channels,
+    }
+
+
+def summarize_window(values: np.ndarray) -> Dict:
+    """Stats for a raw (len(CHANNELS), n) window of readings."""
+    data = values.astype(np.float64)
+    valid = ~np.isnan(data)
+    filled = np.where(valid, data, 0.0)
+    with np.errstate(invalid='ignore'):
+        minimum = np.fmin.reduce(data, axis=1, initial=np.inf)
+        maximum = np.fmax.reduce(data, axis=1, initial=-np.inf)
+    return summarize(int(data.shape[1]), valid.sum(axis=1), filled.sum(axis=1),
+                     (filled * filled).sum(axis=1), minimum, maximum)
+
+
+class ZoneAggregates:
+    """Bucketed running aggregates for one zone over several windows.
+
+    Accumulators for all windows are stacked in (windows, buckets, channels)
+    arrays so one ingest updates every window with a handful of NumPy ops.
+    A bucket slot is reused once its time range has left the window, which
+    evicts the readings it held.
+
+    `arrays` optionally supplies the accumulators, as returned by
+    empty_arrays(), e.g. views into shared memory.
+    """
+
+    def __init__(self, windows_seconds: Sequence[float],
+                 buckets: int = BUCKETS_PER_WINDOW,
+                 arrays: Optional[Tuple[np.ndarray, ...]] = None):
+        self.buckets = buckets
+        self._widths = np.asarray(windows_seconds, dtype=np.float64) / buckets
+        self._rows = np.arange(len(windows_seconds))
+        if arrays is None:
+            arrays = self.empty_arrays(len(windows_seconds), buckets)
+        (self._ids, self._readings, self._count, self._sum, self._sumsq,
+         self._min, self._max) = arrays
+
+    @staticmethod
+    def shapes(windows: int, buckets: int = BUCKETS_PER_WINDOW
+               ) -> Tuple[Tuple[Tuple[int, ...], type], ...]:
+        """(shape, dtype) of each accumulator, in the order `arrays` takes them."""
+        shape = (windows, buckets, len(CHANNELS))
+        return ((shape[:2], np.int64), (shape[:2], np.int64), (shape, np.int64),
+                (shape, np.float64), (shape, np.float64), (shape, np.float64),
+                (shape, np.float64))
+
+    @staticmethod
+    def reset_arrays(arrays: Tuple[np.ndarray, ...]):
+        """Empty accumulators in place: no buckets, no readings."""
+        ids, readings, count, total, sumsq, minimum, maximum = arrays
+        ids.fill(-1)
+        for array in (readings, count, total, sumsq):
+            array.fill(0)
+        minimum.fill(np.inf)
+        maximum.fill(-np.inf)
+
+    @classmethod
+    def empty_arrays(cls, windows: int, buckets: int = BUCKETS_PER_WINDOW
+                     ) -> Tuple[np.ndarray, ...]:
+        arrays = tuple(np.empty(shape, dtype=dtype)
+                       for shape, dtype in cls.shapes(windows, buckets))
+        cls.reset_arrays(arrays)
+        return arrays
+
+    def add(self, timestamp: float, values: Iterable[float]):
+        """Fold one reading into every window."""
+        values = np.asarray(values, dtype=np.float64)
+        ids = (timestamp // self._widths).astype(np.int64)
+        slots = ids % self.buckets
+        current = self._ids[self._rows, slots]
+
+        # A slot holding a newer bucket means this reading is already older
+        # than that window; skip it there.
+        keep = current <= ids
+        rows, slots, ids = self._rows[keep], slots[keep], ids[keep]
+        stale = current[keep] < ids
+        if stale.any():
+            r, s = rows[stale], slots[stale]
+            self._ids[r, s] = ids[stale]
+            self._readings[r, s] = 0
+            self._count[r, s] = 0
+            self._sum[r, s] = 0.0
+            self._sumsq[r, s] = 0.0
+            self._min[r, s] = np.inf
+            self._max[r, s] = -np.inf
+
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0.0)
+        self._readings[rows, slots] += 1
+        self._count[rows, slots] += valid
+        self._sum[rows, slots] += filled
+        self._sumsq[rows, slots] += filled * filled
+        self._min[rows, slots] = np.fmin(self._min[rows, slots], values)
+        self._max[rows, slots] = np.fmax(self._max[rows, slots], values)
+
+    def add_many(self, timestamps: np.ndarray, values: np.ndarray):
+        """Fold a batch of readings into every window.
+
+        `values` has shape (len(CHANNELS), n). Updates are scattered into the
+        bucket arrays with unbuffered ufunc.at calls, one set per window.
+        """
+        data = values.T.astype(np.float64)
+        valid = ~np.isnan(data)
+        filled = np.where(valid, data, 0.0)
+        for window, width in enumerate(self._widths):
+            ids = (timestamps // width).astype(np.int64)
+            slots = ids % self.buckets
+
+            # Each slot ends up holding the newest bucket that maps to it
+            target = self._ids[window].copy()
+            np.maximum.at(target, slots, ids)
+            stale = target > self._ids[window]
+            if stale.any():
+                self._ids[window, stale] = target[stale]
+                self._readings[window, stale] = 0
+                self._count[window, stale] = 0
+                self._sum[window, stale] = 0.0
+                self._sumsq[window, stale] = 0.0
+                self._min[window, stale] = np.inf
+                self._max[window, stale] = -np.inf
+
+            keep = ids == target[slots]
+            s = slots[keep]
+            np.add.at(self._readings[window], s, 1)
+            np.add.at(self._count[window], s, valid[keep])
+            np.add.at(self._sum[window], s, filled[keep])
+            np.add.at(self._sumsq[window], s, filled[keep] * filled[keep])
+            np.fmin.at(self._min[window], s, data[keep])
+            np.fmax.at(self._max[window], s, data[keep])
+
+    def summary(self, window: int, now: float) -> Dict:
+        """Stats for the window at index `window`, as of time `now`."""
+        newest = int(now // self._widths[window])
+        ids = self._ids[window]
+        live = (ids > newest - self.buckets) & (ids <= newest)
+        return summarize(int(self._readings[window, live].sum()),
+                         self._count[window, live].sum(axis=0),
+                         self._sum[window, live].sum(axis=0),
+                         self._sumsq[window, live].sum(axis=0),
+                         self._min[window, live].min(axis=0, initial=np.inf),
+                         self._max[window, live].max(axis=0, initial=-np.inf))
+
+
+class StatsAggregator:
+    """Rolling per-zone stats for a fixed set of window lengths."""
+
+    def __init__(self, windows_hours: Sequence[float] = DEFAULT_WINDOWS_HOURS,
+                 buckets: int = BUCKETS_PER_WINDOW):
+        self.windows_hours = tuple(windows_hours)
+        self.buckets = buckets
+        self._zones: Dict[int, ZoneAggregates] = {}
+
+    def add(self, zone_id: int, timestamp: float, values: Iterable[float]):
+        """Record a reading for a zone."""
+        zone = self._zones.get(zone_id)
+        if zone is None:
+            zone = self._zones[zone_id] = self._new_zone(zone_id)
+        zone.add(timestamp, values)
+
+    def add_many(self, zone_id: int, timestamps: np.ndarray, values: np.ndarray):
+        """Record a batch of readings for a zone."""
+        zone = self._zones.get(zone_id)
+        if zone is None:
+            zone = self._zones[zone_id] = self._new_zone(zone_id)
+        zone.add_many(timestamps, values)
+
+    def _new_zone(self, zone_id: int) -> ZoneAggregates:
+        return ZoneAggregates([hours * 3600 for hours in self.windows_hours], self.buckets)
+
+    def covers(self, hours: float) -> bool:
+        """Whether stats for this window length are maintained."""
+        return hours in self.windows_hours
+
+    def summary(self, zone_id: int, hours: float, now: float) -> Optional[Dict]:
+        """Stats for a zone over a maintained window, None if the zone is unknown."""
+        zone = self._zones.get(zone_id)
+        if zone is None:
+            return None
+        return zone.summary(self.windows_hours.index(hours), now)
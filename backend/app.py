@@ -3,35 +3,203 @@ Flask Backend Server for Intelligent Irrigation Controller
 Handles API requests, WebSocket connections, and data storage.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
-from datetime import datetime, timedelta
+from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
+from datetime import datetime
 import json
 import os
-from collections import defaultdict
-import threading
+import atexit
 import time
 
+import numpy as np
+
+from aggregates import BUCKETS_PER_WINDOW, summarize_window
+from broadcaster import Broadcaster, device_room, zone_fields, zone_room
+from codec import UnsupportedEncoding, decode_document, decode_packed, is_packed
+from devices import DEFAULT_DEVICE, CapacityExceeded, DeviceRegistry
+from downsample import MAX_POINTS_LIMIT, METHODS, downsample
+from export import (CHUNK_SIZE, ENCODINGS, FORMATS, MIMETYPES, buffer_history, compress,
+                    stream_history)
+from inference import (DEFAULT_MODEL_PATH, DEFAULT_NUMPY_MODEL_PATH, DEFAULT_SCALER_PATH,
+                       FEATURES, ModelUnavailable, create_inference)
+from ingest import (MAX_DEVICE_ID_LENGTH, MAX_ZONES, IngestJob, QueueFull, ReadingGroup,
+                    ShardedIngestQueue, drop_acknowledged, highest_seqs, merge_groups,
+                    parse_batch)
+from instrumentation import CONTENT_TYPE, MetricsRegistry, SamplingProfiler
+from message_hub import HubManager
+from persistence import DEFAULT_DATABASE_URL, create_persistence
+from response_cache import DEFAULT_MAX_BYTES, DEFAULT_MAX_ENTRIES, ResponseCache
+from rollups import (DEFAULT_POINT_BUDGET, rebucket, rollup_records, select_tier,
+                     summarize_rollup, tier_named)
+from shared_state import DEFAULT_MAX_DEVICES, DEFAULT_MAX_ZONES, SharedDeviceRegistry
+from storage import CHANNELS, parse_timestamp, reading_values, records_from_arrays
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'irrigation-controller-secret-key'
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+# With several workers (see serve.py) emits go through a message queue so
+# they reach clients of every worker: a redis:// (or other python-socketio
+# queue) URL, or unix:// for the hub serve.py runs
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+if SOCKETIO_MESSAGE_QUEUE and SOCKETIO_MESSAGE_QUEUE.startswith('unix://'):
+    socketio = SocketIO(app, cors_allowed_origins="*",
+                        client_manager=HubManager(SOCKETIO_MESSAGE_QUEUE))
+else:
+    socketio = SocketIO(app, cors_allowed_origins="*", message_queue=SOCKETIO_MESSAGE_QUEUE)
+# Set when workers share device state through files in this directory
+SHARED_STATE_DIR = os.environ.get('SHARED_STATE_DIR')
+
+# Served on /metrics in the Prometheus text format; gauges of state that is
+# already kept elsewhere are collected when scraped (see collect_metrics)
+metrics = MetricsRegistry()
+request_seconds = metrics.histogram(
+    'irrigation_http_request_duration_seconds',
+    'Time to handle a request, including sending a streamed body',
+    ('route', 'method', 'status'))
+ingest_readings = metrics.counter(
+    'irrigation_ingest_readings_total', 'Readings applied to memory', ('device_id',))
+socketio_clients = metrics.gauge(
+    'irrigation_socketio_clients', 'Connected Socket.IO clients')
+socketio_clients.set(0)
+emit_seconds = metrics.histogram(
+    'irrigation_socketio_emit_duration_seconds', 'Time to emit one broadcast', ('event',))
+# The sampling profiler costs a stack walk per thread every interval, so it
+# can only be started at runtime when PROFILER_ENABLED is set
+profiler = SamplingProfiler()
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', 'False').lower() == 'true'
+
+# Sensor updates are coalesced and sent as diffs every BROADCAST_TICK_MS
+broadcaster = Broadcaster(socketio, tick=float(os.environ.get('BROADCAST_TICK_MS', 250)) / 1000,
+                          emit_seconds=emit_seconds, diffs=not SHARED_STATE_DIR)
+broadcaster.start()
 
-# In-memory data storage (replace with database in production)
-sensor_data = defaultdict(list)
-zone_configs = {
+# Each device has its own recent readings (last SENSOR_BUFFER_CAPACITY per
+# zone), rolling stats for the windows the dashboard asks /api/stats for, zone
+# configs and status, guarded by a per-device lock; full history goes to the
+# database. Workers sharing state keep all of it in SHARED_STATE_DIR, for up
+# to SHARED_MAX_DEVICES devices of SHARED_MAX_ZONES zones.
+if SHARED_STATE_DIR:
+    devices = SharedDeviceRegistry(
+        SHARED_STATE_DIR, capacity=int(os.environ.get('SENSOR_BUFFER_CAPACITY', 1000)),
+        windows_hours=(1, 24, 168),
+        max_devices=int(os.environ.get('SHARED_MAX_DEVICES', DEFAULT_MAX_DEVICES)),
+        max_zones=int(os.environ.get('SHARED_MAX_ZONES', DEFAULT_MAX_ZONES)))
+else:
+    devices = DeviceRegistry(capacity=int(os.environ.get('SENSOR_BUFFER_CAPACITY', 1000)),
+                             windows_hours=(1, 24, 168))
+persistence = create_persistence(os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL))
+atexit.register(persistence.close)
+# Server-side model for /api/predict and for backfilling readings that
+# arrive without a water_prediction; the NumPy export is used when present
+inference = create_inference(os.environ.get('NUMPY_MODEL_PATH', DEFAULT_NUMPY_MODEL_PATH),
+                             os.environ.get('MODEL_PATH', DEFAULT_MODEL_PATH),
+                             os.environ.get('SCALER_PATH', DEFAULT_SCALER_PATH))
+inference.start()
+# Workers attaching to shared state that already holds devices find the
+# history there; an empty registry (a new directory, or one the first
+# worker left before restoring into it) gets history from the database
+history_missing = len(devices) == 0
+# The unscoped endpoints (/api/zones, /api/status, ...) serve the original
+# single controller
+default_device = devices.get_or_create(DEFAULT_DEVICE, zone_configs={
     0: {'name': 'Zone 1 - Tomatoes', 'enabled': True, 'min_moisture': 40},
     1: {'name': 'Zone 2 - Lettuce', 'enabled': True, 'min_moisture': 45},
     2: {'name': 'Zone 3 - Herbs', 'enabled': True, 'min_moisture': 50},
     3: {'name': 'Zone 4 - Flowers', 'enabled': True, 'min_moisture': 35},
-}
-system_status = {
-    'online': False,
-    'last_update': None,
-    'pump_running': False,
-    'active_zones': []
-}
+})
+
+# Serialized responses of the read endpoints, reused while the device's data
+# version is unchanged; views of a sliding time window also expire after
+# RESPONSE_CACHE_TTL seconds
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', DEFAULT_MAX_ENTRIES)),
+    max_bytes=int(os.environ.get('RESPONSE_CACHE_BYTES', DEFAULT_MAX_BYTES)))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 5))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        labels = (request.url_rule.rule if request.url_rule is not None else 'unmatched',
+                  request.method, str(response.status_code))
+        def observe():
+            request_seconds.observe(time.perf_counter() - started, *labels)
+        if response.is_streamed:
+            # Timed until the server has sent the whole body
+            response.call_on_close(observe)
+        else:
+            observe()
+    return response
+
+def default_zone_config(zone_id):
+    """Configuration for a zone a device reports before it was configured."""
+    return {'name': f'Zone {zone_id + 1}', 'enabled': True, 'min_moisture': 40}
+
+def restore_history():
+    """Reload recent readings from the database after a restart."""
+    since = time.time() - max(devices.windows_hours) * 3600
+    for device_id, zone_id, timestamp, values in persistence.iter_since(since):
+        device = devices.get_or_create(device_id)
+        with device.lock:
+            device.add(zone_id, timestamp, values)
+            device.zone_configs.setdefault(zone_id, default_zone_config(zone_id))
+    # Devices resume replaying their buffers after the last stored reading
+    for device_id, seq in persistence.last_seqs().items():
+        device = devices.get_or_create(device_id)
+        with device.lock:
+            device.last_seq = device.accepted_seq = seq
+
+if history_missing:
+    restore_history()
+
+def zone_window(device_id, zone_id, since):
+    """Readings for a zone since a time, from memory and, if needed, the database."""
+    device = devices.get(device_id)
+    zone = oldest = None
+    if device:
+        with device.lock:
+            zone = device.readings.zone(zone_id)
+            oldest = zone.oldest() if zone else None
+            # Copy out of the ring buffer; the ingest worker may append meanwhile
+            recent_timestamps, recent_values = (
+                (arr.copy() for arr in zone.window(since=since)) if zone else (None, None))
+    if oldest is not None and oldest <= since:
+        return recent_timestamps, recent_values
+    
+    # The ring buffer doesn't reach back far enough; read the older part
+    # from the database up to where memory takes over.
+    timestamps, values = persistence.query(device_id, zone_id, since=since, until=oldest)
+    if zone is None:
+        return timestamps, values
+    return (np.concatenate((timestamps, recent_timestamps)),
+            np.concatenate((values, recent_values), axis=1))
+
+def zone_window_chunks(device_id, zone_id, since, chunk_size=CHUNK_SIZE):
+    """zone_window() as (timestamps, values) chunks, oldest first.
+    
+    The database part is read a chunk at a time, so memory stays bounded
+    however long the window is.
+    """
+    device = devices.get(device_id)
+    oldest = recent = None
+    if device:
+        with device.lock:
+            zone = device.readings.zone(zone_id)
+            if zone:
+                oldest = zone.oldest()
+                recent = tuple(arr.copy() for arr in zone.window(since=since))
+    if oldest is None or oldest > since:
+        yield from persistence.query_chunks(device_id, zone_id, since=since, until=oldest,
+                                            chunk_size=chunk_size)
+    if recent is not None:
+        timestamps, values = recent
+        for start in range(0, len(timestamps), chunk_size):
+            yield timestamps[start:start + chunk_size], values[:, start:start + chunk_size]
 
 @app.route('/')
 def index():
@@ -44,140 +212,753 @@ def index():
 
 @app.route('/api/sensor-data', methods=['POST'])
 def receive_sensor_data():
-    """Receive sensor data from ESP32."""
+    """Receive sensor data from ESP32.
+    
+    An optional `seq` numbers the upload; one at or below the highest
+    sequence number queued for the device is a duplicate and is not stored
+    again. The response's `ack_seq` is the highest sequence number stored,
+    so it only covers this upload once the ingest worker and the database
+    writer have handled it.
+    """
     try:
-        data = request.json
-        timestamp = datetime.now().isoformat()
+        now = time.time()
+        if is_packed(request.content_type):
+            return _receive_packed(request.get_data(), now, bulk=False)
+        data = decode_document(request.content_type, request.get_data())
+        device_id = data.get('device_id', request.args.get('device_id', DEFAULT_DEVICE))
+        if not isinstance(device_id, str) or not 0 < len(device_id) <= MAX_DEVICE_ID_LENGTH:
+            raise ValueError('invalid device_id')
+        seq = data.get('seq')
+        if seq is not None and (not isinstance(seq, int) or isinstance(seq, bool)
+                                or not 0 <= seq < 2 ** 63):
+            raise ValueError('invalid seq')
+        seqs = None if seq is None else np.array([seq], dtype=np.int64)
         
-        # Store sensor data (only process zone keys, ignore system keys)
+        # Collect zone readings (only process zone keys, ignore system keys)
+        groups = []
         for zone_id_str, zone_data in data.items():
             # Skip non-zone keys like 'pump_running', 'active_zones'
-            if zone_id_str in ['pump_running', 'active_zones']:
+            if zone_id_str in ['pump_running', 'active_zones', 'device_id', 'seq']:
                 continue
             
             try:
                 zone_id = int(zone_id_str)
-            except (ValueError, TypeError):
+            except (ValueError, TypeError, OverflowError):
                 # Skip if zone_id is not a valid integer
                 continue
             
             # Ensure zone_data is a dictionary
             if not isinstance(zone_data, dict):
                 continue
+            # Same bounds as bulk uploads (see ingest.parse_batch)
+            if not 0 <= zone_id < MAX_ZONES:
+                raise ValueError('invalid zone_id')
                 
-            sensor_data[zone_id].append({
-                'timestamp': timestamp,
-                'soil_moisture': zone_data.get('soil_moisture'),
-                'temperature': zone_data.get('temperature'),
-                'humidity': zone_data.get('humidity'),
-                'water_prediction': zone_data.get('water_prediction'),
-                'water_applied': zone_data.get('water_applied', 0)
-            })
-            
-            # Keep only last 1000 readings per zone
-            if len(sensor_data[zone_id]) > 1000:
-                sensor_data[zone_id] = sensor_data[zone_id][-1000:]
+            values = np.array(reading_values(zone_data), dtype=np.float64).reshape(-1, 1)
+            groups.append(ReadingGroup(device_id, zone_id, np.array([now]), values, seqs))
         
-        system_status['online'] = True
-        system_status['last_update'] = timestamp
-        system_status['pump_running'] = data.get('pump_running', False)
-        system_status['active_zones'] = data.get('active_zones', [])
+        status = {
+            'online': True,
+            'last_update': datetime.fromtimestamp(now).isoformat(),
+            'pump_running': data.get('pump_running', False),
+            'active_zones': data.get('active_zones', []),
+        }
+        # The device lock makes the duplicate check and queueing atomic
+        device = devices.get_or_create(device_id)
+        with device.lock:
+            if seq is not None and device.accepted_seq is not None and seq <= device.accepted_seq:
+                return jsonify({'status': 'duplicate', 'ack_seq': device.last_seq}), 200
+            device.reserve_zones(group.zone_id for group in groups)
+            # Storage and WebSocket broadcast happen on the ingest worker
+            ingest_queue.submit(IngestJob(groups, [device_id], {device_id: status}, now,
+                                          len(groups), {device_id: device.seq_epoch}))
+            if seq is not None:
+                device.accepted_seq = seq
+            ack_seq = device.last_seq
         
-        # Emit to connected clients via WebSocket
-        socketio.emit('sensor_update', {
-            'data': data,
-            'timestamp': timestamp,
-            'status': system_status
-        })
-        
-        return jsonify({'status': 'success'}), 200
+        return jsonify({'status': 'success', 'ack_seq': ack_seq}), 200
         
+    except QueueFull as e:
+        return _saturated_response(e)
+    except CapacityExceeded as e:
+        return _capacity_response(e)
+    except UnsupportedEncoding as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 415
     except Exception as e:
         print(f"Error receiving sensor data: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 400
 
+@app.route('/api/sensor-data/batch', methods=['POST'])
+def receive_sensor_batch():
+    """Receive many timestamped readings, e.g. a device's offline backlog.
+    
+    Readings may carry a per-device `seq`; those already queued are
+    reported as duplicates, and `acks` only cover readings once stored (see
+    receive_sensor_data). An object payload may also carry the device's
+    `pump_running` and `active_zones`.
+    """
+    now = time.time()
+    try:
+        if is_packed(request.content_type):
+            return _receive_packed(request.get_data(), now, bulk=True)
+        payload = decode_document(request.content_type, request.get_data())
+        batch = parse_batch(payload, now, DEFAULT_DEVICE)
+    except UnsupportedEncoding as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 415
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    last_update = datetime.fromtimestamp(now).isoformat()
+    statuses = {device_id: {'online': True, 'last_update': last_update}
+                for device_id in batch.device_ids}
+    if isinstance(payload, dict):
+        status = statuses.get(payload.get('device_id', DEFAULT_DEVICE))
+        if status is not None:
+            status.update({key: payload[key] for key in ('pump_running', 'active_zones')
+                           if key in payload})
+    return _enqueue_batch(batch, statuses, now, bulk=True)
+
+def _receive_packed(body, now, bulk):
+    """Queue a packed upload; its header carries the device's pump state."""
+    try:
+        packed = decode_packed(body, now)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    statuses = {}
+    if packed.batch.accepted:
+        statuses[packed.device_id] = {
+            'online': True,
+            'last_update': datetime.fromtimestamp(now).isoformat(),
+            'pump_running': packed.pump_running,
+            'active_zones': packed.active_zones,
+        }
+    return _enqueue_batch(packed.batch, statuses, now, bulk)
+
+def _enqueue_batch(batch, statuses, now, bulk):
+    """Queue a parsed upload, skipping readings already queued, and ack what is stored."""
+    # The device locks make the duplicate check and queueing atomic
+    try:
+        with devices.locked(batch.device_ids) as states:
+            batch = drop_acknowledged(batch, {device_id: state.accepted_seq
+                                              for device_id, state in states.items()})
+            for device_id, state in states.items():
+                state.reserve_zones(group.zone_id for group in batch.groups
+                                    if group.device_id == device_id)
+            if batch.accepted:
+                ingest_queue.submit(IngestJob(batch.groups, batch.device_ids, statuses,
+                                              now, batch.accepted,
+                                              {device_id: state.seq_epoch
+                                               for device_id, state in states.items()}),
+                                    bulk=bulk)
+            for device_id, seq in highest_seqs(batch.groups).items():
+                states[device_id].accepted_seq = seq
+            acks = {device_id: state.last_seq for device_id, state in states.items()}
+    except QueueFull as e:
+        return _saturated_response(e)
+    except CapacityExceeded as e:
+        return _capacity_response(e)
+    
+    rejected = len(batch.results) - batch.accepted - batch.duplicates
+    body = {
+        'status': 'success' if not rejected else ('partial' if batch.accepted else 'error'),
+        'accepted': batch.accepted,
+        'rejected': rejected,
+        'duplicates': batch.duplicates,
+        'results': batch.results,
+        'acks': acks,
+    }
+    if len(acks) == 1:
+        body['ack_seq'], = acks.values()
+    return jsonify(body), 200 if batch.accepted or batch.duplicates or not batch.results else 400
+
+def _saturated_response(error):
+    """503 when the ingest queue is full, 429 when bulk uploads should back off."""
+    response = jsonify({'status': 'error', 'message': str(error)})
+    response.headers['Retry-After'] = '1'
+    return response, 429 if error.bulk else 503
+
+def _capacity_response(error):
+    """507 when shared device state has no room for another device or zone."""
+    return jsonify({'status': 'error', 'message': str(error)}), 507
+
+def apply_ingest(jobs):
+    """Ingest worker: apply queued readings to memory, the database and broadcasts.
+    
+    Each worker only sees devices of its own shard, and holds one device's
+    lock at a time. Sequenced readings are acknowledged once the database
+    has committed them (see acknowledge).
+    """
+    groups = merge_groups([group for job in jobs for group in job.groups])
+    # (seq_epoch, highest seq) of each job's sequenced readings, per device
+    sequenced = {}
+    for job in jobs:
+        for device_id, seq in highest_seqs(job.groups).items():
+            sequenced.setdefault(device_id, []).append(
+                ((job.seq_epochs or {}).get(device_id, 0), seq))
+    try:
+        inference.backfill(groups)
+    except Exception as e:
+        print(f"Error backfilling predictions: {e}")
+    groups_by_device = {}
+    for group in groups:
+        groups_by_device.setdefault(group.device_id, []).append(group)
+    statuses = {}
+    for job in jobs:
+        for device_id, status in job.statuses.items():
+            statuses.setdefault(device_id, {}).update(status)
+    
+    updated_zones, updated_status = {}, {}
+    for device_id in set(groups_by_device) | set(statuses):
+        device_groups = groups_by_device.get(device_id, ())
+        try:
+            device = devices.get_or_create(device_id)
+            with device.lock:
+                device.reserve_zones(group.zone_id for group in device_groups)
+                for group in device_groups:
+                    zone_id = group.zone_id
+                    device.add_many(zone_id, group.timestamps, group.values)
+                    ingest_readings.inc(len(group.timestamps), device_id)
+                    device.zone_configs.setdefault(zone_id, default_zone_config(zone_id))
+                    # Only broadcast groups that brought the zone's newest reading
+                    if group.timestamps[-1] >= device.readings.zone(zone_id).latest():
+                        updated_zones.setdefault(device_id, {})[zone_id] = \
+                            zone_fields(group.values[:, -1])
+                if device_id in statuses:
+                    device.status.update(statuses[device_id])
+                    updated_status[device_id] = dict(device.status)
+                device.version += 1
+        except Exception as e:
+            # Other devices' readings go ahead; this one's are not written to
+            # the database, and the device replays them
+            print(f"Error applying readings of device {device_id}: {e}")
+            groups_by_device.pop(device_id, None)
+            updated_zones.pop(device_id, None)
+            updated_status.pop(device_id, None)
+            if device_id in sequenced:
+                acknowledge(device_id, sequenced[device_id], False)
+    
+    for device_id, device_groups in groups_by_device.items():
+        # The writer reports on the device's last write, and on any earlier
+        # one that failed
+        on_commit = None
+        if device_id in sequenced:
+            on_commit = lambda stored, device_id=device_id: \
+                acknowledge(device_id, sequenced[device_id], stored)
+        for group in device_groups:
+            persistence.write_many(group.device_id, group.zone_id, group.timestamps,
+                                   group.values, group.seqs,
+                                   on_commit=on_commit if group is device_groups[-1] else None)
+    for device_id in set(updated_zones) | set(updated_status):
+        broadcaster.publish(device_id, updated_zones.get(device_id, {}),
+                            updated_status.get(device_id))
+
+def acknowledge(device_id, sequenced, stored):
+    """Acknowledge a device's readings up to the highest seq now stored.
+    
+    `sequenced` holds the (seq_epoch, highest seq) of each job the readings
+    came from. When they could not be stored, later readings may still be,
+    but acknowledging those would skip the lost ones: the device's epoch
+    moves on so they no longer count, and its replay is queued again.
+    """
+    device = devices.get(device_id)
+    if device is None:
+        return
+    with device.lock:
+        current = [seq for epoch, seq in sequenced if epoch == device.seq_epoch]
+        if not current:
+            return
+        if not stored:
+            device.seq_epoch += 1
+            device.accepted_seq = device.last_seq
+        elif device.last_seq is None or max(current) > device.last_seq:
+            device.last_seq = max(current)
+
+# One ingest worker per device shard so devices don't queue behind each other
+ingest_queue = ShardedIngestQueue(apply_ingest,
+                                  shards=int(os.environ.get('INGEST_WORKERS', 4)),
+                                  max_readings=int(os.environ.get('INGEST_QUEUE_READINGS', 50000)))
+ingest_queue.start()
+
+@app.route('/api/predict', methods=['POST'])
+def predict():
+    """Predict water requirements for one reading or a list of readings.
+    
+    Each reading has soil_moisture, temperature, humidity and zone_id, plus
+    either `hour` or a `timestamp` (defaults to now) for the time of day.
+    """
+    if not inference.available:
+        return jsonify({'status': 'error', 'message': inference.error}), 503
+    try:
+        payload = decode_document(request.content_type, request.get_data())
+        single = isinstance(payload, dict)
+        readings = [payload] if single else payload
+        if not isinstance(readings, list) or not readings:
+            raise ValueError('Expected a reading or a non-empty list of readings')
+        features = np.array([_prediction_features(reading) for reading in readings],
+                            dtype=np.float32)
+        predictions = inference.predict(features)
+    except UnsupportedEncoding as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 415
+    except ModelUnavailable as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    except (TypeError, ValueError, KeyError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    values = [round(float(value), 4) for value in predictions]
+    if single:
+        return jsonify({'water_prediction': values[0]})
+    return jsonify({'predictions': values})
+
+def _prediction_features(reading):
+    if not isinstance(reading, dict):
+        raise ValueError('reading must be an object')
+    if 'hour' in reading:
+        hour = float(reading['hour'])
+    else:
+        timestamp = parse_timestamp(reading['timestamp']) if 'timestamp' in reading else time.time()
+        hour = datetime.fromtimestamp(timestamp).hour
+    return [float(reading[name]) for name in FEATURES[:4]] + [hour]
+
+@app.route('/api/predict/metrics', methods=['GET'])
+def get_predict_metrics():
+    """Get inference batching counters and per-device prediction drift."""
+    return jsonify(inference.metrics())
+
+@app.route('/api/ingest/metrics', methods=['GET'])
+def get_ingest_metrics():
+    """Get ingest queue depth, counters and drain latency."""
+    return jsonify(ingest_queue.metrics())
+
+@app.route('/api/cache/metrics', methods=['GET'])
+def get_cache_metrics():
+    """Get response cache size and hit counters."""
+    return jsonify(response_cache.metrics())
+
+metrics.collector('irrigation_stored_readings', 'Readings held in memory per zone')
+metrics.collector('irrigation_stored_bytes', 'Bytes allocated for readings per zone')
+metrics.collector('irrigation_ingest_queue_depth', 'Jobs waiting for an ingest worker')
+metrics.collector('irrigation_ingest_pending_readings', 'Readings queued but not yet applied')
+metrics.collector('irrigation_ingest_events_total', 'Readings accepted, rejected and processed',
+                  'counter')
+metrics.collector('irrigation_response_cache_entries', 'Responses held in the cache')
+metrics.collector('irrigation_response_cache_bytes', 'Bytes held in the response cache')
+metrics.collector('irrigation_response_cache_lookups_total', 'Response cache hits and misses',
+                  'counter')
+
+def collect_metrics():
+    """Scrape-time samples of the stores, ingest queue and response cache."""
+    for device in devices:
+        with device.lock:
+            zones = [(zone_id, len(device.readings.zone(zone_id)),
+                      device.readings.zone(zone_id).nbytes)
+                     for zone_id in device.readings.zone_ids()]
+        for zone_id, readings, nbytes in zones:
+            labels = {'device_id': device.device_id, 'zone_id': str(zone_id)}
+            yield 'irrigation_stored_readings', labels, readings
+            yield 'irrigation_stored_bytes', labels, nbytes
+    
+    queue = ingest_queue.metrics()
+    yield 'irrigation_ingest_queue_depth', {}, queue['queue_depth']
+    yield 'irrigation_ingest_pending_readings', {}, queue['pending_readings']
+    for event in ('accepted', 'rejected', 'processed'):
+        yield 'irrigation_ingest_events_total', {'event': event}, queue[event]
+    
+    cache = response_cache.metrics()
+    yield 'irrigation_response_cache_entries', {}, cache['entries']
+    yield 'irrigation_response_cache_bytes', {}, cache['bytes']
+    for result, key in (('hit', 'hits'), ('miss', 'misses')):
+        yield 'irrigation_response_cache_lookups_total', {'result': result}, cache[key]
+
+metrics.register_collector(collect_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Get every metric in the Prometheus text exposition format."""
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+@app.route('/api/profiler', methods=['GET', 'POST'])
+def control_profiler():
+    """Get the sampling profiler's state, or start, stop or reset it.
+    
+    POST body: {'enabled': bool, 'interval': seconds, 'reset': bool}. Only
+    available when the server runs with PROFILER_ENABLED=true.
+    """
+    if not PROFILER_ENABLED:
+        return jsonify({'status': 'error', 'message': 'Profiler is disabled'}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        interval = data.get('interval')
+        if interval is not None and (not isinstance(interval, (int, float))
+                                     or isinstance(interval, bool)
+                                     or not 0.001 <= interval <= 10):
+            return jsonify({'status': 'error',
+                            'message': 'interval must be between 0.001 and 10 seconds'}), 400
+        if data.get('reset'):
+            profiler.reset()
+        if data.get('enabled') is True:
+            profiler.start(interval)
+        elif data.get('enabled') is False:
+            profiler.stop()
+        elif interval is not None:
+            profiler.interval = interval
+    return jsonify(profiler.status())
+
+@app.route('/api/profiler/stacks', methods=['GET'])
+def get_profiler_stacks():
+    """Get sampled stacks in collapsed form ('frame;frame;... count'), for flame graphs."""
+    if not PROFILER_ENABLED:
+        return jsonify({'status': 'error', 'message': 'Profiler is disabled'}), 403
+    limit = request.args.get('limit', type=int)
+    return Response(profiler.collapsed(limit), content_type='text/plain; charset=utf-8')
+
+def _device_or_404(device_id):
+    device = devices.get(device_id)
+    if device is None:
+        return None, (jsonify({'status': 'error', 'message': 'Device not found'}), 404)
+    return device, None
+
+def cached_response(device_id, build, max_age=None):
+    """Serve build()'s JSON response from the cache while the device's data is unchanged.
+    
+    The key is the path and query plus the device's data version, which
+    ingest and zone updates bump. Responses carry an ETag of their body,
+    so a matching If-None-Match gets a 304. Only 200s are cached, and
+    streamed responses are passed through.
+    """
+    device = devices.get(device_id)
+    # Read before building, so data arriving meanwhile moves past this entry
+    version = device.version if device else None
+    key = (request.path, device_id, version, tuple(sorted(request.args.items(multi=True))))
+    entry = response_cache.get(key, max_age)
+    if entry is None:
+        response = app.make_response(build())
+        if response.status_code != 200 or response.is_streamed:
+            return response
+        headers = tuple((name, value) for name, value in response.headers
+                        if name.startswith('X-'))
+        entry = response_cache.put(key, response.get_data(), headers)
+    else:
+        response = app.response_class(entry.body, mimetype='application/json')
+        response.headers.extend(entry.headers)
+    response.set_etag(entry.etag)
+    return response.make_conditional(request)
+
 @app.route('/api/sensor-data', methods=['GET'])
 def get_sensor_data():
     """Get historical sensor data."""
+    device_id = request.args.get('device_id', DEFAULT_DEVICE)
+    return cached_response(device_id, lambda: _sensor_data(device_id), RESPONSE_CACHE_TTL)
+
+@app.route('/api/devices/<device_id>/sensor-data', methods=['GET'])
+def get_device_sensor_data(device_id):
+    """Get historical sensor data of one device."""
+    if device_id not in devices:
+        return _device_or_404(device_id)[1]
+    return cached_response(device_id, lambda: _sensor_data(device_id), RESPONSE_CACHE_TTL)
+
+def _sensor_data(device_id):
+    """History of one or all zones of a device.
+    
+    With `max_points` (or `resolution`, seconds per point) each zone is
+    downsampled server-side to at most that many points, using time buckets
+    (`downsample=buckets`, the default) or LTTB on `channel`
+    (`downsample=lttb`).
+    
+    Long ranges are answered from rollup tiers: `tier=auto` (the default)
+    picks the coarsest tier that still meets the point budget, `tier=raw`
+    forces raw readings and a tier name (e.g. `1h`) forces that tier. The
+    tier used is reported in the X-Rollup-Tier header.
+    
+    Raw windows of more than CHUNK_SIZE readings, and any response in
+    another `format` (`ndjson` or `columnar`, see export.stream_history),
+    are streamed a chunk at a time and gzip/deflate compressed when
+    Accept-Encoding allows. Streamed responses bypass the response cache
+    and carry no ETag; smaller raw windows are sent in one piece and are
+    cached like the other JSON responses.
+    
+    With `cursor` the response is wrapped as {'cursor', 'reset', 'data'}
+    (plus 'zone_id' for one zone). An empty cursor fetches the window as
+    above, but always from raw readings: the cursor marks what the ring
+    buffers hold, and rollups miss readings the database writer has not
+    flushed yet. The cursor of a previous response returns only readings
+    stored since, raw and omitting zones without any. When those are no
+    longer all in memory, or the server restarted, the full window is sent
+    again with `reset` set.
+    """
     zone_id = request.args.get('zone_id', type=int)
     hours = request.args.get('hours', 24, type=int)
+    max_points = request.args.get('max_points', type=int)
+    resolution = request.args.get('resolution', type=float)
+    method = request.args.get('downsample', 'buckets')
+    channel = request.args.get('channel', 'soil_moisture')
+    tier_name = request.args.get('tier', 'auto')
+    cursor = request.args.get('cursor')
+    fmt = request.args.get('format', 'json')
+    
+    now = time.time()
+    cutoff = now - hours * 3600
+    
+    if resolution is not None:
+        if resolution <= 0:
+            return jsonify({'status': 'error', 'message': 'resolution must be positive'}), 400
+        points = int(np.ceil(hours * 3600 / resolution))
+        max_points = min(max_points, points) if max_points is not None else points
+    if max_points is not None:
+        if max_points < 1:
+            return jsonify({'status': 'error', 'message': 'max_points must be positive'}), 400
+        max_points = min(max_points, MAX_POINTS_LIMIT)
+    if method not in METHODS or channel not in CHANNELS:
+        return jsonify({'status': 'error', 'message': 'Unknown downsample method or channel'}), 400
+    if fmt not in FORMATS:
+        return jsonify({'status': 'error', 'message': f'Unknown format: {fmt}'}), 400
+    if cursor is not None and fmt != 'json':
+        return jsonify({'status': 'error', 'message': 'cursor requires format=json'}), 400
+    
+    if cursor:
+        increment = readings_after(device_id, zone_id, cursor, cutoff)
+        if increment is not None:
+            return jsonify(increment)
+    if cursor is not None:
+        # Taken before reading the window, so nothing stored meanwhile is missed
+        next_cursor = ''
+        device = devices.get(device_id)
+        if device:
+            with device.lock:
+                next_cursor = device.readings.cursor()
+    
+    budget = max_points or DEFAULT_POINT_BUDGET
+    if cursor is not None and tier_name not in ('auto', 'raw'):
+        return jsonify({'status': 'error', 'message': 'cursor requires tier=raw'}), 400
+    if tier_name == 'auto' and cursor is None:
+        tier = select_tier(persistence.tiers, hours * 3600, budget) if persistence.tiers else None
+    elif tier_name in ('auto', 'raw'):
+        tier = None
+    else:
+        tier = tier_named(persistence.tiers, tier_name)
+        if tier is None:
+            return jsonify({'status': 'error', 'message': f'Unknown tier: {tier_name}'}), 400
     
-    cutoff_time = datetime.now() - timedelta(hours=hours)
+    def zone_records(zid):
+        if tier is not None:
+            rollup = persistence.rollups(device_id, zid, tier, cutoff)
+            return rollup_records(rebucket(rollup, cutoff, now, budget))
+        timestamps, values = zone_window(device_id, zid, cutoff)
+        if max_points is None:
+            return records_from_arrays(timestamps, values)
+        return downsample(timestamps, values, cutoff, now, max_points, method, channel)
+    
+    if zone_id is not None:
+        zone_ids = [zone_id]
+    else:
+        device = devices.get(device_id)
+        zone_ids = []
+        if device:
+            with device.lock:
+                zone_ids = sorted(device.zone_ids() if tier else device.readings.zone_ids())
+    
+    if cursor is None and (fmt != 'json' or (tier is None and max_points is None)):
+        def zone_chunks(zid):
+            if tier is not None or max_points is not None:
+                yield zone_records(zid)
+                return
+            for timestamps, values in zone_window_chunks(device_id, zid, cutoff):
+                yield records_from_arrays(timestamps, values)
+        
+        zones = ((zid, zone_chunks(zid)) for zid in zone_ids)
+        if fmt == 'json':
+            zones, records = buffer_history(zones, CHUNK_SIZE)
+            if records is not None:
+                response = jsonify({'zone_id': zone_id, 'data': records[zone_id]}
+                                   if zone_id is not None else records)
+                response.headers['X-Rollup-Tier'] = 'raw'
+                return response
+        body = stream_history(zones, fmt, zone_id)
+        encoding = request.accept_encodings.best_match(ENCODINGS)
+        if encoding:
+            body = compress(body, encoding)
+        response = app.response_class(stream_with_context(body), mimetype=MIMETYPES[fmt])
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['X-Rollup-Tier'] = tier.name if tier else 'raw'
+        return response
     
     if zone_id is not None:
         # Return data for specific zone
-        zone_data = sensor_data.get(zone_id, [])
-        filtered_data = [
-            d for d in zone_data 
-            if datetime.fromisoformat(d['timestamp']) >= cutoff_time
-        ]
-        return jsonify({'zone_id': zone_id, 'data': filtered_data})
+        body = {'zone_id': zone_id, 'data': zone_records(zone_id)}
     else:
         # Return data for all zones
-        all_data = {}
-        for zid in sensor_data.keys():
-            zone_data = sensor_data[zid]
-            filtered_data = [
-                d for d in zone_data 
-                if datetime.fromisoformat(d['timestamp']) >= cutoff_time
-            ]
-            all_data[zid] = filtered_data
-        return jsonify(all_data)
+        body = {zid: zone_records(zid) for zid in zone_ids}
+    if cursor is not None:
+        if zone_id is None:
+            body = {'data': body}
+        body.update(cursor=next_cursor, reset=bool(cursor))
+    response = jsonify(body)
+    response.headers['X-Rollup-Tier'] = tier.name if tier else 'raw'
+    return response
+
+def readings_after(device_id, zone_id, cursor, since):
+    """Readings a device stored after a cursor, or None if the client must reload.
+    
+    Served from the ring buffers under one hold of the device lock, so the
+    returned cursor covers exactly what is returned.
+    """
+    device = devices.get(device_id)
+    if device is None:
+        return None
+    zone_ids = [zone_id] if zone_id is not None else None
+    with device.lock:
+        serial = device.readings.parse_cursor(cursor)
+        if serial is None:
+            return None
+        data = {}
+        for zid in zone_ids if zone_ids is not None else device.readings.zone_ids():
+            zone = device.readings.zone(zid)
+            if zone is None:
+                continue
+            window = zone.after(serial, since)
+            if window is None:
+                return None
+            if len(window[0]):
+                data[zid] = window
+        next_cursor = device.readings.cursor()
+    records = {zid: records_from_arrays(*window) for zid, window in data.items()}
+    if zone_id is not None:
+        return {'zone_id': zone_id, 'data': records.get(zone_id, []),
+                'cursor': next_cursor, 'reset': False}
+    return {'data': records, 'cursor': next_cursor, 'reset': False}
+
+@app.route('/api/devices', methods=['GET'])
+def get_devices():
+    """List known devices with their status."""
+    listing = []
+    for device in devices:
+        with device.lock:
+            listing.append({
+                'device_id': device.device_id,
+                'zones': len(device.zone_ids()),
+                **device.status,
+            })
+    listing.sort(key=lambda entry: entry['device_id'])
+    return jsonify({'devices': listing})
 
 @app.route('/api/zones', methods=['GET'])
 def get_zones():
     """Get zone configurations."""
-    return jsonify(zone_configs)
+    return cached_response(DEFAULT_DEVICE, lambda: _zones(default_device))
+
+@app.route('/api/devices/<device_id>/zones', methods=['GET'])
+def get_device_zones(device_id):
+    """Get zone configurations of one device."""
+    device, error = _device_or_404(device_id)
+    return error or cached_response(device_id, lambda: _zones(device))
+
+def _zones(device):
+    with device.lock:
+        return jsonify(device.zone_configs)
 
 @app.route('/api/zones/<int:zone_id>', methods=['PUT'])
 def update_zone(zone_id):
     """Update zone configuration."""
-    if zone_id not in zone_configs:
-        return jsonify({'status': 'error', 'message': 'Zone not found'}), 404
-    
+    return _update_zone(default_device, zone_id)
+
+@app.route('/api/devices/<device_id>/zones/<int:zone_id>', methods=['PUT'])
+def update_device_zone(device_id, zone_id):
+    """Update zone configuration of one device."""
+    device, error = _device_or_404(device_id)
+    return error or _update_zone(device, zone_id)
+
+def _update_zone(device, zone_id):
     data = request.json
-    zone_configs[zone_id].update(data)
+    try:
+        with device.lock:
+            if zone_id not in device.zone_configs:
+                return jsonify({'status': 'error', 'message': 'Zone not found'}), 404
+            device.zone_configs[zone_id].update(data)
+            config = dict(device.zone_configs[zone_id])
+            device.version += 1
+    except ValueError as e:
+        # Shared state has a fixed amount of room for zone configuration
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     
     # Emit update via WebSocket
     socketio.emit('zone_config_update', {
+        'device_id': device.device_id,
         'zone_id': zone_id,
-        'config': zone_configs[zone_id]
-    })
+        'config': config
+    }, to=device_room(device.device_id))
     
-    return jsonify({'status': 'success', 'config': zone_configs[zone_id]})
+    return jsonify({'status': 'success', 'config': config})
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """Get system status."""
-    return jsonify(system_status)
+    return cached_response(DEFAULT_DEVICE, lambda: _status(default_device))
+
+@app.route('/api/devices/<device_id>/status', methods=['GET'])
+def get_device_status(device_id):
+    """Get status of one device."""
+    device, error = _device_or_404(device_id)
+    return error or cached_response(device_id, lambda: _status(device))
+
+def _status(device):
+    with device.lock:
+        return jsonify(device.status)
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get system statistics."""
+    device_id = request.args.get('device_id', DEFAULT_DEVICE)
+    hours = request.args.get('hours', 24, type=int)
+    return cached_response(device_id, lambda: jsonify(device_stats(device_id, hours, time.time())),
+                           RESPONSE_CACHE_TTL)
+
+@app.route('/api/devices/<device_id>/stats', methods=['GET'])
+def get_device_stats(device_id):
+    """Get statistics of one device."""
+    if device_id not in devices:
+        return _device_or_404(device_id)[1]
     hours = request.args.get('hours', 24, type=int)
-    cutoff_time = datetime.now() - timedelta(hours=hours)
+    return cached_response(device_id, lambda: jsonify(device_stats(device_id, hours, time.time())),
+                           RESPONSE_CACHE_TTL)
+
+def device_stats(device_id, hours, now):
+    """Per-zone summaries of a device's last `hours`, plus its total water applied."""
+    device = devices.get(device_id)
+    zone_ids = []
+    if device:
+        with device.lock:
+            zone_ids = device.zone_ids()
     
     stats = {}
     total_water = 0
     
-    for zone_id in range(4):
-        zone_data = sensor_data.get(zone_id, [])
-        filtered_data = [
-            d for d in zone_data 
-            if datetime.fromisoformat(d['timestamp']) >= cutoff_time
-        ]
+    for zone_id in zone_ids:
+        # Keyed by string so jsonify can sort alongside 'total_water_applied'
+        key = str(zone_id)
+        if device.stats.covers(hours):
+            with device.lock:
+                zone_summary = device.stats.summary(zone_id, hours, now)
+        else:
+            # Uncommon window length: aggregate a rollup tier at about the
+            # same granularity as the rolling stats, or raw readings for
+            # windows shorter than the finest tier allows
+            tier = None
+            if persistence.tiers:
+                tier = select_tier(persistence.tiers, hours * 3600, BUCKETS_PER_WINDOW)
+            if tier is not None:
+                zone_summary = summarize_rollup(
+                    persistence.rollups(device_id, zone_id, tier, now - hours * 3600))
+            else:
+                zone_summary = summarize_window(
+                    zone_window(device_id, zone_id, now - hours * 3600)[1])
         
-        if filtered_data:
-            stats[zone_id] = {
-                'readings': len(filtered_data),
-                'avg_soil_moisture': sum(d['soil_moisture'] for d in filtered_data) / len(filtered_data),
-                'avg_temperature': sum(d['temperature'] for d in filtered_data) / len(filtered_data),
-                'avg_humidity': sum(d['humidity'] for d in filtered_data) / len(filtered_data),
-                'total_water_applied': sum(d.get('water_applied', 0) for d in filtered_data),
-            }
-            total_water += stats[zone_id]['total_water_applied']
+        if zone_summary and zone_summary['readings']:
+            stats[key] = zone_summary
+            total_water += zone_summary['total_water_applied']
         else:
-            stats[zone_id] = {
+            stats[key] = {
                 'readings': 0,
                 'avg_soil_moisture': 0,
                 'avg_temperature': 0,
@@ -186,25 +967,150 @@ def get_stats():
             }
     
     stats['total_water_applied'] = total_water
-    return jsonify(stats)
+    return stats
+
+@app.route('/api/fleet/stats', methods=['GET'])
+def get_fleet_stats():
+    """Get statistics across all devices.
+    
+    Built from each device's rolling aggregates, so the cost grows linearly
+    with the number of devices and zones.
+    """
+    hours = request.args.get('hours', 24, type=int)
+    now = time.time()
+    channels = ('soil_moisture', 'temperature', 'humidity')
+    sums = dict.fromkeys(channels, 0.0)
+    counts = dict.fromkeys(channels, 0)
+    per_device = {}
+    online = readings = zones = 0
+    total_water = 0
+    
+    for device in devices:
+        stats = device_stats(device.device_id, hours, now)
+        device_water = stats.pop('total_water_applied')
+        device_readings = 0
+        for summary in stats.values():
+            device_readings += summary['readings']
+            for name in channels:
+                channel = summary.get('channels', {}).get(name)
+                if channel and channel['count']:
+                    sums[name] += channel['mean'] * channel['count']
+                    counts[name] += channel['count']
+        with device.lock:
+            is_online = bool(device.status['online'])
+            last_update = device.status['last_update']
+        per_device[device.device_id] = {
+            'online': is_online,
+            'last_update': last_update,
+            'zones': len(stats),
+            'readings': device_readings,
+            'total_water_applied': device_water,
+        }
+        online += is_online
+        readings += device_readings
+        zones += len(stats)
+        total_water += device_water
+    
+    return jsonify({
+        'devices': len(per_device),
+        'online': online,
+        'zones': zones,
+        'readings': readings,
+        # Reading-weighted means over every device zone
+        **{f'avg_{name}': sums[name] / counts[name] if counts[name] else 0
+           for name in channels},
+        'total_water_applied': total_water,
+        'per_device': per_device,
+    })
 
 @socketio.on('connect')
 def handle_connect():
     """Handle WebSocket connection."""
-    print('Client connected')
+    socketio_clients.inc()
+    # Until a client subscribes elsewhere it follows the default device
+    join_room(device_room(DEFAULT_DEVICE))
     emit('connected', {'status': 'connected'})
+    _emit_snapshot(DEFAULT_DEVICE)
+
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    """Join a device's room, or only some of its zones' rooms.
+    
+    Payload: {'device_id': ..., 'zone_ids': [...], 'replace': bool}. With
+    'replace' the client first leaves every room it is in.
+    """
+    data = data if isinstance(data, dict) else {}
+    device_id = str(data.get('device_id', DEFAULT_DEVICE))
+    zone_ids = data.get('zone_ids')
+    if data.get('replace'):
+        for room in rooms():
+            if room.startswith('device:'):
+                leave_room(room)
+    
+    if zone_ids is None:
+        join_room(device_room(device_id))
+    else:
+        for zone_id in zone_ids:
+            join_room(zone_room(device_id, zone_id))
+    _emit_snapshot(device_id, zone_ids)
+
+@socketio.on('unsubscribe')
+def handle_unsubscribe(data):
+    """Leave a device's room or some of its zones' rooms."""
+    data = data if isinstance(data, dict) else {}
+    device_id = str(data.get('device_id', DEFAULT_DEVICE))
+    zone_ids = data.get('zone_ids')
+    if zone_ids is None:
+        leave_room(device_room(device_id))
+    else:
+        for zone_id in zone_ids:
+            leave_room(zone_room(device_id, zone_id))
+
+def _emit_snapshot(device_id, zone_ids=None):
+    """Send a new subscriber the last broadcast state; later updates are diffs."""
+    if SHARED_STATE_DIR:
+        zones, status = _stored_snapshot(device_id, zone_ids)
+    else:
+        zones, status = broadcaster.snapshot(device_id, zone_ids)
+    if zones or status:
+        update = {'device_id': device_id, 'timestamp': datetime.now().isoformat(),
+                  'data': zones}
+        if status and zone_ids is None:
+            update['status'] = status
+        emit('sensor_update', update)
+
+def _stored_snapshot(device_id, zone_ids=None):
+    """Latest stored reading of each zone and the status, as broadcast.
+    
+    Other workers broadcast for the device too, so this worker's last
+    broadcast may be out of date.
+    """
+    device = devices.get(device_id)
+    if device is None:
+        return {}, {}
+    wanted = None if zone_ids is None else {str(zone_id) for zone_id in zone_ids}
+    zones = {}
+    with device.lock:
+        for zone_id in device.readings.zone_ids():
+            if wanted is not None and str(zone_id) not in wanted:
+                continue
+            zone = device.readings.zone(zone_id)
+            values = zone.window(since=zone.latest())[1]
+            zones[str(zone_id)] = zone_fields(values[:, -1])
+        status = dict(device.status) if device.status['online'] else {}
+    return zones, status
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle WebSocket disconnection."""
-    print('Client disconnected')
+    socketio_clients.dec()
 
 def simulate_data():
     """Simulate sensor data for demo/testing purposes."""
     import random
     while True:
         time.sleep(30)  # Simulate data every 30 seconds
-        if not system_status['online']:  # Only if no real device connected
+        if not default_device.status['online']:  # Only if no real device connected
             simulated_data = {}
             for zone_id in range(4):
                 simulated_data[str(zone_id)] = {
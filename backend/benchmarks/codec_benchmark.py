@@ -0,0 +1,80 @@
+"""
+Compare ingest encodings: bytes on the wire and decode time per reading.
+
+Usage (from the backend directory):
+    python benchmarks/codec_benchmark.py --readings 1000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codec import PACKED_TYPE, decode_document, decode_packed, encode_packed, msgpack
+from devices import DEFAULT_DEVICE
+from ingest import parse_batch
+from storage import CHANNELS
+
+
+def make_readings(n):
+    """Random readings for 4 zones, one minute apart."""
+    start = time.time() - n * 60
+    readings = []
+    for i in range(n):
+        readings.append({
+            'zone_id': i % 4,
+            'timestamp': round(start + i * 60, 3),
+            'soil_moisture': round(random.uniform(30, 75), 1),
+            'temperature': round(random.uniform(18, 28), 1),
+            'humidity': round(random.uniform(45, 85), 1),
+            'water_prediction': round(random.uniform(0, 50), 1),
+            'water_applied': 0,
+        })
+    return readings
+
+
+def time_per_reading(decode, body, n, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decode(body)
+        best = min(best, time.perf_counter() - start)
+    return best / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--readings', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    readings = make_readings(args.readings)
+    now = time.time()
+    document = {'device_id': DEFAULT_DEVICE, 'readings': readings}
+
+    encodings = [('json', 'application/json', json.dumps(document).encode())]
+    if msgpack is not None:
+        encodings.append(('msgpack', 'application/msgpack', msgpack.packb(document)))
+    packed = encode_packed(DEFAULT_DEVICE, [
+        (r['zone_id'], r['timestamp'], [r[name] for name in CHANNELS]) for r in readings])
+    encodings.append(('packed', PACKED_TYPE, packed))
+
+    print(f"{'encoding':<10}{'bytes/reading':>16}{'decode us/reading':>20}")
+    for name, content_type, body in encodings:
+        if content_type == PACKED_TYPE:
+            decode = lambda b: decode_packed(b, now)
+        else:
+            decode = lambda b, ct=content_type: parse_batch(
+                decode_document(ct, b), now, DEFAULT_DEVICE)
+        per_reading = time_per_reading(decode, body, args.readings, args.repeat)
+        print(f'{name:<10}{len(body) / args.readings:>16.1f}{per_reading:>20.2f}')
+    if msgpack is None:
+        print('(install msgpack to include MessagePack)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+Benchmark the ingest and query handlers against a JSON baseline.
+
+Drives POST /api/sensor-data, GET /api/sensor-data and GET /api/stats
+through Flask's test client at several history sizes, zone counts and
+window lengths, and measures memory per stored reading. Queries are
+timed with the response cache cleared first, so they measure the handler;
+get_sensor_data_cached repeats get_sensor_data with the cache in place
+(windows streamed in chunks are never cached). Given --baseline, any
+result more than --threshold slower (or larger) than the baseline fails
+the run with exit status 1. Timings depend on the machine, so compare
+only against a baseline recorded on the machine running the benchmark.
+
+Usage (from the backend directory):
+    python benchmarks/hot_paths.py                                # print results only
+    python benchmarks/hot_paths.py --save-baseline baseline.json  # record this machine's
+    python benchmarks/hot_paths.py --baseline baseline.json       # compare against it
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+HISTORY_SIZES = (1000, 10000, 50000)
+ZONE_COUNTS = (4, 16)
+WINDOW_HOURS = (1, 24, 168)
+# Not one of the rolling windows, so /api/stats aggregates raw readings
+UNCOVERED_HOURS = 6
+HISTORY_SPAN = 168 * 3600
+
+# Handlers are measured in memory: no database, broadcasts or model, and
+# ring buffers large enough to hold the biggest history
+os.environ.setdefault('DATABASE_URL', 'none')
+os.environ.setdefault('NUMPY_MODEL_PATH', '')
+os.environ.setdefault('MODEL_PATH', '')
+os.environ['SENSOR_BUFFER_CAPACITY'] = str(max(HISTORY_SIZES))
+
+import numpy as np
+
+import app as backend
+from devices import DeviceState
+from storage import CHANNELS
+
+
+def random_values(rng, n):
+    """Channel values of shape (len(CHANNELS), n)."""
+    values = np.empty((len(CHANNELS), n))
+    values[0] = rng.uniform(30, 75, n)
+    values[1] = rng.uniform(18, 28, n)
+    values[2] = rng.uniform(45, 85, n)
+    values[3] = rng.uniform(0, 50, n)
+    values[4] = np.where(rng.random(n) < 0.1, values[3], 0.0)
+    return values
+
+
+def fill_device(state, zones, readings, now, rng):
+    """Spread `readings` per zone evenly over the last HISTORY_SPAN seconds."""
+    timestamps = np.linspace(now - HISTORY_SPAN, now, readings)
+    with state.lock:
+        for zone_id in range(zones):
+            state.add_many(zone_id, timestamps, random_values(rng, readings))
+
+
+def measure(call, number, repeat):
+    """Median and best seconds per call over `repeat` rounds of `number` calls."""
+    call()  # warm up, e.g. first-request setup
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        rounds.append((time.perf_counter() - start) / number)
+    return statistics.median(rounds), min(rounds)
+
+
+def timed_get(client, url, cached=False):
+    """A GET of `url`; unless `cached`, built anew each call rather than a cache hit."""
+    def call():
+        if not cached:
+            backend.response_cache.clear()
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f'GET {url}: {response.status_code}')
+        # Streamed responses are only built as their body is read
+        response.get_data()
+    return call
+
+
+def bench_queries(client, args, rng):
+    results = {}
+    now = time.time()
+    for history in args.history:
+        for zones in args.zones:
+            device_id = f'bench-{history}-{zones}'
+            fill_device(backend.devices.get_or_create(device_id), zones, history, now, rng)
+            for hours in args.hours:
+                params = f'[history={history},zones={zones},hours={hours}]'
+                base = f'device_id={device_id}&hours={hours}'
+                cases = {
+                    'get_sensor_data': f'/api/sensor-data?{base}&tier=raw',
+                    'get_sensor_data_downsampled':
+                        f'/api/sensor-data?{base}&tier=raw&max_points=200',
+                    'get_stats': f'/api/stats?{base}',
+                }
+                for name, url in cases.items():
+                    results[name + params] = measure(timed_get(client, url),
+                                                     args.number, args.repeat)
+                results['get_sensor_data_cached' + params] = measure(
+                    timed_get(client, cases['get_sensor_data'], cached=True),
+                    args.number, args.repeat)
+            params = f'[history={history},zones={zones},hours={UNCOVERED_HOURS}]'
+            url = f'/api/stats?device_id={device_id}&hours={UNCOVERED_HOURS}'
+            results['get_stats' + params] = measure(timed_get(client, url),
+                                                    args.number, args.repeat)
+    return results
+
+
+def bench_ingest(client, args, rng):
+    results = {}
+    for zones in args.zones:
+        device_id = f'bench-post-{zones}'
+        payloads = []
+        for _ in range(args.number):
+            values = random_values(rng, zones)
+            payload = {'device_id': device_id}
+            for zone_id in range(zones):
+                payload[str(zone_id)] = dict(zip(CHANNELS, values[:, zone_id].round(1).tolist()))
+            payloads.append(payload)
+
+        rounds = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for payload in payloads:
+                response = client.post('/api/sensor-data', json=payload)
+                if response.status_code != 200:
+                    raise RuntimeError(f'POST /api/sensor-data: {response.status_code}')
+            rounds.append((time.perf_counter() - start) / len(payloads))
+            # Let the ingest workers drain between rounds so the queue never fills
+            backend.ingest_queue.join()
+        results[f'receive_sensor_data[zones={zones}]'] = (statistics.median(rounds),
+                                                          min(rounds))
+    return results
+
+
+def bench_memory(args, rng):
+    """Bytes allocated per stored reading by a device's buffers and rolling stats."""
+    results = {}
+    now = time.time()
+    for history in args.history:
+        zones = max(args.zones)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        state = DeviceState('memory', capacity=history,
+                            windows_hours=backend.devices.windows_hours)
+        fill_device(state, zones, history, now, rng)
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        results[f'memory_per_reading[history={history},zones={zones}]'] = \
+            used / (history * zones)
+    return results
+
+
+def change(result, previous):
+    """Relative change over the baseline.
+
+    Timings are compared by their best round, the one least disturbed by
+    other load on the machine.
+    """
+    key = 'best' if 'best' in result and 'best' in previous else 'value'
+    return result[key] / previous[key] - 1
+
+
+def compare(current, baseline, threshold):
+    """Names of results more than `threshold` (a fraction) above the baseline."""
+    regressions = []
+    for name, result in current.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if change(result, previous) > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--history', type=int, nargs='+', default=list(HISTORY_SIZES),
+                        help='readings per zone')
+    parser.add_argument('--zones', type=int, nargs='+', default=list(ZONE_COUNTS))
+    parser.add_argument('--hours', type=int, nargs='+', default=list(WINDOW_HOURS),
+                        help='query window lengths')
+    parser.add_argument('--number', type=int, default=20, help='calls per round')
+    parser.add_argument('--repeat', type=int, default=5, help='rounds per benchmark')
+    parser.add_argument('--baseline', metavar='PATH',
+                        help='compare against the baseline in this JSON file')
+    parser.add_argument('--save-baseline', metavar='PATH',
+                        help='write the results to this JSON file as a new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown over the baseline, as a fraction')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args()
+    if max(args.history) > max(HISTORY_SIZES):
+        parser.error(f'--history is limited to {max(HISTORY_SIZES)} readings per zone')
+    if args.baseline and not os.path.exists(args.baseline):
+        parser.error(f'no baseline at {args.baseline}; record one with --save-baseline')
+
+    rng = np.random.default_rng(0)
+    client = backend.app.test_client()
+    timings = {**bench_ingest(client, args, rng), **bench_queries(client, args, rng)}
+    results = {name: {'value': median * 1e6, 'best': best * 1e6, 'unit': 'us'}
+               for name, (median, best) in timings.items()}
+    results.update({name: {'value': size, 'unit': 'bytes'}
+                    for name, size in bench_memory(args, rng).items()})
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    width = max(len(name) for name in results)
+    print(f"{'benchmark':<{width}} {'value':>12} {'baseline':>12} {'change':>8}")
+    for name, result in results.items():
+        line = f"{name:<{width}} {result['value']:>9.1f} {result['unit']:<2}"
+        previous = baseline.get(name)
+        if previous:
+            line += (f" {previous['value']:>9.1f} {previous['unit']:<2}"
+                     f" {change(result, previous):>+8.1%}")
+        print(line)
+
+    document = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f'Baseline saved to {args.save_baseline}')
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f'\n{len(regressions)} regression(s) beyond {args.threshold:.0%}:')
+        for name in regressions:
+            print(f'  {name}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Coalesced WebSocket broadcasting of sensor updates.
+Updates are buffered and sent once per tick, containing only the fields
+that changed since the previous tick, to per-device and per-zone rooms.
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from storage import CHANNELS, OUTPUT_DECIMALS
+
+DEFAULT_TICK = 0.25
+# Devices silent for this long are forgotten; their next update is sent whole
+DEFAULT_IDLE_SECONDS = 3600
+
+
+def device_room(device_id: str) -> str:
+    return f'device:{device_id}'
+
+
+def zone_room(device_id: str, zone_id) -> str:
+    return f'device:{device_id}:zone:{zone_id}'
+
+
+def zone_fields(values: Iterable[float]) -> Dict:
+    """JSON-ready channel values for one reading."""
+    return {name: (None if value != value else round(float(value), OUTPUT_DECIMALS))
+            for name, value in zip(CHANNELS, values)}
+
+
+def _changes(previous: Dict, current: Dict) -> Dict:
+    return {key: value for key, value in current.items()
+            if key not in previous or previous[key] != value}
+
+
+class Broadcaster:
+    """Coalesces per-device updates and emits field-level diffs each tick.
+
+    Every subscriber of `device:<id>` receives the device's changed zones
+    and status; subscribers of `device:<id>:zone:<n>` receive only that
+    zone's changed fields. With an `emit_seconds` histogram, the time each
+    emit takes is observed under its event name.
+
+    Without `diffs`, updated zones are sent with all their latest fields:
+    when several workers broadcast for the same device, what one of them
+    sent last is not what clients last received.
+
+    What was sent is kept per device, for diffs and snapshots, until the
+    device has had no update for `idle_seconds`.
+    """
+
+    def __init__(self, socketio, tick: float = DEFAULT_TICK, emit_seconds=None,
+                 diffs: bool = True, idle_seconds: float = DEFAULT_IDLE_SECONDS):
+        self.socketio = socketio
+        self.tick = tick
+        self.emit_seconds = emit_seconds
+        self.diffs = diffs
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._pending_zones: Dict[str, Dict[str, Dict]] = {}
+        self._pending_status: Dict[str, Dict] = {}
+        self._sent_zones: Dict[str, Dict[str, Dict]] = {}
+        self._sent_status: Dict[str, Dict] = {}
+        self._last_update: Dict[str, float] = {}
+        self._started = False
+
+    def publish(self, device_id: str, zones: Dict[str, Dict],
+                status: Optional[Dict] = None):
+        """Queue the latest zone fields (and optionally status) for a device."""
+        with self._lock:
+            pending = self._pending_zones.setdefault(device_id, {})
+            for zone_id, fields in zones.items():
+                pending.setdefault(str(zone_id), {}).update(fields)
+            if status is not None:
+                self._pending_status[device_id] = dict(status)
+
+    def start(self):
+        """Start the background tick loop once."""
+        if not self._started:
+            self._started = True
+            self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.tick)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error broadcasting sensor updates: {e}")
+
+    def flush(self):
+        """Emit everything that changed since the last flush."""
+        timestamp = datetime.now().isoformat()
+        now = time.monotonic()
+        updates = []
+        with self._lock:
+            zones, self._pending_zones = self._pending_zones, {}
+            statuses, self._pending_status = self._pending_status, {}
+            for device_id, last_update in list(self._last_update.items()):
+                if now - last_update > self.idle_seconds and device_id not in zones \
+                        and device_id not in statuses:
+                    del self._last_update[device_id]
+                    self._sent_zones.pop(device_id, None)
+                    self._sent_status.pop(device_id, None)
+            for device_id in set(zones) | set(statuses):
+                self._last_update[device_id] = now
+                sent_zones = self._sent_zones.setdefault(device_id, {})
+                changed = {}
+                for zone_id, fields in zones.get(device_id, {}).items():
+                    diff = _changes(sent_zones.get(zone_id, {}), fields) if self.diffs else fields
+                    if diff:
+                        changed[zone_id] = diff
+                        sent_zones.setdefault(zone_id, {}).update(diff)
+
+                status = statuses.get(device_id)
+                if status is not None and self.diffs:
+                    status = _changes(self._sent_status.get(device_id, {}), status)
+                if status is not None:
+                    self._sent_status.setdefault(device_id, {}).update(status)
+                if changed or status:
+                    updates.append((device_id, changed, status))
+
+        for device_id, changed, status in updates:
+            update = {'device_id': device_id, 'timestamp': timestamp, 'data': changed}
+            if status:
+                update['status'] = status
+            self._emit('sensor_update', update, device_room(device_id))
+            for zone_id, diff in changed.items():
+                self._emit('sensor_update', {
+                    'device_id': device_id,
+                    'timestamp': timestamp,
+                    'data': {zone_id: diff},
+                }, zone_room(device_id, zone_id))
+
+    def _emit(self, event: str, payload: Dict, room: str):
+        if self.emit_seconds is None:
+            self.socketio.emit(event, payload, to=room)
+            return
+        start = time.perf_counter()
+        self.socketio.emit(event, payload, to=room)
+        self.emit_seconds.observe(time.perf_counter() - start, event)
+
+    def snapshot(self, device_id: str,
+                 zone_ids: Optional[Iterable] = None) -> Tuple[Dict, Dict]:
+        """Last broadcast state, so new subscribers can render before the next diff."""
+        with self._lock:
+            zones = self._sent_zones.get(device_id, {})
+            if zone_ids is not None:
+                wanted = {str(zone_id) for zone_id in zone_ids}
+                zones = {zone: fields for zone, fields in zones.items() if zone in wanted}
+            return ({zone: dict(fields) for zone, fields in zones.items()},
+                    dict(self._sent_status.get(device_id, {})))
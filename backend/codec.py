@@ -0,0 +1,120 @@
+"""
+Request body decoding for sensor-data uploads.
+Besides JSON, devices may send MessagePack or a packed little-endian record
+format that is decoded with a single np.frombuffer call.
+"""
+
+import json
+import struct
+from typing import Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:  # optional, only needed for application/msgpack bodies
+    msgpack = None
+
+from ingest import (MAX_BATCH_READINGS, MAX_DEVICE_ID_LENGTH, ParsedBatch,
+                    group_readings)
+from storage import CHANNELS
+
+JSON_TYPE = 'application/json'
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack')
+PACKED_TYPE = 'application/x-irrigation-packed'
+
+# Packed layout: a 16-byte header, the device ID (UTF-8), then fixed-size
+# records. A record timestamp of 0 means "stamp with the server time".
+PACKED_MAGIC = b'IRRG'
+PACKED_VERSION = 1
+PACKED_HEADER = struct.Struct('<4sBBBxII')  # magic, version, flags, id length, count, active-zone mask
+PACKED_RECORD = np.dtype([
+    ('zone_id', '<u2'),
+    ('timestamp', '<f8'),
+    ('values', '<f4', (len(CHANNELS),)),
+])
+FLAG_PUMP_RUNNING = 0x01
+
+
+class UnsupportedEncoding(ValueError):
+    """The request body's Content-Type cannot be decoded."""
+
+
+class PackedPayload:
+    """Decoded packed upload: validated readings plus the header's status bits."""
+
+    def __init__(self, batch: ParsedBatch, device_id: str, pump_running: bool,
+                 active_zones: Sequence[int]):
+        self.batch = batch
+        self.device_id = device_id
+        self.pump_running = pump_running
+        self.active_zones = list(active_zones)
+
+
+def media_type(content_type: Optional[str]) -> str:
+    """Lower-cased media type without parameters such as charset."""
+    return (content_type or JSON_TYPE).split(';', 1)[0].strip().lower()
+
+
+def is_packed(content_type: Optional[str]) -> bool:
+    return media_type(content_type) == PACKED_TYPE
+
+
+def decode_document(content_type: Optional[str], body: bytes):
+    """Decode a JSON or MessagePack body into Python objects."""
+    kind = media_type(content_type)
+    if kind in MSGPACK_TYPES:
+        if msgpack is None:
+            raise UnsupportedEncoding('MessagePack support is not installed')
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    if kind == JSON_TYPE or kind.endswith('+json'):
+        return json.loads(body)
+    raise UnsupportedEncoding(f'Unsupported Content-Type: {kind}')
+
+
+def decode_packed(body: bytes, now: float) -> PackedPayload:
+    """Decode a packed upload straight into timestamp/value arrays."""
+    if len(body) < PACKED_HEADER.size:
+        raise ValueError('Packed body is shorter than its header')
+    magic, version, flags, id_length, count, zone_mask = PACKED_HEADER.unpack_from(body)
+    if magic != PACKED_MAGIC or version != PACKED_VERSION:
+        raise ValueError('Not a packed irrigation payload')
+    if count > MAX_BATCH_READINGS:
+        raise ValueError(f'At most {MAX_BATCH_READINGS} readings per batch')
+
+    offset = PACKED_HEADER.size + id_length
+    if len(body) != offset + count * PACKED_RECORD.itemsize:
+        raise ValueError('Packed body length does not match its record count')
+    device_id = body[PACKED_HEADER.size:offset].decode('utf-8')
+    if not 0 < len(device_id) <= MAX_DEVICE_ID_LENGTH:
+        raise ValueError('invalid device_id')
+
+    records = np.frombuffer(body, dtype=PACKED_RECORD, count=count, offset=offset)
+    timestamps = records['timestamp'].astype(np.float64)
+    timestamps[timestamps == 0] = now
+    values = records['values'].copy()
+    # Same default as reading_values(): no water_applied means none applied
+    values[np.isnan(values[:, -1]), -1] = 0
+    batch = group_readings(np.full(count, device_id, dtype=object),
+                           records['zone_id'].astype(np.int64), timestamps,
+                           values, {}, now)
+    active_zones = [zone for zone in range(32) if zone_mask & (1 << zone)]
+    return PackedPayload(batch, device_id, bool(flags & FLAG_PUMP_RUNNING), active_zones)
+
+
+def encode_packed(device_id: str,
+                  readings: Iterable[Tuple[int, float, Sequence[float]]],
+                  pump_running: bool = False,
+                  active_zones: Sequence[int] = ()) -> bytes:
+    """Encode (zone_id, timestamp, values) readings in the packed format."""
+    records = np.array([(zone_id, timestamp, values)
+                        for zone_id, timestamp, values in readings],
+                       dtype=PACKED_RECORD)
+    device = device_id.encode('utf-8')
+    zone_mask = 0
+    for zone in active_zones:
+        zone_mask |= 1 << zone
+    header = PACKED_HEADER.pack(PACKED_MAGIC, PACKED_VERSION,
+                                FLAG_PUMP_RUNNING if pump_running else 0,
+                                len(device), len(records), zone_mask)
+    return header + device + records.tobytes()
@@ -0,0 +1,152 @@
+"""
+Per-device state for the controllers reporting to the backend.
+Devices are spread over independently locked shards so that ingest and
+queries for different controllers don't contend on shared structures.
+"""
+
+import threading
+import zlib
+from contextlib import ExitStack, contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from aggregates import DEFAULT_WINDOWS_HOURS, StatsAggregator
+from storage import DEFAULT_CAPACITY, SensorStore
+
+# Readings posted without a device ID belong to the original single controller
+DEFAULT_DEVICE = 'default'
+DEFAULT_SHARDS = 16
+
+
+class CapacityExceeded(ValueError):
+    """No room is left for another device or zone (see shared_state.py)."""
+
+
+def shard_of(device_id: str, shards: int) -> int:
+    """Stable shard index for a device (the same in every process)."""
+    return zlib.crc32(device_id.encode('utf-8')) % shards
+
+
+def initial_status() -> Dict:
+    """Status of a device that has not reported yet."""
+    return {
+        'online': False,
+        'last_update': None,
+        'pump_running': False,
+        'active_zones': []
+    }
+
+
+class DeviceState:
+    """Readings, rolling stats, zone configuration and status of one device.
+
+    Callers hold `lock` while reading or mutating any of the attributes.
+    """
+
+    def __init__(self, device_id: str, capacity: int = DEFAULT_CAPACITY,
+                 windows_hours: Sequence[float] = DEFAULT_WINDOWS_HOURS,
+                 zone_configs: Optional[Dict[int, Dict]] = None):
+        self.device_id = device_id
+        self.lock = threading.RLock()
+        self.readings = SensorStore(capacity)
+        self.stats = StatsAggregator(windows_hours)
+        self.zone_configs: Dict[int, Dict] = zone_configs or {}
+        self.status = initial_status()
+        # Highest sequence number applied and written to the database, the
+        # one acknowledged to the device (see ingest.py)
+        self.last_seq: Optional[int] = None
+        # Highest sequence number queued; uploads at or below it are
+        # duplicates. seq_epoch moves on when queued readings could not be
+        # stored, so readings queued before that no longer advance last_seq.
+        self.accepted_seq: Optional[int] = None
+        self.seq_epoch = 0
+        # Bumped whenever readings, status or zone configs change, so cached
+        # responses built from older data are no longer looked up
+        self.version = 0
+
+    def add(self, zone_id: int, timestamp: float, values: Tuple[float, ...]):
+        """Record one reading for a zone."""
+        self.readings.append(zone_id, timestamp, values)
+        self.stats.add(zone_id, timestamp, values)
+
+    def add_many(self, zone_id: int, timestamps: np.ndarray, values: np.ndarray):
+        """Record a timestamp-sorted run of readings for a zone."""
+        self.readings.extend(zone_id, timestamps, values)
+        self.stats.add_many(zone_id, timestamps, values)
+
+    def reserve_zones(self, zone_ids: Iterable[int]):
+        """Make room for readings of these zones before they are queued.
+
+        Called holding `lock`. In memory every valid zone fits, so this is a
+        no-op; shared state raises CapacityExceeded when the zones don't fit.
+        """
+
+    def zone_ids(self) -> List[int]:
+        """Configured zones plus any zone that has reported readings."""
+        return sorted(set(self.zone_configs) | set(self.readings.zone_ids()))
+
+
+class _Shard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices: Dict[str, DeviceState] = {}
+
+
+class DeviceRegistry:
+    """Sharded device ID to DeviceState mapping, creating entries on first use.
+
+    A shard lock only guards membership; per-device work happens under the
+    device's own lock.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY,
+                 windows_hours: Sequence[float] = DEFAULT_WINDOWS_HOURS,
+                 shards: int = DEFAULT_SHARDS):
+        self.capacity = capacity
+        self.windows_hours = tuple(windows_hours)
+        self.shards = shards
+        self._shards = [_Shard() for _ in range(shards)]
+
+    def shard_of(self, device_id: str) -> int:
+        return shard_of(device_id, self.shards)
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._shards[self.shard_of(device_id)].devices
+
+    def __len__(self) -> int:
+        return sum(len(shard.devices) for shard in self._shards)
+
+    def __iter__(self) -> Iterator[DeviceState]:
+        for shard in self._shards:
+            with shard.lock:
+                states = list(shard.devices.values())
+            yield from states
+
+    def get(self, device_id: str) -> Optional[DeviceState]:
+        return self._shards[self.shard_of(device_id)].devices.get(device_id)
+
+    def get_or_create(self, device_id: str,
+                      zone_configs: Optional[Dict[int, Dict]] = None) -> DeviceState:
+        shard = self._shards[self.shard_of(device_id)]
+        state = shard.devices.get(device_id)
+        if state is None:
+            with shard.lock:
+                state = shard.devices.get(device_id)
+                if state is None:
+                    state = shard.devices[device_id] = DeviceState(
+                        device_id, self.capacity, self.windows_hours, zone_configs)
+        return state
+
+    def device_ids(self) -> List[str]:
+        return [state.device_id for state in self]
+
+    @contextmanager
+    def locked(self, device_ids: Sequence[str]) -> Iterator[Dict[str, DeviceState]]:
+        """Hold the locks of several devices, created if needed, taken in a fixed order."""
+        with ExitStack() as stack:
+            states = {}
+            for device_id in sorted(set(device_ids)):
+                states[device_id] = state = self.get_or_create(device_id)
+                stack.enter_context(state.lock)
+            yield states
@@ -0,0 +1,107 @@
+"""
+Downsampling of sensor history for charts.
+Bounds the number of points returned per zone by the requested resolution
+instead of by how much history is retained.
+"""
+
+from typing import Dict, List
+
+import numpy as np
+
+from storage import CHANNEL_INDEX, CHANNELS, records_from_arrays
+
+METHODS = ('buckets', 'lttb')
+MAX_POINTS_LIMIT = 5000
+
+
+def bucket_stats(timestamps: np.ndarray, values: np.ndarray, start: float,
+                 end: float, max_points: int):
+    """Per-channel count, mean, min and max over equal-width time buckets.
+
+    Buckets tile [start, end] so every zone of a query shares the same bucket
+    timestamps; empty buckets are left out. `timestamps` must be sorted.
+    Returns (bucket_starts, readings, mean, minimum, maximum), the stats
+    shaped (len(CHANNELS), buckets).
+    """
+    width = max(end - start, 1e-9) / max_points
+    index = np.clip(((timestamps - start) // width).astype(np.int64), 0, max_points - 1)
+    # Sorted timestamps make every bucket a contiguous run
+    runs = np.flatnonzero(np.r_[True, np.diff(index) != 0])
+
+    finite = ~np.isnan(values)
+    counts = np.add.reduceat(finite, runs, axis=1)
+    sums = np.add.reduceat(np.where(finite, values, 0), runs, axis=1, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / counts
+    minimum = np.fmin.reduceat(values, runs, axis=1)
+    maximum = np.fmax.reduceat(values, runs, axis=1)
+    readings = np.diff(np.r_[runs, len(timestamps)])
+    return start + index[runs] * width, readings, mean, minimum, maximum
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Indices picked by Largest-Triangle-Three-Buckets decimation.
+
+    Keeps the first and last points and, from each of `threshold - 2`
+    buckets in between, the point forming the largest triangle with the
+    previously kept point and the next bucket's average. A threshold of 1
+    keeps only the last point.
+    """
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1][-threshold:], dtype=np.int64)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    # Next-bucket averages don't depend on earlier picks, so compute them at once
+    next_edges = np.r_[edges[1:], n]
+    lengths = next_edges - edges
+    avg_x = np.add.reduceat(x, edges) / lengths
+    avg_y = np.add.reduceat(y, edges) / lengths
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((x[a] - avg_x[i + 1]) * (y[lo:hi] - y[a])
+                      - (x[a] - x[lo:hi]) * (avg_y[i + 1] - y[a]))
+        a = lo + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def downsample(timestamps: np.ndarray, values: np.ndarray, start: float, end: float,
+               max_points: int, method: str = 'buckets',
+               channel: str = 'soil_moisture') -> List[Dict]:
+    """JSON-ready readings for a zone, at most `max_points` of them.
+
+    'buckets' returns one record per time bucket with channel averages plus
+    'readings', 'min' and 'max'; 'lttb' returns the original readings that
+    best preserve the shape of `channel`. Zones with no more than
+    `max_points` readings are returned as is.
+    """
+    if len(timestamps) <= max_points:
+        return records_from_arrays(timestamps, values)
+
+    if method == 'lttb':
+        y = values[CHANNEL_INDEX[channel]].astype(np.float64)
+        valid = np.flatnonzero(~np.isnan(y))
+        keep = valid[lttb_indices(timestamps[valid], y[valid], max_points)]
+        return records_from_arrays(timestamps[keep], values[:, keep])
+
+    return bucket_records(*bucket_stats(timestamps, values, start, end, max_points))
+
+
+def bucket_records(bucket_starts: np.ndarray, readings: np.ndarray, mean: np.ndarray,
+                   minimum: np.ndarray, maximum: np.ndarray) -> List[Dict]:
+    """JSON-ready records for time buckets: channel means plus 'readings', 'min' and 'max'."""
+    records = records_from_arrays(bucket_starts, mean)
+    minimums = records_from_arrays(bucket_starts, minimum)
+    maximums = records_from_arrays(bucket_starts, maximum)
+    for record, count, low, high in zip(records, readings.tolist(), minimums, maximums):
+        record['readings'] = count
+        record['min'] = {name: low[name] for name in CHANNELS}
+        record['max'] = {name: high[name] for name in CHANNELS}
+    return records
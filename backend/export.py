@@ -0,0 +1,119 @@
+"""
+Streaming serialization of history responses.
+Readings are encoded and optionally compressed a chunk at a time, so a long
+export never exists as one string in memory and the first bytes go out as
+soon as the first chunk has been read.
+"""
+
+import itertools
+import json
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional, faster encoding
+    orjson = None
+
+FORMATS = ('json', 'ndjson', 'columnar')
+MIMETYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'columnar': 'application/json',
+}
+ENCODINGS = ('gzip', 'deflate')
+# Readings serialized at a time; bounds the memory a request holds
+CHUNK_SIZE = 5000
+# Compressed output is flushed to the client at least this often
+FLUSH_BYTES = 64 * 1024
+
+ZoneChunks = Iterable[Tuple[int, Iterable[List[Dict]]]]
+
+
+def dumps(obj) -> bytes:
+    """Compact JSON bytes; NaN is not expected (records carry None)."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+def _columns(records: List[Dict]) -> Dict[str, List]:
+    return {key: [record[key] for record in records] for key in records[0]}
+
+
+def stream_history(zones: ZoneChunks, fmt: str,
+                   zone_id: Optional[int] = None) -> Iterator[bytes]:
+    """Encode (zone_id, record chunks) pairs as `fmt`.
+
+    json has the shape of the buffered response, {zone: [record, ...]} or,
+    for a single `zone_id`, {'zone_id': n, 'data': [...]}. columnar has the
+    same outer shape, but each zone holds a list of blocks mapping every
+    field to an array of up to CHUNK_SIZE values. ndjson is one record per
+    line with its zone_id added.
+    """
+    if fmt == 'ndjson':
+        for zid, chunks in zones:
+            for records in chunks:
+                if records:
+                    yield b''.join(dumps({'zone_id': zid, **record}) + b'\n'
+                                   for record in records)
+        return
+
+    opened = False
+    for zid, chunks in zones:
+        if zone_id is not None:
+            yield b'{"zone_id":' + dumps(zid) + b',"data":['
+        else:
+            yield (b',' if opened else b'{') + dumps(str(zid)) + b':['
+        opened = True
+        first = True
+        for records in chunks:
+            if not records:
+                continue
+            body = dumps(_columns(records)) if fmt == 'columnar' else dumps(records)[1:-1]
+            yield body if first else b',' + body
+            first = False
+        yield b']'
+    yield b'}' if opened else b'{}'
+
+
+def buffer_history(zones: ZoneChunks, limit: int
+                   ) -> Tuple[ZoneChunks, Optional[Dict[int, List[Dict]]]]:
+    """Read (zone_id, record chunks) pairs whole if they hold at most `limit` records.
+
+    Returns (None, {zone_id: records}) for a window small enough to send in
+    one piece, or else the pairs to stream, with the chunks already read put
+    back in front and None. At most one chunk beyond `limit` is read.
+    """
+    zones = iter(zones)
+    read: List[Tuple[int, List[List[Dict]]]] = []
+    count = 0
+    for zid, chunks in zones:
+        chunks = iter(chunks)
+        taken: List[List[Dict]] = []
+        read.append((zid, taken))
+        for records in chunks:
+            taken.append(records)
+            count += len(records)
+            if count > limit:
+                read[-1] = (zid, itertools.chain(taken, chunks))
+                return itertools.chain(read, zones), None
+    return None, {zid: [record for records in taken for record in records]
+                  for zid, taken in read}
+
+
+def compress(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """gzip or deflate (zlib) a byte stream, flushing the first chunk at once."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+    pending = 0
+    flushed = False
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        pending += len(chunk)
+        if not flushed or pending >= FLUSH_BYTES:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+            flushed = True
+        if data:
+            yield data
+    yield compressor.flush()
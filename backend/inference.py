@@ -0,0 +1,323 @@
+"""
+Server-side water-requirement predictions.
+Requests from the API and the ingest workers are queued and run through the
+model together, one invoke() per tick, so throughput grows with load instead
+of paying interpreter overhead per reading.
+"""
+
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from storage import CHANNEL_INDEX
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODEL_PATH = os.path.join(_ROOT, 'firmware', 'models', 'irrigation_model.tflite')
+# Written by models/export_numpy.py; preferred since it needs no TensorFlow
+DEFAULT_NUMPY_MODEL_PATH = os.path.join(_ROOT, 'models', 'irrigation_model.npz')
+DEFAULT_SCALER_PATH = os.path.join(_ROOT, 'models', 'scaler.pkl')
+
+# Model input order, as in models/train_model.py
+FEATURES = ('soil_moisture', 'temperature', 'humidity', 'zone_id', 'hour')
+_SENSOR_ROWS = [CHANNEL_INDEX[name] for name in FEATURES[:3]]
+
+DEFAULT_TICK = 0.005
+DEFAULT_MAX_BATCH = 4096
+
+
+class ModelUnavailable(RuntimeError):
+    """No model (or no runtime to execute it) is available."""
+
+
+def load_scaler(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """StandardScaler mean and scale from train_model.py's scaler.pkl."""
+    try:
+        with open(path, 'rb') as f:
+            scaler = pickle.load(f)
+    except (OSError, ImportError, pickle.UnpicklingError) as e:
+        raise ModelUnavailable(f'Cannot load scaler {path}: {e}')
+    return (np.asarray(scaler.mean_, dtype=np.float32),
+            np.asarray(scaler.scale_, dtype=np.float32))
+
+
+def _interpreter_class():
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        try:
+            import tensorflow as tf
+        except ImportError:
+            raise ModelUnavailable('Neither tflite_runtime nor tensorflow is installed')
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+_ACTIVATIONS = {
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'linear': lambda x: x,
+    'sigmoid': lambda x: np.reciprocal(1 + np.exp(-x), out=x),
+    'tanh': lambda x: np.tanh(x, out=x),
+}
+
+
+class NumpyModel:
+    """Dense-layer forward pass in NumPy, from models/export_numpy.py's .npz.
+
+    Loads in milliseconds and handles any batch size with one matmul per
+    layer; the scaler mean/scale are part of the file.
+    """
+
+    def __init__(self, path: str):
+        if not os.path.exists(path):
+            raise ModelUnavailable(f'Model file {path} not found')
+        with np.load(path, allow_pickle=False) as data:
+            self.mean = data['mean'].astype(np.float32)
+            self.scale = data['scale'].astype(np.float32)
+            names = [str(name) for name in data['activations']]
+            self.layers = [(data[f'kernel_{i}'].astype(np.float32),
+                            data[f'bias_{i}'].astype(np.float32)) for i in range(len(names))]
+        unknown = set(names) - set(_ACTIVATIONS)
+        if unknown:
+            raise ModelUnavailable(f'Unsupported activations: {sorted(unknown)}')
+        self.activations = [_ACTIVATIONS[name] for name in names]
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """Predicted water requirement (ml) for each (len(FEATURES),) row."""
+        x = (np.asarray(features, dtype=np.float32) - self.mean) / self.scale
+        for (kernel, bias), activation in zip(self.layers, self.activations):
+            x = x @ kernel
+            x += bias
+            x = activation(x)
+        return x[:, 0]
+
+
+def _quantize(values: np.ndarray, details: Dict) -> np.ndarray:
+    """Float values in a tensor's dtype, using its quantization for integer tensors."""
+    dtype = details['dtype']
+    if np.issubdtype(dtype, np.floating):
+        return values.astype(dtype)
+    scale, zero_point = details['quantization']
+    info = np.iinfo(dtype)
+    return np.clip(np.round(values / scale + zero_point), info.min, info.max).astype(dtype)
+
+
+def _dequantize(values: np.ndarray, details: Dict) -> np.ndarray:
+    if np.issubdtype(details['dtype'], np.floating):
+        return values.astype(np.float32)
+    scale, zero_point = details['quantization']
+    return ((values.astype(np.float32) - zero_point) * scale).astype(np.float32)
+
+
+class TFLiteModel:
+    """Scaler plus TFLite interpreter, run over whole batches.
+
+    The input tensor is resized to the next power of two of the batch size
+    and padded, so reallocations only happen when the load level changes.
+    Full-integer (int8) models are fed quantized inputs and their outputs
+    dequantized.
+    """
+
+    def __init__(self, model_path: str, scaler_path: str):
+        if not os.path.exists(model_path):
+            raise ModelUnavailable(f'Model file {model_path} not found')
+        self.mean, self.scale = load_scaler(scaler_path)
+        self.interpreter = _interpreter_class()(model_path=model_path)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._size = int(self._input['shape'][0])
+
+    def _resize(self, size: int):
+        if size != self._size:
+            self.interpreter.resize_tensor_input(self._input['index'], [size, len(FEATURES)])
+            self.interpreter.allocate_tensors()
+            self._input = self.interpreter.get_input_details()[0]
+            self._output = self.interpreter.get_output_details()[0]
+            self._size = size
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """Predicted water requirement (ml) for each (len(FEATURES),) row."""
+        n = len(features)
+        scaled = (features - self.mean) / self.scale
+        size = 1 << max(n - 1, 0).bit_length()
+        self._resize(size)
+        batch = np.zeros((size, len(FEATURES)), dtype=self._input['dtype'])
+        batch[:n] = _quantize(scaled, self._input)
+        self.interpreter.set_tensor(self._input['index'], batch)
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self._output['index'])[:n, 0]
+        return _dequantize(output, self._output)
+
+
+def features_from_readings(zone_ids: np.ndarray, timestamps: np.ndarray,
+                           values: np.ndarray) -> np.ndarray:
+    """Model inputs for stored readings; `values` has shape (len(CHANNELS), n)."""
+    # Local hour of day, with the UTC offset in effect now
+    offset = time.localtime().tm_gmtoff
+    hours = ((timestamps + offset) // 3600) % 24
+    return np.column_stack([values[_SENSOR_ROWS].T, zone_ids, hours]).astype(np.float32)
+
+
+class _Request:
+    __slots__ = ('features', 'future')
+
+    def __init__(self, features: np.ndarray):
+        self.features = features
+        self.future = Future()
+
+
+class InferenceService:
+    """Micro-batching front end for a model.
+
+    Requests queued within one tick (or until `max_batch` rows are waiting)
+    are concatenated and predicted with a single model call on the service
+    thread, which also owns the interpreter.
+    """
+
+    def __init__(self, model=None, tick: float = DEFAULT_TICK,
+                 max_batch: int = DEFAULT_MAX_BATCH, error: Optional[str] = None):
+        self.model = model
+        self.tick = tick
+        self.max_batch = max_batch
+        self.error = error
+        self._pending: List[_Request] = []
+        self._rows = 0
+        self._cond = threading.Condition()
+        self._counts = {'requests': 0, 'predictions': 0, 'batches': 0, 'errors': 0,
+                        'backfilled': 0}
+        self._drift: Dict[str, List[float]] = {}
+        self._worker = None
+
+    @property
+    def available(self) -> bool:
+        return self.model is not None
+
+    def start(self):
+        """Start the batching thread once."""
+        if self.available and self._worker is None:
+            self._worker = threading.Thread(target=self._run, name='inference',
+                                            daemon=True)
+            self._worker.start()
+
+    def submit(self, features: np.ndarray) -> Future:
+        """Queue (n, len(FEATURES)) feature rows; the future yields (n,) predictions."""
+        if not self.available:
+            raise ModelUnavailable(self.error or 'No model loaded')
+        request = _Request(np.asarray(features, dtype=np.float32).reshape(-1, len(FEATURES)))
+        with self._cond:
+            self._pending.append(request)
+            self._rows += len(request.features)
+            self._counts['requests'] += 1
+            self._cond.notify()
+        return request.future
+
+    def predict(self, features: np.ndarray, timeout: Optional[float] = 5.0) -> np.ndarray:
+        return self.submit(features).result(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Give other callers one tick to join this batch
+                deadline = time.monotonic() + self.tick
+                while self._rows < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                requests, self._pending, self._rows = self._pending, [], 0
+
+            features = np.concatenate([request.features for request in requests])
+            try:
+                predictions = self.model.predict(features)
+            except Exception as e:
+                print(f"Error running inference on {len(features)} rows: {e}")
+                with self._cond:
+                    self._counts['errors'] += 1
+                for request in requests:
+                    request.future.set_exception(e)
+                continue
+
+            with self._cond:
+                self._counts['predictions'] += len(features)
+                self._counts['batches'] += 1
+            offset = 0
+            for request in requests:
+                n = len(request.features)
+                request.future.set_result(predictions[offset:offset + n])
+                offset += n
+
+    def backfill(self, groups: Sequence, timeout: Optional[float] = 5.0):
+        """Fill missing water_prediction values of ingest groups in place.
+
+        Readings that already carry a device prediction are predicted too,
+        to track how far each device's edge model drifts from the server's.
+        """
+        if not self.available or not groups:
+            return
+        column = CHANNEL_INDEX['water_prediction']
+        features = np.concatenate([
+            features_from_readings(np.full(len(group.timestamps), group.zone_id),
+                                   group.timestamps, group.values)
+            for group in groups])
+        usable = np.isfinite(features).all(axis=1)
+        if not usable.any():
+            return
+        predictions = np.full(len(features), np.nan, dtype=np.float32)
+        predictions[usable] = self.predict(features[usable], timeout)
+
+        offset, filled = 0, 0
+        for group in groups:
+            n = len(group.timestamps)
+            predicted = predictions[offset:offset + n]
+            reported = group.values[column]
+            missing = np.isnan(reported) & ~np.isnan(predicted)
+            compared = ~np.isnan(reported) & ~np.isnan(predicted)
+            if compared.any():
+                with self._cond:
+                    drift = self._drift.setdefault(group.device_id, [0, 0.0])
+                    drift[0] += int(compared.sum())
+                    drift[1] += float(np.abs(reported[compared] - predicted[compared]).sum())
+            reported[missing] = predicted[missing]
+            filled += int(missing.sum())
+            offset += n
+        with self._cond:
+            self._counts['backfilled'] += filled
+
+    def metrics(self) -> Dict:
+        """Throughput counters and per-device mean absolute prediction drift."""
+        with self._cond:
+            metrics = {'available': self.available, 'error': self.error,
+                       'pending_rows': self._rows, **self._counts}
+            metrics['drift_mae'] = {device_id: round(total / n, 4)
+                                    for device_id, (n, total) in self._drift.items()}
+        batches = metrics['batches']
+        metrics['mean_batch_size'] = round(metrics['predictions'] / batches, 2) if batches else 0
+        return metrics
+
+
+def load_model(numpy_path: str = DEFAULT_NUMPY_MODEL_PATH,
+               model_path: str = DEFAULT_MODEL_PATH,
+               scaler_path: str = DEFAULT_SCALER_PATH):
+    """The NumPy model if exported, otherwise the TFLite model and scaler."""
+    if numpy_path and os.path.exists(numpy_path):
+        return NumpyModel(numpy_path)
+    return TFLiteModel(model_path, scaler_path)
+
+
+def create_inference(numpy_path: str = DEFAULT_NUMPY_MODEL_PATH,
+                     model_path: str = DEFAULT_MODEL_PATH,
+                     scaler_path: str = DEFAULT_SCALER_PATH, **kwargs) -> InferenceService:
+    """Inference service for a model; without a usable model it reports unavailable."""
+    try:
+        model = load_model(numpy_path, model_path, scaler_path)
+    except ModelUnavailable as e:
+        print(f"Server-side inference disabled: {e}")
+        return InferenceService(None, error=str(e), **kwargs)
+    return InferenceService(model, **kwargs)
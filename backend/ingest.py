@@ -0,0 +1,478 @@
+"""
+Validation, grouping and queueing of sensor-reading uploads.
+HTTP handlers validate and enqueue; a worker thread drains the queue in
+batches into storage so request latency doesn't depend on storage work.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from devices import shard_of
+from storage import CHANNELS, parse_timestamp, reading_values
+
+MAX_BATCH_READINGS = 10000
+# How far ahead of the server clock a device timestamp may be
+MAX_CLOCK_SKEW = 300
+MAX_DEVICE_ID_LENGTH = 64
+# Zone IDs run from 0 to MAX_ZONES - 1; each new zone preallocates a ring
+# buffer, and the packed format's active-zone mask covers 32 zones
+MAX_ZONES = 32
+# Sequence number of readings sent without one
+NO_SEQ = -1
+
+# Channels that must carry at least one value for a reading to be useful
+_SENSOR_CHANNELS = slice(0, 3)
+
+
+class ReadingGroup(NamedTuple):
+    """Timestamp-sorted readings for one device zone."""
+    device_id: str
+    zone_id: int
+    timestamps: np.ndarray
+    values: np.ndarray  # (len(CHANNELS), n)
+    seqs: Optional[np.ndarray] = None  # device sequence numbers, NO_SEQ if unsequenced
+
+
+class ParsedBatch(NamedTuple):
+    groups: List[ReadingGroup]
+    results: List[Dict]
+    accepted: int
+    device_ids: List[str]
+    duplicates: int = 0
+    positions: Sequence[np.ndarray] = ()  # index in the upload of each group's readings
+
+
+def parse_batch(payload, now: float, default_device: str) -> ParsedBatch:
+    """Validate a bulk upload and group accepted readings by device and zone.
+
+    `payload` is either a list of readings or an object with a `readings`
+    list and an optional `device_id` applying to readings that lack one.
+    Each reading has `zone_id`, sensor channels and either `timestamp`
+    (epoch seconds/milliseconds or ISO-8601) or `age` (seconds before now);
+    readings with neither are stamped with the server time. An optional
+    `seq` is the device's sequence number for the reading (see
+    drop_acknowledged).
+    """
+    if isinstance(payload, dict):
+        readings = payload.get('readings')
+        batch_device = payload.get('device_id', default_device)
+    else:
+        readings, batch_device = payload, default_device
+    if not isinstance(readings, list):
+        raise ValueError("Expected a list of readings or an object with 'readings'")
+    if len(readings) > MAX_BATCH_READINGS:
+        raise ValueError(f'At most {MAX_BATCH_READINGS} readings per batch')
+
+    n = len(readings)
+    errors: Dict[int, str] = {}
+    device_ids = [''] * n
+    zone_ids = np.full(n, -1, dtype=np.int64)
+    timestamps = np.full(n, np.nan, dtype=np.float64)
+    values = np.full((n, len(CHANNELS)), np.nan, dtype=np.float64)
+    seqs = np.full(n, NO_SEQ, dtype=np.int64)
+
+    # Field extraction is per item; range checks below are vectorized
+    for i, reading in enumerate(readings):
+        if not isinstance(reading, dict):
+            errors[i] = 'reading must be an object'
+            continue
+        device_id = reading.get('device_id', batch_device)
+        if not isinstance(device_id, str) or not 0 < len(device_id) <= MAX_DEVICE_ID_LENGTH:
+            errors[i] = 'invalid device_id'
+            continue
+        try:
+            zone_ids[i] = int(reading.get('zone_id'))
+        except (TypeError, ValueError, OverflowError):
+            errors[i] = 'invalid zone_id'
+            continue
+        try:
+            if 'timestamp' in reading:
+                timestamps[i] = parse_timestamp(reading['timestamp'])
+            else:
+                timestamps[i] = now - float(reading.get('age', 0))
+        except (TypeError, ValueError, OverflowError):
+            errors[i] = 'invalid timestamp'
+            continue
+        if 'seq' in reading:
+            seq = reading['seq']
+            if not isinstance(seq, int) or isinstance(seq, bool) or not 0 <= seq < 2 ** 63:
+                errors[i] = 'invalid seq'
+                continue
+            seqs[i] = seq
+        device_ids[i] = device_id
+        values[i] = reading_values(reading)
+
+    return group_readings(np.array(device_ids, dtype=object), zone_ids,
+                          timestamps, values, errors, now, seqs)
+
+
+def group_readings(device_ids: np.ndarray, zone_ids: np.ndarray,
+                   timestamps: np.ndarray, values: np.ndarray,
+                   errors: Dict[int, str], now: float,
+                   seqs: Optional[np.ndarray] = None) -> ParsedBatch:
+    """Range-check decoded readings and group the valid ones by device zone.
+
+    `values` has shape (n, len(CHANNELS)); `errors` holds per-index failures
+    already found while decoding and is extended in place. A sequenced
+    reading repeating an earlier one's device, zone and `seqs` entry is a
+    duplicate.
+    """
+    n = len(timestamps)
+    checks = (
+        ((zone_ids < 0) | (zone_ids >= MAX_ZONES), 'invalid zone_id'),
+        (~np.isfinite(timestamps), 'invalid timestamp'),
+        (timestamps > now + MAX_CLOCK_SKEW, 'timestamp is in the future'),
+        (np.isnan(values[:, _SENSOR_CHANNELS]).all(axis=1), 'no sensor values'),
+    )
+    for failed, message in checks:
+        for i in np.flatnonzero(failed).tolist():
+            errors.setdefault(i, message)
+
+    results = [{'index': i, 'status': 'accepted'} for i in range(n)]
+    for i, message in errors.items():
+        results[i] = {'index': i, 'status': 'rejected', 'error': message}
+
+    ok = np.ones(n, dtype=bool)
+    ok[list(errors)] = False
+    index = np.flatnonzero(ok)
+    if not len(index):
+        return ParsedBatch([], results, 0, [])
+
+    names, device_codes = np.unique(device_ids[index].astype(str), return_inverse=True)
+    duplicates = 0
+    if seqs is not None and (seqs[index] != NO_SEQ).any():
+        # Repeats within the upload: sort by device, zone and seq, compare neighbours
+        order = np.lexsort((index, seqs[index], zone_ids[index], device_codes))
+        key = np.column_stack([device_codes, zone_ids[index], seqs[index]])[order]
+        repeated = np.r_[False, (np.diff(key, axis=0) == 0).all(axis=1)]
+        repeated &= key[:, 2] != NO_SEQ
+        if repeated.any():
+            for i in index[order[repeated]].tolist():
+                results[i] = {'index': i, 'status': 'duplicate'}
+            duplicates = int(repeated.sum())
+            keep = np.ones(len(index), dtype=bool)
+            keep[order[repeated]] = False
+            index, device_codes = index[keep], device_codes[keep]
+
+    # Sort by device, zone, then time and split into runs per device zone
+    order = np.lexsort((timestamps[index], zone_ids[index], device_codes))
+    index, device_codes = index[order], device_codes[order]
+    zones = zone_ids[index]
+    breaks = np.flatnonzero((np.diff(device_codes) != 0) | (np.diff(zones) != 0)) + 1
+
+    groups, positions = [], []
+    for run in np.split(np.arange(len(index)), breaks):
+        rows = index[run]
+        groups.append(ReadingGroup(str(names[device_codes[run[0]]]), int(zones[run[0]]),
+                                   timestamps[rows], values[rows].T,
+                                   None if seqs is None else seqs[rows]))
+        positions.append(rows)
+    return ParsedBatch(groups, results, len(index), [str(name) for name in names],
+                       duplicates, positions)
+
+
+def drop_acknowledged(batch: ParsedBatch, acked: Dict[str, Optional[int]]) -> ParsedBatch:
+    """Mark readings at or below their device's acknowledged seq as duplicates.
+
+    Devices number readings with increasing sequence numbers, buffer them
+    while offline and replay the buffer oldest first, dropping what the
+    server has acknowledged. `acked` is the highest sequence number queued
+    per device: everything up to it is already stored or about to be, which
+    makes replays idempotent. Devices are only acknowledged once readings
+    are stored, so they keep queued readings until then.
+    """
+    groups, positions, results = [], [], batch.results
+    duplicates = batch.duplicates
+    for group, position in zip(batch.groups, batch.positions):
+        last = acked.get(group.device_id)
+        stale = None
+        if last is not None and group.seqs is not None:
+            stale = (group.seqs != NO_SEQ) & (group.seqs <= last)
+        if stale is None or not stale.any():
+            groups.append(group)
+            positions.append(position)
+            continue
+        if results is batch.results:
+            results = list(results)
+        for i in position[stale].tolist():
+            results[i] = {'index': i, 'status': 'duplicate'}
+        duplicates += int(stale.sum())
+        keep = ~stale
+        if keep.any():
+            groups.append(group._replace(timestamps=group.timestamps[keep],
+                                         values=group.values[:, keep],
+                                         seqs=group.seqs[keep]))
+            positions.append(position[keep])
+    accepted = sum(len(group.timestamps) for group in groups)
+    return batch._replace(groups=groups, results=results, accepted=accepted,
+                          duplicates=duplicates, positions=positions)
+
+
+def highest_seqs(groups: List[ReadingGroup]) -> Dict[str, int]:
+    """Highest sequence number per device among sequenced readings."""
+    highest: Dict[str, int] = {}
+    for group in groups:
+        if group.seqs is not None and len(group.seqs):
+            seq = int(group.seqs.max())
+            if seq != NO_SEQ and seq > highest.get(group.device_id, NO_SEQ):
+                highest[group.device_id] = seq
+    return highest
+
+
+def merge_groups(groups: List[ReadingGroup]) -> List[ReadingGroup]:
+    """Combine groups for the same device zone into one time-sorted group."""
+    by_key: Dict = {}
+    for group in groups:
+        by_key.setdefault((group.device_id, group.zone_id), []).append(group)
+    merged = []
+    for (device_id, zone_id), parts in by_key.items():
+        if len(parts) == 1:
+            merged.append(parts[0])
+            continue
+        timestamps = np.concatenate([part.timestamps for part in parts])
+        values = np.concatenate([part.values for part in parts], axis=1)
+        order = np.argsort(timestamps, kind='stable')
+        seqs = None
+        if any(part.seqs is not None for part in parts):
+            seqs = np.concatenate([
+                np.full(len(part.timestamps), NO_SEQ, dtype=np.int64)
+                if part.seqs is None else part.seqs for part in parts])[order]
+        merged.append(ReadingGroup(device_id, zone_id, timestamps[order], values[:, order],
+                                   seqs))
+    return merged
+
+
+class IngestJob(NamedTuple):
+    """Validated readings waiting to be applied, plus device status updates."""
+    groups: List[ReadingGroup]
+    device_ids: List[str]
+    statuses: Dict[str, Dict]
+    received_at: float
+    size: int
+    # Each device's seq_epoch when the job was queued (see DeviceState)
+    seq_epochs: Optional[Dict[str, int]] = None
+
+
+class QueueFull(Exception):
+    """The ingest queue cannot take more readings right now."""
+
+    def __init__(self, bulk: bool):
+        super().__init__('bulk uploads paused' if bulk else 'ingest queue full')
+        self.bulk = bulk
+
+
+class IngestQueue:
+    """Bounded queue of ingest jobs drained in batches by a worker thread.
+
+    Capacity is counted in readings rather than requests so one large
+    backlog upload can't hide behind a small request count.
+    """
+
+    def __init__(self, apply: Callable[[List[IngestJob]], None],
+                 max_readings: int = 50000, max_batch: int = 2000,
+                 high_water: float = 0.8, latency_window: int = 1000):
+        self.apply = apply
+        self.max_readings = max_readings
+        self.max_batch = max_batch
+        self.high_water = int(max_readings * high_water)
+        self._jobs = deque()
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._idle = threading.Condition(self._cond)
+        self._busy = False
+        self._latencies = deque(maxlen=latency_window)
+        self._counts = {'accepted': 0, 'rejected': 0, 'processed': 0,
+                        'batches': 0, 'errors': 0}
+        self._worker = None
+
+    def start(self, name: str = 'ingest-worker'):
+        """Start the worker thread once."""
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+            self._worker.start()
+
+    def _has_room(self, size: int, bulk: bool) -> bool:
+        limit = self.high_water if bulk else self.max_readings
+        return not self._pending or self._pending + size <= limit
+
+    def submit(self, job: IngestJob, bulk: bool = False):
+        """Enqueue a job; raises QueueFull when saturated.
+
+        Bulk uploads are turned away once the queue passes its high-water
+        mark so that live readings keep flowing while backlogs back off.
+        """
+        with self._cond:
+            if not self._has_room(job.size, bulk):
+                self._counts['rejected'] += job.size
+                raise QueueFull(bulk)
+            self._enqueue(job)
+
+    def _enqueue(self, job: IngestJob):
+        """Append a job whose room was checked; called holding `_cond`."""
+        self._jobs.append(job)
+        self._pending += job.size
+        self._counts['accepted'] += job.size
+        self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs:
+                    self._cond.wait()
+                jobs, size = [], 0
+                while self._jobs and size < self.max_batch:
+                    job = self._jobs.popleft()
+                    jobs.append(job)
+                    size += job.size
+                self._busy = True
+
+            try:
+                self.apply(jobs)
+            except Exception as e:
+                print(f"Error applying {len(jobs)} ingest jobs: {e}")
+                error = True
+            else:
+                error = False
+            done = time.time()
+
+            with self._cond:
+                self._pending -= size
+                self._busy = False
+                self._counts['processed'] += size
+                self._counts['batches'] += 1
+                self._counts['errors'] += error
+                self._latencies.extend(done - job.received_at for job in jobs)
+                if not self._jobs:
+                    self._idle.notify_all()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued job has been applied."""
+        with self._cond:
+            return self._idle.wait_for(lambda: not self._jobs and not self._busy,
+                                       timeout)
+
+    def counters(self):
+        """Raw metrics and drain latencies in seconds, for combining queues."""
+        with self._cond:
+            metrics = {
+                'queue_depth': len(self._jobs),
+                'pending_readings': self._pending,
+                'capacity_readings': self.max_readings,
+                **self._counts,
+            }
+            return metrics, np.array(self._latencies, dtype=np.float64)
+
+    def metrics(self) -> Dict:
+        """Queue depth, throughput counters and drain latency percentiles (ms)."""
+        metrics, latencies = self.counters()
+        metrics['drain_latency_ms'] = _latency_percentiles(latencies)
+        return metrics
+
+
+def _latency_percentiles(latencies: np.ndarray) -> Optional[Dict]:
+    if not len(latencies):
+        return None
+    latencies = latencies * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'p50': round(float(p50), 3), 'p95': round(float(p95), 3),
+        'p99': round(float(p99), 3), 'max': round(float(latencies.max()), 3),
+    }
+
+
+class ShardedIngestQueue:
+    """One IngestQueue and worker per device shard.
+
+    Jobs are split by device so that a backlog or slow apply for one
+    controller doesn't hold up readings from the others; readings of a
+    device always go through the same worker, which keeps them in order.
+    """
+
+    def __init__(self, apply: Callable[[List[IngestJob]], None], shards: int = 4,
+                 max_readings: int = 50000, **kwargs):
+        per_shard = max(1, max_readings // shards)
+        self.shards = shards
+        self.max_readings = per_shard * shards
+        self.queues = [IngestQueue(apply, max_readings=per_shard, **kwargs)
+                       for _ in range(shards)]
+
+    def start(self):
+        for index, queue in enumerate(self.queues):
+            queue.start(name=f'ingest-worker-{index}')
+
+    def shard(self, device_id: str) -> int:
+        return shard_of(device_id, self.shards)
+
+    def split(self, job: IngestJob) -> Dict[int, IngestJob]:
+        """Per-shard parts of a job."""
+        shard = self.shard
+        shards = {shard(device_id) for device_id in set(job.device_ids) | set(job.statuses)}
+        if len(shards) <= 1:
+            return {index: job for index in shards}
+
+        parts = {}
+        for index in shards:
+            groups = [group for group in job.groups if shard(group.device_id) == index]
+            parts[index] = IngestJob(
+                groups,
+                [device_id for device_id in job.device_ids if shard(device_id) == index],
+                {device_id: status for device_id, status in job.statuses.items()
+                 if shard(device_id) == index},
+                job.received_at,
+                sum(len(group.timestamps) for group in groups),
+                {device_id: epoch for device_id, epoch in (job.seq_epochs or {}).items()
+                 if shard(device_id) == index})
+        return parts
+
+    def submit(self, job: IngestJob, bulk: bool = False):
+        """Enqueue a job's per-shard parts; raises QueueFull if any shard is saturated.
+
+        A multi-device upload is accepted or refused as a whole.
+        """
+        parts = self.split(job)
+        if not parts:
+            return
+        if len(parts) == 1:
+            (index, part), = parts.items()
+            self.queues[index].submit(part, bulk)
+            return
+        # Every shard's lock is held, in index order, from the check until
+        # the parts are queued, so concurrent uploads can't overfill a shard
+        with ExitStack() as stack:
+            for index in sorted(parts):
+                stack.enter_context(self.queues[index]._cond)
+            for index, part in parts.items():
+                queue = self.queues[index]
+                if not queue._has_room(part.size, bulk):
+                    queue._counts['rejected'] += job.size
+                    raise QueueFull(bulk)
+            for index, part in parts.items():
+                self.queues[index]._enqueue(part)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every shard has applied its queued jobs."""
+        deadline = None if timeout is None else time.time() + timeout
+        for queue in self.queues:
+            remaining = None if deadline is None else max(0.0, deadline - time.time())
+            if not queue.join(remaining):
+                return False
+        return True
+
+    def metrics(self) -> Dict:
+        """Combined counters and drain latency, plus per-shard depth."""
+        combined, latencies, shards = {}, [], []
+        for queue in self.queues:
+            metrics, queue_latencies = queue.counters()
+            shards.append({'queue_depth': metrics['queue_depth'],
+                           'pending_readings': metrics['pending_readings']})
+            for key, value in metrics.items():
+                combined[key] = combined.get(key, 0) + value
+            latencies.append(queue_latencies)
+        combined['drain_latency_ms'] = _latency_percentiles(np.concatenate(latencies))
+        combined['shards'] = shards
+        return combined
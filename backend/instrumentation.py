@@ -0,0 +1,285 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+Counters, gauges and histograms are plain dicts behind one lock each, cheap
+enough for the request and ingest hot paths; values that are already kept
+elsewhere are read by collectors only when /metrics is scraped.
+"""
+
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds; spans a cached GET through a large export
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_PROFILER_INTERVAL = 0.01
+
+Labels = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"'
+                          for name, value in zip(names, values)) + '}'
+
+
+def _number(value: float) -> str:
+    if value != value:
+        return 'NaN'
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Labels, float] = {}
+
+    def _header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self._header() + [f'{self.name}{_labels(self.label_names, key)} {_number(value)}'
+                                 for key, value in values]
+
+
+class Counter(_Metric):
+    """Monotonic total per label set."""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """Current value per label set."""
+
+    kind = 'gauge'
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount: float = 1, *labels):
+        self.inc(-amount, *labels)
+
+
+class Histogram(_Metric):
+    """Bucketed observations per label set, with their sum and count."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label set -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *labels) -> '_Timer':
+        """Context manager observing the seconds its block takes."""
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        names = self.label_names + ('le',)
+        lines = self._header()
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(names, key + (_number(bound),))} '
+                             f'{cumulative}')
+            suffix = _labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{suffix} {values[-1]!r}')
+            lines.append(f'{self.name}_count{suffix} {cumulative}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class MetricsRegistry:
+    """Named metrics plus collectors that report gauges at scrape time.
+
+    A collector returns (name, labels, value) samples; its metric is
+    declared with `collector(name, help, kind)` so it gets HELP and TYPE
+    lines even while it has no samples.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collected: Dict[str, Tuple[str, str]] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics or metric.name in self._collected:
+                raise ValueError(f'metric {metric.name} is already registered')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def collector(self, name: str, help: str, kind: str = 'gauge'):
+        """Declare a metric whose samples a registered collector reports."""
+        with self._lock:
+            if name in self._metrics or name in self._collected:
+                raise ValueError(f'metric {name} is already registered')
+            self._collected[name] = (help, kind)
+
+    def register_collector(self, collect: Callable[[], Iterable[Sample]]):
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        """Every metric in the text exposition format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+
+        samples: Dict[str, List[str]] = {name: [] for name in self._collected}
+        for collect in self._collectors:
+            try:
+                for name, labels, value in collect():
+                    samples.setdefault(name, []).append(
+                        f'{name}{_labels(list(labels), list(labels.values()))} {_number(value)}')
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+        for name, values in samples.items():
+            help, kind = self._collected.get(name, ('', 'untyped'))
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(values)
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """Statistical profiler sampling every thread's stack on an interval.
+
+    Samples are kept as collapsed stacks ('file:function;...' -> count),
+    the input format of flame graph tools. Nothing runs until `start()`,
+    and the sampler thread never samples itself.
+    """
+
+    def __init__(self, interval: float = DEFAULT_PROFILER_INTERVAL, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._stacks = _Tally()
+        self._samples = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: Optional[float] = None):
+        if interval is not None:
+            self.interval = interval
+        if self.running:
+            return
+        self._stop.clear()
+        self._started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self._samples = 0
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                names = []
+                while frame is not None and len(names) < self.max_depth:
+                    code = frame.f_code
+                    names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                stacks.append(';'.join(reversed(names)))
+            with self._lock:
+                self._stacks.update(stacks)
+                self._samples += 1
+
+    def collapsed(self, limit: Optional[int] = None) -> str:
+        """One 'stack count' line per distinct stack, most frequent first."""
+        with self._lock:
+            stacks = self._stacks.most_common(limit)
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                'running': self.running,
+                'interval': self.interval,
+                'samples': self._samples,
+                'stacks': len(self._stacks),
+                'started_at': self._started_at,
+            }
@@ -0,0 +1,244 @@
+"""
+Load generator for the ingest endpoints.
+Simulates thousands of devices uploading concurrently over a pooled
+connection and reports throughput, latency percentiles and error rates.
+
+Usage (from the backend directory, with the backend running):
+    python loadgen.py --devices 2000 --interval 10 --duration 60
+    python loadgen.py --devices 500 --pattern burst --burst-every 20 --burst-size 60
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+try:
+    import aiohttp
+except ImportError:  # optional, only needed to generate load
+    aiohttp = None
+
+from simulator import BUFFER_CAPACITY, MAX_UPLOAD_SAMPLES, simulate_sensor_reading
+
+DEFAULT_URL = 'http://localhost:5000'
+PATTERNS = ('steady', 'burst', 'ramp')
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return float('nan')
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+class LoadStats:
+    """Outcome of every request sent during a run."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses = Counter()
+        self.exceptions = Counter()
+        self.readings = 0
+        self.duplicates = 0
+        self.max_lag = 0.0
+
+    def record(self, latency: float, status: int, readings: int, duplicates: int = 0):
+        self.latencies.append(latency)
+        self.statuses[status] += 1
+        if status == 200:
+            self.readings += readings
+            self.duplicates += duplicates
+
+    def record_exception(self, latency: float, error: Exception):
+        self.latencies.append(latency)
+        self.exceptions[type(error).__name__] += 1
+
+    def report(self, elapsed: float) -> Dict:
+        requests = len(self.latencies)
+        failed = requests - self.statuses[200]
+        ordered = sorted(self.latencies)
+        return {
+            'elapsed_s': round(elapsed, 2),
+            'requests': requests,
+            'requests_per_s': round(requests / elapsed, 1) if elapsed else 0.0,
+            'readings_per_s': round(self.readings / elapsed, 1) if elapsed else 0.0,
+            'latency_ms': {f'p{q}': round(percentile(ordered, q) * 1000, 2)
+                           for q in PERCENTILES},
+            'error_rate': round(failed / requests, 4) if requests else 0.0,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+            'exceptions': dict(self.exceptions),
+            'duplicates': self.duplicates,
+            # How far uploads started behind schedule; large values mean the
+            # generator, not the backend, is the bottleneck
+            'max_schedule_lag_ms': round(self.max_lag * 1000, 1),
+        }
+
+
+class VirtualDevice:
+    """One simulated controller with the firmware's buffer-and-replay protocol."""
+
+    def __init__(self, device_id: str, zones: int):
+        self.device_id = device_id
+        self.zones = zones
+        # Start from the clock so devices of an earlier run don't collide
+        self.seq = int(time.time() * 1000)
+        self.backlog = deque(maxlen=BUFFER_CAPACITY)
+
+    def sample(self):
+        self.backlog.append((self.seq, time.time(), simulate_sensor_reading(self.zones)))
+        self.seq += 1
+
+    def single_payload(self) -> Dict:
+        seq, _, data = self.backlog[-1]
+        return {**data, 'device_id': self.device_id, 'seq': seq}
+
+    def batch_payload(self) -> Dict:
+        readings = []
+        for seq, taken_at, data in list(self.backlog)[:MAX_UPLOAD_SAMPLES]:
+            for zone_id in range(self.zones):
+                readings.append({'zone_id': zone_id, 'seq': seq, 'timestamp': taken_at,
+                                 **data[str(zone_id)]})
+        latest = self.backlog[-1][2]
+        return {'device_id': self.device_id, 'pump_running': latest['pump_running'],
+                'active_zones': latest['active_zones'], 'readings': readings}
+
+    def acknowledge(self, ack_seq: Optional[int]):
+        """Drop samples up to ack_seq, which is None until one is stored."""
+        while self.backlog and ack_seq is not None and self.backlog[0][0] <= ack_seq:
+            self.backlog.popleft()
+
+
+async def upload(session, url: str, device: VirtualDevice, stats: LoadStats,
+                 force_batch: bool):
+    """Send the device's newest sample, or its backlog as one batch."""
+    if len(device.backlog) == 1 and not force_batch:
+        target, payload = f'{url}/api/sensor-data', device.single_payload()
+        readings = device.zones
+    else:
+        target, payload = f'{url}/api/sensor-data/batch', device.batch_payload()
+        readings = len(payload['readings'])
+    start = time.perf_counter()
+    try:
+        async with session.post(target, json=payload) as response:
+            body = await response.json(content_type=None) if response.status == 200 else None
+            status = response.status
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        stats.record_exception(time.perf_counter() - start, e)
+        return
+    duplicates = 0
+    if body is not None:
+        device.acknowledge(body.get('ack_seq'))
+        duplicates = body.get('duplicates', 0)
+    stats.record(time.perf_counter() - start, status, readings - duplicates, duplicates)
+
+
+async def run_device(session, args, device: VirtualDevice, stats: LoadStats,
+                     started: float):
+    """Upload every `interval` seconds until the run ends, following `pattern`."""
+    stop_at = started + args.duration
+    if args.pattern == 'ramp':
+        # Devices come online evenly over the ramp window
+        first = started + random.uniform(0, args.ramp)
+    else:
+        first = started + random.uniform(0, args.interval)
+    next_send = first
+    next_burst = started + args.burst_every if args.pattern == 'burst' else float('inf')
+
+    while True:
+        due = min(next_send, next_burst)
+        if due >= stop_at:
+            return
+        await asyncio.sleep(max(0.0, due - time.monotonic()))
+        stats.max_lag = max(stats.max_lag, time.monotonic() - due)
+        if due == next_burst:
+            # Every device reconnects at once with a buffered backlog
+            for _ in range(args.burst_size):
+                device.sample()
+            next_burst += args.burst_every
+        else:
+            device.sample()
+            next_send += args.interval
+        await upload(session, args.url, device, stats, args.batch)
+
+
+async def run_load(args) -> Dict:
+    devices = [VirtualDevice(f'{args.prefix}{i:05d}', args.zones)
+               for i in range(args.devices)]
+    stats = LoadStats()
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        started = time.monotonic()
+        await asyncio.gather(*(run_device(session, args, device, stats, started)
+                               for device in devices))
+        elapsed = time.monotonic() - started
+    return stats.report(elapsed)
+
+
+def print_report(report: Dict):
+    latency = report['latency_ms']
+    print(f"Requests:    {report['requests']} in {report['elapsed_s']}s "
+          f"({report['requests_per_s']} req/s, {report['readings_per_s']} readings/s)")
+    print('Latency:     ' + ', '.join(f'{name}={value}ms' for name, value in latency.items()))
+    print(f"Error rate:  {report['error_rate']:.2%}")
+    print(f"Statuses:    {report['statuses']}")
+    if report['exceptions']:
+        print(f"Exceptions:  {report['exceptions']}")
+    print(f"Duplicates:  {report['duplicates']}")
+    print(f"Max lag:     {report['max_schedule_lag_ms']}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default=DEFAULT_URL, help='backend base URL')
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--zones', type=int, default=4, help='zones per device')
+    parser.add_argument('--interval', type=float, default=30.0,
+                        help='seconds between uploads of one device')
+    parser.add_argument('--rate', type=float,
+                        help='total uploads per second; overrides --interval')
+    parser.add_argument('--duration', type=float, default=60.0, help='seconds to run')
+    parser.add_argument('--pattern', choices=PATTERNS, default='steady')
+    parser.add_argument('--ramp', type=float, default=30.0,
+                        help='seconds over which devices start (ramp pattern)')
+    parser.add_argument('--burst-every', type=float, default=30.0,
+                        help='seconds between synchronized reconnects (burst pattern)')
+    parser.add_argument('--burst-size', type=int, default=30,
+                        help='buffered samples each device replays in a burst')
+    parser.add_argument('--batch', action='store_true',
+                        help='always upload through the batch endpoint')
+    parser.add_argument('--connections', type=int, default=100,
+                        help='size of the connection pool')
+    parser.add_argument('--timeout', type=float, default=10.0, help='request timeout (s)')
+    parser.add_argument('--prefix', default='load-', help='device_id prefix')
+    parser.add_argument('--json', metavar='PATH', help='also write the report as JSON')
+    args = parser.parse_args()
+
+    if aiohttp is None:
+        parser.error('aiohttp is required: pip install aiohttp')
+    if args.devices < 1 or args.zones < 1 or args.duration <= 0:
+        parser.error('--devices, --zones and --duration must be positive')
+    if args.rate is not None:
+        if args.rate <= 0:
+            parser.error('--rate must be positive')
+        args.interval = args.devices / args.rate
+    if args.interval <= 0:
+        parser.error('--interval must be positive')
+
+    print(f'{args.devices} devices x {args.zones} zones, one upload every '
+          f'{args.interval:g}s each ({args.devices / args.interval:.1f} uploads/s), '
+          f'{args.pattern} pattern, {args.duration:g}s against {args.url}')
+    report = asyncio.run(run_load(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+Local message queue for Socket.IO emits between worker processes.
+serve.py runs a MessageHub on a Unix socket and each worker's HubManager
+relays its emits through it, so clients connected to any worker receive
+them; a stand-in for Redis when all workers run on one host.
+"""
+
+import os
+import queue
+import socket
+import struct
+import threading
+from typing import Dict, Optional
+
+import socketio
+
+# Frames are a 4-byte big-endian length followed by a JSON message
+_LENGTH = struct.Struct('!I')
+
+
+def _read_frame(sock) -> Optional[bytes]:
+    """The next frame's payload, or None once the peer has closed."""
+    header = _read_exactly(sock, _LENGTH.size)
+    if header is None:
+        return None
+    return _read_exactly(sock, _LENGTH.unpack(header)[0])
+
+
+def _read_exactly(sock, size: int) -> Optional[bytes]:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+class MessageHub:
+    """Relays every frame a connection sends to all the other connections.
+
+    Each connection has its own outbox and sender thread, so one slow
+    reader doesn't hold up the others; one that falls `max_pending` frames
+    behind is disconnected.
+    """
+
+    def __init__(self, path: str, max_pending: int = 1024):
+        self.path = path
+        self.max_pending = max_pending
+        self._server: Optional[socket.socket] = None
+        self._outboxes: Dict[socket.socket, queue.Queue] = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen()
+        threading.Thread(target=self._accept, name='message-hub', daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return  # closed
+            outbox = queue.Queue(self.max_pending)
+            with self._lock:
+                self._outboxes[conn] = outbox
+            threading.Thread(target=self._send, args=(conn, outbox), daemon=True).start()
+            threading.Thread(target=self._relay, args=(conn,), daemon=True).start()
+
+    def _relay(self, conn: socket.socket):
+        try:
+            while True:
+                payload = _read_frame(conn)
+                if payload is None:
+                    break
+                frame = _LENGTH.pack(len(payload)) + payload
+                with self._lock:
+                    outboxes = [(other, outbox) for other, outbox in self._outboxes.items()
+                                if other is not conn]
+                for other, outbox in outboxes:
+                    try:
+                        outbox.put_nowait(frame)
+                    except queue.Full:
+                        # Ends the connection's relay, which cleans it up
+                        try:
+                            other.shutdown(socket.SHUT_RDWR)
+                        except OSError:
+                            pass
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                outbox = self._outboxes.pop(conn)
+            conn.close()
+            try:
+                outbox.put_nowait(None)
+            except queue.Full:
+                pass  # the sender fails on the closed socket instead
+
+    @staticmethod
+    def _send(conn: socket.socket, outbox: queue.Queue):
+        while True:
+            frame = outbox.get()
+            if frame is None:
+                return
+            try:
+                conn.sendall(frame)
+            except OSError:
+                return
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class HubManager(socketio.PubSubManager):
+    """Socket.IO client manager sharing emits through a MessageHub.
+
+    `url` is 'unix://' followed by the hub's socket path. Messages are
+    sent by one background task, so emits from any handler or thread
+    never interleave on the socket. A worker may emit before any client
+    has connected to it, so the connection, and with it listening, starts
+    on first use: the hub relays to every connection, and one that is not
+    read would stall it.
+    """
+
+    name = 'hub'
+
+    def __init__(self, url: str, channel: str = 'flask-socketio', write_only: bool = False,
+                 logger=None, json=None):
+        if not url.startswith('unix://'):
+            raise ValueError(f'unexpected message hub URL: {url}')
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.path = url[len('unix://'):]
+        self._sock = None
+        self._outbox = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        """Connect to the hub and start the sender and listener, once."""
+        with self._start_lock:
+            if self._outbox is not None:
+                return
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+            if self.server.async_mode == 'eventlet':
+                from eventlet.greenio import GreenSocket
+                sock = GreenSocket(sock)
+            self._sock = sock
+            self._outbox = self.server.eio.create_queue()
+        self.server.start_background_task(self._send)
+        if not self.write_only:
+            self.thread = self.server.start_background_task(self._thread)
+
+    def initialize(self):
+        self._start()
+
+    def _publish(self, data):
+        self._start()
+        self._outbox.put(self.json.dumps(data).encode())
+
+    def _send(self):
+        while True:
+            payload = self._outbox.get()
+            self._sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+    def _listen(self):
+        while True:
+            payload = _read_frame(self._sock)
+            if payload is None:
+                return
+            yield payload
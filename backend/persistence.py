@@ -0,0 +1,444 @@
+"""
+Persistent storage for sensor readings.
+Readings are written to a SQL database by a background thread in batches so
+the ingest path never waits for disk. Alongside the raw readings the writer
+maintains rollup tiers (see rollups.py) for long-range queries.
+"""
+
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import (BigInteger, Column, Float, Index, Integer, MetaData,
+                        String, Table, and_, cast, create_engine, event, func,
+                        inspect, literal, select, text)
+
+from rollups import DEFAULT_TIERS, Rollup, Tier, aggregate, empty_rollup
+from storage import CHANNELS
+
+DEFAULT_DATABASE_URL = 'sqlite:///irrigation.db'
+
+metadata = MetaData()
+
+sensor_readings = Table(
+    'sensor_readings', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('device_id', String(64), nullable=False, server_default='default'),
+    Column('zone_id', Integer, nullable=False),
+    Column('timestamp', Float, nullable=False),
+    *(Column(name, Float) for name in CHANNELS),
+    # Device sequence number; NULL for unsequenced readings, which never conflict
+    Column('seq', BigInteger),
+    Index('ix_sensor_readings_device_zone_timestamp',
+          'device_id', 'zone_id', 'timestamp'),
+    Index('uq_sensor_readings_device_zone_seq', 'device_id', 'zone_id', 'seq',
+          unique=True),
+)
+
+_CHANNEL_COLUMNS = [sensor_readings.c[name] for name in CHANNELS]
+
+# Per-channel accumulator columns of a rollup bucket
+_ROLLUP_STATS = ('count', 'sum', 'sumsq', 'min', 'max')
+
+sensor_rollups = Table(
+    'sensor_rollups', metadata,
+    Column('device_id', String(64), primary_key=True),
+    Column('zone_id', Integer, primary_key=True),
+    Column('tier', Integer, primary_key=True),  # bucket width in seconds
+    Column('bucket', BigInteger, primary_key=True),  # bucket start, epoch seconds
+    Column('readings', Integer, nullable=False),
+    *(Column(f'{name}_{stat}', Integer if stat == 'count' else Float,
+             nullable=stat != 'count')
+      for name in CHANNELS for stat in _ROLLUP_STATS),
+)
+
+# How often the writer deletes rollup buckets past their tier's retention
+ROLLUP_PRUNE_INTERVAL = 300
+
+
+def _empty_window() -> Tuple[np.ndarray, np.ndarray]:
+    return (np.empty(0, dtype=np.float64),
+            np.empty((len(CHANNELS), 0), dtype=np.float32))
+
+
+class NullPersistence:
+    """Persistence backend used when no database is configured."""
+
+    enabled = False
+    tiers = ()
+
+    def write(self, device_id: str, zone_id: int, timestamp: float,
+              values: Sequence[float]):
+        pass
+
+    def write_many(self, device_id: str, zone_id: int, timestamps: np.ndarray,
+                   values: np.ndarray, seqs: Optional[np.ndarray] = None,
+                   on_commit: Optional[Callable[[bool], None]] = None):
+        if on_commit is not None:
+            on_commit(True)
+
+    def last_seqs(self) -> Dict[str, int]:
+        return {}
+
+    def query(self, device_id: str, zone_id: int, since: Optional[float] = None,
+              until: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        return _empty_window()
+
+    def query_chunks(self, device_id: str, zone_id: int, since: Optional[float] = None,
+                     until: Optional[float] = None, chunk_size: int = 10000
+                     ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        return iter(())
+
+    def iter_since(self, since: float) -> Iterator[Tuple[str, int, float, Tuple]]:
+        return iter(())
+
+    def rollups(self, device_id: str, zone_id: int, tier: Tier, since: float,
+                until: Optional[float] = None) -> Rollup:
+        return empty_rollup()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLPersistence:
+    """SQLAlchemy-backed store with a batching background writer.
+
+    For SQLite the database runs in WAL mode so the writer does not block
+    readers serving range queries. Rollups need an upsert, so they are only
+    kept on SQLite and PostgreSQL; there, readings repeating a stored
+    (device_id, zone_id, seq) are also skipped on insert, and rollups are
+    built from the rows the insert returns so skipped readings aren't
+    counted again.
+    """
+
+    enabled = True
+
+    def __init__(self, url: str = DEFAULT_DATABASE_URL, batch_size: int = 500,
+                 flush_interval: float = 1.0, max_pending: int = 100000,
+                 tiers: Sequence[Tier] = DEFAULT_TIERS):
+        self.engine = create_engine(url)
+        dialect = self.engine.dialect.name
+        if dialect == 'sqlite':
+            event.listen(self.engine, 'connect', _configure_sqlite)
+        self.upserts = dialect in ('sqlite', 'postgresql')
+        self.tiers = tuple(tiers) if self.upserts else ()
+        _migrate(self.engine)
+        backfill = self.tiers and not inspect(self.engine).has_table('sensor_rollups')
+        metadata.create_all(self.engine)
+        # create_all() only adds indexes along with a new table
+        for index in sensor_readings.indexes:
+            index.create(self.engine, checkfirst=True)
+        if backfill:
+            _backfill_rollups(self.engine, self.tiers)
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._next_prune = 0.0
+        # A transaction failed since on_commit callbacks last ran
+        self._failed = False
+        self._stopped = threading.Event()
+        self._writer = threading.Thread(target=self._run_writer,
+                                        name='sensor-db-writer', daemon=True)
+        self._writer.start()
+
+    def write(self, device_id: str, zone_id: int, timestamp: float,
+              values: Sequence[float]):
+        """Queue a reading for the background writer."""
+        self.write_many(device_id, zone_id, np.array([timestamp], dtype=np.float64),
+                        np.asarray(values, dtype=np.float64).reshape(-1, 1))
+
+    def write_many(self, device_id: str, zone_id: int, timestamps: np.ndarray,
+                   values: np.ndarray, seqs: Optional[np.ndarray] = None,
+                   on_commit: Optional[Callable[[bool], None]] = None):
+        """Queue a run of readings; `values` has shape (len(CHANNELS), n).
+
+        `seqs` are the readings' device sequence numbers, NO_SEQ (-1) for none.
+        The writer calls `on_commit(stored)` once the readings' transaction
+        has ended; `stored` is False if it, or any transaction since the
+        previous callback, failed to commit.
+        """
+        columns = [[None if v != v else v for v in channel]
+                   for channel in values.astype(np.float64).tolist()]
+        seq_column = [None] * len(timestamps) if seqs is None else \
+            [None if seq < 0 else seq for seq in seqs.tolist()]
+        rows = []
+        for i, timestamp in enumerate(timestamps.tolist()):
+            row = {'device_id': device_id, 'zone_id': zone_id, 'timestamp': timestamp,
+                   'seq': seq_column[i]}
+            for name, column in zip(CHANNELS, columns):
+                row[name] = column[i]
+            rows.append(row)
+        self._pending.put((rows, on_commit))
+
+    def _rollup_rows(self, readings: Sequence[Tuple]) -> List[Dict]:
+        """Rollup rows, one per tier bucket, of (device_id, zone_id, timestamp, *CHANNELS)."""
+        by_zone: Dict = {}
+        for reading in readings:
+            by_zone.setdefault((reading[0], reading[1]), []).append(reading[2:])
+        rows = []
+        for (device_id, zone_id), zone_readings in by_zone.items():
+            table = np.array(zone_readings, dtype=np.float64)  # NULL channels become NaN
+            table = table[np.argsort(table[:, 0], kind='stable')]
+            timestamps, values = table[:, 0], table[:, 1:].T
+            for tier in self.tiers:
+                rollup = aggregate(timestamps, values, tier.seconds)
+                stats = {'count': rollup.count.tolist(), 'sum': rollup.total.tolist(),
+                         'sumsq': rollup.sumsq.tolist(), 'min': rollup.minimum.tolist(),
+                         'max': rollup.maximum.tolist()}
+                for i, (bucket, count) in enumerate(zip(rollup.starts.tolist(),
+                                                        rollup.readings.tolist())):
+                    row = {'device_id': device_id, 'zone_id': zone_id, 'tier': tier.seconds,
+                           'bucket': int(bucket), 'readings': count}
+                    for stat, channels in stats.items():
+                        for name, column in zip(CHANNELS, channels):
+                            value = column[i]
+                            row[f'{name}_{stat}'] = None if value != value else value
+                    rows.append(row)
+        return rows
+
+    def _run_writer(self):
+        while not self._stopped.is_set() or not self._pending.empty():
+            try:
+                chunks = [self._pending.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            size = len(chunks[0][0])
+            while size < self.batch_size:
+                try:
+                    chunks.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+                size += len(chunks[-1][0])
+            batch = [row for rows, _ in chunks for row in rows]
+            try:
+                with self.engine.begin() as conn:
+                    if batch and self.tiers:
+                        inserted = conn.execute(self._readings_insert().returning(
+                            sensor_readings.c.device_id, sensor_readings.c.zone_id,
+                            sensor_readings.c.timestamp, *_CHANNEL_COLUMNS), batch).all()
+                        rollups = self._rollup_rows(inserted)
+                        if rollups:
+                            conn.execute(self._rollup_upsert(), rollups)
+                    elif batch:
+                        conn.execute(self._readings_insert(), batch)
+            except Exception as e:
+                print(f"Error writing {len(batch)} readings to database: {e}")
+                self._failed = True
+            try:
+                self._notify([on_commit for _, on_commit in chunks if on_commit is not None])
+            finally:
+                for _ in chunks:
+                    self._pending.task_done()
+            if self.tiers and time.time() >= self._next_prune:
+                self._prune_rollups()
+
+    def _notify(self, callbacks: List[Callable[[bool], None]]):
+        if not callbacks:
+            return
+        stored, self._failed = not self._failed, False
+        for on_commit in callbacks:
+            try:
+                on_commit(stored)
+            except Exception as e:
+                print(f"Error acknowledging stored readings: {e}")
+
+    def _readings_insert(self):
+        """INSERT that skips readings whose (device_id, zone_id, seq) is stored."""
+        if not self.upserts:
+            return sensor_readings.insert()
+        if self.engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        return insert(sensor_readings).on_conflict_do_nothing()
+
+    def _rollup_upsert(self):
+        """INSERT ... ON CONFLICT that folds a bucket into an existing one."""
+        if self.engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+            smaller, larger = func.least, func.greatest
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+            # SQLite's scalar min()/max() return NULL if either side is NULL
+            smaller = lambda a, b: func.min(func.coalesce(a, b), func.coalesce(b, a))
+            larger = lambda a, b: func.max(func.coalesce(a, b), func.coalesce(b, a))
+        stmt = insert(sensor_rollups)
+        current, new = sensor_rollups.c, stmt.excluded
+        updates = {'readings': current.readings + new.readings}
+        for name in CHANNELS:
+            for stat in ('count', 'sum', 'sumsq'):
+                column = f'{name}_{stat}'
+                updates[column] = func.coalesce(current[column], 0) + func.coalesce(new[column], 0)
+            updates[f'{name}_min'] = smaller(current[f'{name}_min'], new[f'{name}_min'])
+            updates[f'{name}_max'] = larger(current[f'{name}_max'], new[f'{name}_max'])
+        return stmt.on_conflict_do_update(
+            index_elements=['device_id', 'zone_id', 'tier', 'bucket'], set_=updates)
+
+    def _prune_rollups(self):
+        self._next_prune = time.time() + ROLLUP_PRUNE_INTERVAL
+        try:
+            with self.engine.begin() as conn:
+                for tier in self.tiers:
+                    conn.execute(sensor_rollups.delete().where(and_(
+                        sensor_rollups.c.tier == tier.seconds,
+                        sensor_rollups.c.bucket < time.time() - tier.retention)))
+        except Exception as e:
+            print(f"Error pruning rollups: {e}")
+
+    def query(self, device_id: str, zone_id: int, since: Optional[float] = None,
+              until: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (timestamps, values) for a zone in [since, until), oldest first."""
+        with self.engine.connect() as conn:
+            rows = conn.execute(_window_select(device_id, zone_id, since, until)).all()
+        if not rows:
+            return _empty_window()
+        return _window_arrays(rows)
+
+    def query_chunks(self, device_id: str, zone_id: int, since: Optional[float] = None,
+                     until: Optional[float] = None, chunk_size: int = 10000
+                     ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """query() as consecutive chunks of at most `chunk_size` readings.
+
+        Rows are fetched a chunk at a time, so memory use doesn't grow with
+        the length of the window.
+        """
+        stmt = _window_select(device_id, zone_id, since, until)
+        with self.engine.connect() as conn:
+            result = conn.execution_options(yield_per=chunk_size).execute(stmt)
+            for rows in result.partitions():
+                yield _window_arrays(rows)
+
+    def iter_since(self, since: float,
+                   chunk_size: int = 10000) -> Iterator[Tuple[str, int, float, Tuple]]:
+        """Yield (device_id, zone_id, timestamp, values) for readings since a time."""
+        stmt = (select(sensor_readings.c.device_id, sensor_readings.c.zone_id,
+                       sensor_readings.c.timestamp, *_CHANNEL_COLUMNS)
+                .where(sensor_readings.c.timestamp >= since)
+                .order_by(sensor_readings.c.timestamp)
+                .execution_options(yield_per=chunk_size))
+        with self.engine.connect() as conn:
+            for row in conn.execute(stmt):
+                values = tuple(np.nan if v is None else v for v in row[3:])
+                yield row[0], row[1], row[2], values
+
+    def last_seqs(self) -> Dict[str, int]:
+        """Highest stored sequence number of each device that sent any."""
+        stmt = (select(sensor_readings.c.device_id, func.max(sensor_readings.c.seq))
+                .where(sensor_readings.c.seq.is_not(None))
+                .group_by(sensor_readings.c.device_id))
+        with self.engine.connect() as conn:
+            return {device_id: int(seq) for device_id, seq in conn.execute(stmt)}
+
+    def rollups(self, device_id: str, zone_id: int, tier: Tier, since: float,
+                until: Optional[float] = None) -> Rollup:
+        """Buckets of one tier for a zone, starting from the bucket holding `since`."""
+        columns = [sensor_rollups.c[f'{name}_{stat}']
+                   for stat in _ROLLUP_STATS for name in CHANNELS]
+        stmt = (select(sensor_rollups.c.bucket, sensor_rollups.c.readings, *columns)
+                .where(sensor_rollups.c.device_id == device_id)
+                .where(sensor_rollups.c.zone_id == zone_id)
+                .where(sensor_rollups.c.tier == tier.seconds)
+                .where(sensor_rollups.c.bucket >= since // tier.seconds * tier.seconds)
+                .order_by(sensor_rollups.c.bucket))
+        if until is not None:
+            stmt = stmt.where(sensor_rollups.c.bucket < until)
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(stmt).all()
+        if not rows:
+            return empty_rollup()
+        table = np.array(rows, dtype=np.float64)  # NULL min/max become NaN
+        n = len(CHANNELS)
+        stats = [table[:, 2 + i * n:2 + (i + 1) * n].T for i in range(len(_ROLLUP_STATS))]
+        count, total, sumsq, minimum, maximum = stats
+        return Rollup(table[:, 0], table[:, 1].astype(np.int64),
+                      count.astype(np.int64), total, sumsq, minimum, maximum)
+
+    def flush(self):
+        """Block until every queued reading has been written and its on_commit called."""
+        self._pending.join()
+
+    def close(self):
+        """Stop the writer after draining pending readings."""
+        self._stopped.set()
+        self._writer.join()
+        self.engine.dispose()
+
+
+def _window_select(device_id: str, zone_id: int, since: Optional[float],
+                   until: Optional[float]):
+    stmt = (select(sensor_readings.c.timestamp, *_CHANNEL_COLUMNS)
+            .where(sensor_readings.c.device_id == device_id)
+            .where(sensor_readings.c.zone_id == zone_id)
+            .order_by(sensor_readings.c.timestamp))
+    if since is not None:
+        stmt = stmt.where(sensor_readings.c.timestamp >= since)
+    if until is not None:
+        stmt = stmt.where(sensor_readings.c.timestamp < until)
+    return stmt
+
+
+def _window_arrays(rows) -> Tuple[np.ndarray, np.ndarray]:
+    table = np.array(rows, dtype=np.float64)
+    return table[:, 0], table[:, 1:].T.astype(np.float32)
+
+
+def _migrate(engine):
+    """Bring a database created before readings carried a device_id or seq up to date."""
+    inspector = inspect(engine)
+    if not inspector.has_table('sensor_readings'):
+        return
+    columns = {column['name'] for column in inspector.get_columns('sensor_readings')}
+    with engine.begin() as conn:
+        if 'device_id' not in columns:
+            conn.execute(text("ALTER TABLE sensor_readings ADD COLUMN device_id "
+                              "VARCHAR(64) NOT NULL DEFAULT 'default'"))
+            conn.execute(text('DROP INDEX IF EXISTS ix_sensor_readings_zone_timestamp'))
+        if 'seq' not in columns:
+            conn.execute(text('ALTER TABLE sensor_readings ADD COLUMN seq BIGINT'))
+
+
+def _backfill_rollups(engine, tiers: Sequence[Tier]):
+    """Build rollups for readings stored before the rollup table existed."""
+    now = time.time()
+    readings = sensor_readings.c
+    with engine.begin() as conn:
+        for tier in tiers:
+            if engine.dialect.name == 'postgresql':
+                bucket = func.floor(readings.timestamp / tier.seconds)
+            else:
+                bucket = cast(readings.timestamp / tier.seconds, Integer)
+            bucket = cast(bucket, BigInteger) * tier.seconds
+            columns = [readings.device_id, readings.zone_id,
+                       literal(tier.seconds).label('tier'), bucket.label('bucket'),
+                       func.count().label('readings')]
+            for name in CHANNELS:
+                column = readings[name]
+                columns += [func.count(column), func.coalesce(func.sum(column), 0),
+                            func.coalesce(func.sum(column * column), 0),
+                            func.min(column), func.max(column)]
+            query = (select(*columns)
+                     .where(readings.timestamp >= now - tier.retention)
+                     .group_by(readings.device_id, readings.zone_id, bucket))
+            conn.execute(sensor_rollups.insert().from_select(
+                [column.name for column in sensor_rollups.c], query))
+
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+def create_persistence(url: Optional[str]):
+    """Build the persistence backend for a database URL ('' or 'none' disables it)."""
+    if not url or url.lower() == 'none':
+        return NullPersistence()
+    return SQLPersistence(url)
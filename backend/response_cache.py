@@ -0,0 +1,91 @@
+"""
+LRU cache of serialized JSON responses, keyed by request and data version.
+Entries are looked up with the version of the data they were built from,
+so a bump on ingest or configuration change retires them without any
+explicit invalidation.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, NamedTuple, Optional, Tuple
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    headers: Tuple[Tuple[str, str], ...]
+    created: float
+
+
+def body_etag(body: bytes) -> str:
+    """Strong ETag derived from the response body."""
+    return hashlib.blake2b(body, digest_size=12).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU bounded by entry count and total body bytes."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Hashable, CachedResponse]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._evictions = 0
+
+    def get(self, key: Hashable, max_age: Optional[float] = None) -> Optional[CachedResponse]:
+        """The entry for `key`, unless missing or older than `max_age` seconds."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and max_age is not None and \
+                    time.monotonic() - entry.created > max_age:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry
+
+    def put(self, key: Hashable, body: bytes, headers: Tuple[Tuple[str, str], ...] = ()
+            ) -> CachedResponse:
+        """Store a response body; bodies larger than the whole cache are not kept."""
+        entry = CachedResponse(body, body_etag(body), headers, time.monotonic())
+        if len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+        return entry
+
+    def _remove(self, key: Hashable):
+        self._bytes -= len(self._entries.pop(key).body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,130 @@
+"""
+Multi-resolution rollups of sensor readings.
+Readings are pre-aggregated into fixed time buckets per tier as they are
+persisted, so long-range queries read a few buckets instead of every reading.
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from aggregates import summarize
+from downsample import bucket_records
+from storage import CHANNELS
+
+# Default point budget for history queries that don't pass max_points
+DEFAULT_POINT_BUDGET = 2000
+
+
+class Tier(NamedTuple):
+    name: str
+    seconds: int
+    retention: float  # seconds of buckets kept
+
+
+DEFAULT_TIERS = (
+    Tier('1m', 60, 7 * 86400),
+    Tier('1h', 3600, 365 * 86400),
+    Tier('1d', 86400, 10 * 365 * 86400),
+)
+
+
+class Rollup(NamedTuple):
+    """Aggregated buckets, oldest first; per-channel arrays are (len(CHANNELS), n)."""
+    starts: np.ndarray
+    readings: np.ndarray
+    count: np.ndarray
+    total: np.ndarray
+    sumsq: np.ndarray
+    minimum: np.ndarray  # NaN for channels without values
+    maximum: np.ndarray
+
+
+def empty_rollup() -> Rollup:
+    channels = np.empty((len(CHANNELS), 0), dtype=np.float64)
+    return Rollup(np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64),
+                  np.empty((len(CHANNELS), 0), dtype=np.int64),
+                  channels, channels, channels, channels)
+
+
+def tier_named(tiers: Sequence[Tier], name: str) -> Optional[Tier]:
+    for tier in tiers:
+        if tier.name == name:
+            return tier
+    return None
+
+
+def _reduce_runs(keys: np.ndarray, readings: np.ndarray, count: np.ndarray,
+                 total: np.ndarray, sumsq: np.ndarray, minimum: np.ndarray,
+                 maximum: np.ndarray):
+    """Combine per-reading (or per-bucket) accumulators over runs of equal keys."""
+    runs = np.flatnonzero(np.r_[True, np.diff(keys) != 0])
+    return (keys[runs],
+            np.add.reduceat(readings, runs),
+            np.add.reduceat(count, runs, axis=1),
+            np.add.reduceat(total, runs, axis=1),
+            np.add.reduceat(sumsq, runs, axis=1),
+            np.fmin.reduceat(minimum, runs, axis=1),
+            np.fmax.reduceat(maximum, runs, axis=1))
+
+
+def aggregate(timestamps: np.ndarray, values: np.ndarray, seconds: int) -> Rollup:
+    """Bucket a timestamp-sorted run of readings at one tier's resolution."""
+    data = values.astype(np.float64)
+    valid = ~np.isnan(data)
+    filled = np.where(valid, data, 0.0)
+    buckets = (timestamps // seconds).astype(np.int64) * seconds
+    keys, *stats = _reduce_runs(buckets, np.ones(len(timestamps), dtype=np.int64),
+                                valid.astype(np.int64), filled, filled * filled,
+                                data, data)
+    return Rollup(keys.astype(np.float64), *stats)
+
+
+def rebucket(rollup: Rollup, start: float, end: float, max_points: int) -> Rollup:
+    """Merge tier buckets into at most `max_points` equal-width buckets on [start, end]."""
+    if len(rollup.starts) <= max_points:
+        return rollup
+    width = max(end - start, 1e-9) / max_points
+    index = np.clip(((rollup.starts - start) // width).astype(np.int64), 0, max_points - 1)
+    index, *stats = _reduce_runs(index, *rollup[1:])
+    return Rollup(start + index * width, *stats)
+
+
+def rollup_means(rollup: Rollup) -> np.ndarray:
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return rollup.total / rollup.count
+
+
+def summarize_rollup(rollup: Rollup) -> Dict:
+    """Stats dict (see aggregates.summarize) over every bucket of a rollup."""
+    return summarize(int(rollup.readings.sum()),
+                     rollup.count.sum(axis=1),
+                     rollup.total.sum(axis=1),
+                     rollup.sumsq.sum(axis=1),
+                     np.fmin.reduce(rollup.minimum, axis=1, initial=np.inf),
+                     np.fmax.reduce(rollup.maximum, axis=1, initial=-np.inf))
+
+
+def select_tier(tiers: Sequence[Tier], span: float,
+                max_points: int) -> Optional[Tier]:
+    """Tier to answer a query over `span` seconds with about `max_points` points.
+
+    Picks the coarsest tier that keeps the whole span and is still at least
+    as fine as the requested resolution. None means raw readings are needed
+    because the resolution is finer than any tier. If no tier is fine enough
+    the finest one keeping the span is used, and failing that the coarsest.
+    """
+    resolution = span / max_points
+    if resolution < tiers[0].seconds:
+        return None
+    retained = [tier for tier in tiers if tier.retention >= span]
+    if not retained:
+        return tiers[-1]
+    fine_enough = [tier for tier in retained if tier.seconds <= resolution]
+    return fine_enough[-1] if fine_enough else retained[0]
+
+
+def rollup_records(rollup: Rollup) -> List[Dict]:
+    """JSON-ready bucket records: channel means plus 'readings', 'min' and 'max'."""
+    return bucket_records(rollup.starts, rollup.readings, rollup_means(rollup),
+                          rollup.minimum, rollup.maximum)
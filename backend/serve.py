@@ -0,0 +1,148 @@
+"""
+Run the backend as several worker processes sharing one port.
+Workers keep device state in shared memory (see shared_state.py) and relay
+Socket.IO emits through a message queue, so any worker can take any request.
+Socket.IO clients must use the websocket transport: long-polling needs every
+request of a session to reach the same worker. Workers each write to the
+database, so DATABASE_URL should name a database server rather than SQLite.
+
+Usage (from the backend directory):
+    python serve.py --workers 4
+"""
+
+import argparse
+import multiprocessing
+import multiprocessing.connection
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+from message_hub import MessageHub
+from persistence import DEFAULT_DATABASE_URL
+
+# How long the first worker may take to restore history and start listening
+STARTUP_TIMEOUT = 300
+
+
+def listen_socket(host: str, port: int) -> socket.socket:
+    """A listening socket sharing the port with the other workers (SO_REUSEPORT)."""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    return sock
+
+
+def exit_on_sigterm():
+    """Exit normally on the first SIGTERM, so cleanup and atexit handlers run.
+
+    Repeats are ignored: process managers often signal the whole group, so
+    a worker gets one SIGTERM from them and another from the launcher.
+    """
+    def handle(signum, frame):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, handle)
+
+
+def run_worker(host: str, port: int):
+    """Worker process: import the app and serve it; the launcher handles Ctrl-C."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # atexit handlers flush pending database writes
+    exit_on_sigterm()
+    import app as backend
+
+    sock = listen_socket(host, port)
+    mode = backend.socketio.async_mode
+    if mode == 'eventlet':
+        import eventlet.wsgi
+        from eventlet.greenio import GreenSocket
+        eventlet.wsgi.server(GreenSocket(sock), backend.app)
+    elif mode == 'threading':
+        from werkzeug.serving import make_server
+        make_server(host, port, backend.app, threaded=True, fd=sock.fileno()).serve_forever()
+    else:
+        raise RuntimeError(f'serve.py does not support the {mode} async mode')
+
+
+def wait_listening(process, host: str, port: int):
+    """Block until `process` accepts connections on the port."""
+    address = '127.0.0.1' if host in ('0.0.0.0', '') else '::1' if host == '::' else host
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if not process.is_alive():
+            raise RuntimeError(f'{process.name} exited during startup')
+        try:
+            socket.create_connection((address, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{process.name} did not start listening within {STARTUP_TIMEOUT}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int,
+                        default=int(os.environ.get('WEB_CONCURRENCY', 1)),
+                        help='worker processes (default: WEB_CONCURRENCY or 1)')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error('--workers must be positive')
+    database_url = os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL)
+    if args.workers > 1 and database_url.startswith('sqlite'):
+        print(f"Warning: {args.workers} workers share {database_url}; SQLite takes one "
+              f"writer at a time, so set DATABASE_URL to a database server")
+
+    # State lives for the run unless SHARED_STATE_DIR names a directory to keep
+    owned_state = 'SHARED_STATE_DIR' not in os.environ
+    if owned_state:
+        shm = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        os.environ['SHARED_STATE_DIR'] = tempfile.mkdtemp(prefix='irrigation-', dir=shm)
+    state_dir = os.environ['SHARED_STATE_DIR']
+    hub = None
+    if args.workers > 1 and not os.environ.get('SOCKETIO_MESSAGE_QUEUE'):
+        hub = MessageHub(os.path.join(state_dir, 'socketio.sock'))
+        hub.start()
+        os.environ['SOCKETIO_MESSAGE_QUEUE'] = f'unix://{hub.path}'
+
+    exit_on_sigterm()
+    context = multiprocessing.get_context('spawn')
+    workers = []
+    print(f"Starting {args.workers} worker(s) on http://{args.host}:{args.port} "
+          f"with shared state in {state_dir}")
+    try:
+        for index in range(args.workers):
+            process = context.Process(target=run_worker, args=(args.host, args.port),
+                                      name=f'worker-{index}')
+            process.start()
+            workers.append(process)
+            if index == 0:
+                # The first worker migrates the database and restores history
+                # into the shared state before the others attach to it
+                wait_listening(process, args.host, args.port)
+        # A worker exiting takes the service down, for the platform to restart
+        multiprocessing.connection.wait([process.sentinel for process in workers])
+        print('A worker exited; shutting down')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.join()
+        if hub is not None:
+            hub.close()
+        if owned_state:
+            shutil.rmtree(state_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
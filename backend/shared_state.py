@@ -0,0 +1,424 @@
+"""
+Device state shared by several worker processes.
+Ring buffers, rolling stats, sequence numbers, status and zone configuration
+of every device live in memory-mapped files under SHARED_STATE_DIR (best a
+tmpfs such as /dev/shm), so any worker can ingest or query any device.
+"""
+
+import json
+import mmap
+import os
+import threading
+import uuid
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # optional, POSIX only
+    fcntl = None
+
+import numpy as np
+
+from aggregates import (BUCKETS_PER_WINDOW, DEFAULT_WINDOWS_HOURS, StatsAggregator,
+                        ZoneAggregates)
+from devices import CapacityExceeded, DeviceRegistry, DeviceState, initial_status
+from storage import CHANNELS, DEFAULT_CAPACITY, SensorStore, ZoneBuffer
+
+DEFAULT_MAX_DEVICES = 4096
+DEFAULT_MAX_ZONES = 8
+# Status and zone configuration of a device, as JSON
+META_BYTES = 16 * 1024
+# UTF-8 bytes of a device ID
+DEVICE_ID_BYTES = 256
+
+_FORMAT = 2
+# Registry header: settings the files were laid out with, then the device count
+_SETTINGS, _COUNT = slice(0, 6), 6
+# Device header fields
+(_GENERATION, _SERIAL, _VERSION, _LAST_SEQ, _META_CHANGES, _META_LENGTH, _ZONES,
+ _ACCEPTED_SEQ, _SEQ_EPOCH) = range(9)
+_HEADER_FIELDS = 10
+
+Spec = Tuple[Tuple[int, ...], type]
+
+
+def _views(buffer, offset: int, specs: Sequence[Spec]) -> Tuple[List[np.ndarray], int]:
+    """Arrays of the given (shape, dtype) laid out from `offset`, and the end offset."""
+    arrays = []
+    for shape, dtype in specs:
+        count = int(np.prod(shape))
+        arrays.append(np.frombuffer(buffer, dtype, count, offset).reshape(shape))
+        offset += -(-count * np.dtype(dtype).itemsize // 8) * 8
+    return arrays, offset
+
+
+def _size(specs: Sequence[Spec]) -> int:
+    return sum(-(-int(np.prod(shape)) * np.dtype(dtype).itemsize // 8) * 8
+               for shape, dtype in specs)
+
+
+def _map(path: str, size: int, create: bool = False) -> mmap.mmap:
+    """Map a state file; a new one is allocated up front and reads as zeros."""
+    fd = os.open(path, os.O_RDWR | (os.O_CREAT | os.O_EXCL if create else 0), 0o600)
+    try:
+        if create:
+            # Reserving the pages now turns a full tmpfs into an error here
+            # rather than a SIGBUS on first write
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+        return mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+
+class SharedLock:
+    """Reentrant lock excluding other threads and other processes.
+
+    Threads of a process queue on a threading.RLock; the outermost holder
+    also takes an fcntl lock on one byte of the lock file. `on_acquire` and
+    `on_release` run under both, to sync process-local copies of the
+    shared state.
+    """
+
+    def __init__(self, fd: int, offset: int, on_acquire=None, on_release=None):
+        self._fd = fd
+        self._offset = offset
+        self._on_acquire = on_acquire
+        self._on_release = on_release
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, self._offset)
+                try:
+                    if self._on_acquire is not None:
+                        self._on_acquire()
+                except BaseException:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, self._offset)
+                    raise
+            except BaseException:
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        try:
+            if self._depth == 0:
+                try:
+                    if self._on_release is not None:
+                        self._on_release()
+                finally:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, self._offset)
+        finally:
+            self._lock.release()
+
+
+class SharedZoneBuffer(ZoneBuffer):
+    """ZoneBuffer whose arrays, and positions between locks, are shared."""
+
+    def __init__(self, capacity: int, serials, header: np.ndarray, arrays):
+        super().__init__(capacity, serials, arrays)
+        self._header = header  # head, size, last serial, evicted serial
+        self.load()
+
+    def load(self):
+        self._head, self._size, self._last_serial, self._evicted_serial = \
+            self._header.tolist()
+
+    def store(self):
+        self._header[:] = (self._head, self._size, self._last_serial, self._evicted_serial)
+
+
+class SharedSensorStore(SensorStore):
+    def __init__(self, device: 'SharedDeviceState'):
+        super().__init__(device.capacity)
+        self._device = device
+        # Cursors stay valid across workers, but not across state directories
+        self.generation = f'{int(device.header[_GENERATION]):08x}'
+
+    def _new_zone(self, zone_id: int) -> ZoneBuffer:
+        return self._device.create_zone(zone_id)[0]
+
+
+class SharedStatsAggregator(StatsAggregator):
+    def __init__(self, device: 'SharedDeviceState'):
+        super().__init__(device.windows_hours, device.buckets)
+        self._device = device
+
+    def _new_zone(self, zone_id: int) -> ZoneAggregates:
+        return self._device.create_zone(zone_id)[1]
+
+
+class SharedDeviceState(DeviceState):
+    """DeviceState backed by a state file shared with other workers.
+
+    Ring buffers and rolling stats are written in place. Positions, serials,
+    status and zone configs are loaded when `lock` is taken and written back
+    when it is released, so they are only valid while holding it;
+    `version` and the sequence numbers are read from the file directly.
+    """
+
+    def __init__(self, device_id: str, path: str, registry: 'SharedDeviceRegistry',
+                 index: int, create: bool = False):
+        self.device_id = device_id
+        self.capacity = registry.capacity
+        self.windows_hours = registry.windows_hours
+        self.buckets = registry.buckets
+        self.max_zones = registry.max_zones
+        self._zone_specs = registry.zone_specs
+        self._buffer = _map(path, registry.device_size, create)
+        (self.header, self._zone_ids, self._meta), self._zones_offset = _views(
+            self._buffer, 0, self.header_specs(self.max_zones))
+        if create:
+            self.header[_GENERATION] = uuid.uuid4().int & 0x7fffffff or 1
+            self.header[_SERIAL] = self.header[_LAST_SEQ] = self.header[_ACCEPTED_SEQ] = -1
+
+        self.readings = SharedSensorStore(self)
+        self.stats = SharedStatsAggregator(self)
+        self._buffers: List[SharedZoneBuffer] = []
+        self.zone_configs: Dict[int, Dict] = {}
+        self.status = initial_status()
+        self._meta_changes = -1
+        self._meta_json = b''
+        self.lock = SharedLock(registry.lock_fd, 1 + index, self._load, self._store)
+
+    @staticmethod
+    def header_specs(max_zones: int) -> List[Spec]:
+        return [((_HEADER_FIELDS,), np.int64), ((max_zones,), np.int64),
+                ((META_BYTES,), np.uint8)]
+
+    @staticmethod
+    def zone_specs(capacity: int, windows: int, buckets: int) -> List[Spec]:
+        return [((4,), np.int64), ((2 * capacity,), np.float64),
+                ((len(CHANNELS), 2 * capacity), np.float32), ((2 * capacity,), np.int64),
+                *ZoneAggregates.shapes(windows, buckets)]
+
+    @property
+    def version(self) -> int:
+        return int(self.header[_VERSION])
+
+    @version.setter
+    def version(self, value: int):
+        self.header[_VERSION] = value
+
+    @property
+    def last_seq(self) -> Optional[int]:
+        value = int(self.header[_LAST_SEQ])
+        return None if value < 0 else value
+
+    @last_seq.setter
+    def last_seq(self, value: Optional[int]):
+        self.header[_LAST_SEQ] = -1 if value is None else value
+
+    @property
+    def accepted_seq(self) -> Optional[int]:
+        value = int(self.header[_ACCEPTED_SEQ])
+        return None if value < 0 else value
+
+    @accepted_seq.setter
+    def accepted_seq(self, value: Optional[int]):
+        self.header[_ACCEPTED_SEQ] = -1 if value is None else value
+
+    @property
+    def seq_epoch(self) -> int:
+        return int(self.header[_SEQ_EPOCH])
+
+    @seq_epoch.setter
+    def seq_epoch(self, value: int):
+        self.header[_SEQ_EPOCH] = value
+
+    def _attach_zone(self, slot: int) -> Tuple[SharedZoneBuffer, ZoneAggregates]:
+        offset = self._zones_offset + slot * _size(self._zone_specs)
+        (header, *buffer_arrays), _ = _views(self._buffer, offset, self._zone_specs[:4])
+        aggregate_arrays, _ = _views(self._buffer, offset + _size(self._zone_specs[:4]),
+                                     self._zone_specs[4:])
+        zone_id = int(self._zone_ids[slot])
+        buffer = SharedZoneBuffer(self.capacity, self.readings._serials, header,
+                                  tuple(buffer_arrays))
+        aggregates = ZoneAggregates([hours * 3600 for hours in self.windows_hours],
+                                    self.buckets, tuple(aggregate_arrays))
+        self.readings._zones[zone_id] = buffer
+        self.stats._zones[zone_id] = aggregates
+        self._buffers.append(buffer)
+        return buffer, aggregates
+
+    def create_zone(self, zone_id: int) -> Tuple[SharedZoneBuffer, ZoneAggregates]:
+        """Lay out a new zone's buffer and stats; called holding `lock`."""
+        slot = int(self.header[_ZONES])
+        if slot >= self.max_zones:
+            raise CapacityExceeded(f'device {self.device_id} has more than '
+                                   f'{self.max_zones} zones; raise SHARED_MAX_ZONES')
+        offset = self._zones_offset + slot * _size(self._zone_specs)
+        (header,), _ = _views(self._buffer, offset, self._zone_specs[:1])
+        header[:] = (0, 0, -1, -1)
+        aggregate_arrays, _ = _views(self._buffer, offset + _size(self._zone_specs[:4]),
+                                     self._zone_specs[4:])
+        ZoneAggregates.reset_arrays(tuple(aggregate_arrays))
+        self._zone_ids[slot] = zone_id
+        self.header[_ZONES] = slot + 1
+        return self._attach_zone(slot)
+
+    def reserve_zones(self, zone_ids: Iterable[int]):
+        """Lay out the zones that don't exist yet, or none if they don't all fit."""
+        new = sorted(set(zone_ids) - set(self.readings.zone_ids()))
+        if int(self.header[_ZONES]) + len(new) > self.max_zones:
+            raise CapacityExceeded(f'device {self.device_id} has more than '
+                                   f'{self.max_zones} zones; raise SHARED_MAX_ZONES')
+        for zone_id in new:
+            self.create_zone(zone_id)
+
+    def _load(self):
+        for slot in range(len(self._buffers), int(self.header[_ZONES])):
+            self._attach_zone(slot)
+        for buffer in self._buffers:
+            buffer.load()
+        self.readings._serials.last = int(self.header[_SERIAL])
+        changes = int(self.header[_META_CHANGES])
+        if changes != self._meta_changes:
+            self._meta_json = self._meta[:int(self.header[_META_LENGTH])].tobytes()
+            meta = json.loads(self._meta_json) if self._meta_json else {}
+            self.status = meta.get('status', initial_status())
+            self.zone_configs = {int(zone_id): config for zone_id, config
+                                 in meta.get('zone_configs', {}).items()}
+            self._meta_changes = changes
+
+    def _store(self):
+        for buffer in self._buffers:
+            buffer.store()
+        self.header[_SERIAL] = self.readings._serials.last
+        meta = json.dumps({'status': self.status, 'zone_configs': self.zone_configs}).encode()
+        if meta == self._meta_json:
+            return
+        if len(meta) > META_BYTES:
+            # Drop the local change; the stored copy is reloaded on next lock
+            self._meta_changes = -1
+            raise ValueError(f'status and zone configuration of device {self.device_id} '
+                             f'exceed {META_BYTES} bytes')
+        self._meta[:len(meta)] = np.frombuffer(meta, dtype=np.uint8)
+        self.header[_META_LENGTH] = len(meta)
+        self.header[_META_CHANGES] += 1
+        self._meta_changes = int(self.header[_META_CHANGES])
+        self._meta_json = meta
+
+
+class SharedDeviceRegistry(DeviceRegistry):
+    """DeviceRegistry whose devices live in a directory shared by workers.
+
+    Devices are numbered in the order any worker first saw them; the
+    `registry` file maps numbers to IDs, device N's state is in `device-N`,
+    and byte 0 (registry) or 1 + N (device) of `locks` is its lock. The
+    first process to open the directory lays it out and has `created` set.
+    """
+
+    def __init__(self, path: str, capacity: int = DEFAULT_CAPACITY,
+                 windows_hours: Sequence[float] = DEFAULT_WINDOWS_HOURS,
+                 max_devices: int = DEFAULT_MAX_DEVICES,
+                 max_zones: int = DEFAULT_MAX_ZONES,
+                 buckets: int = BUCKETS_PER_WINDOW):
+        if fcntl is None:
+            raise RuntimeError('Shared device state needs a POSIX system')
+        self.path = path
+        self.capacity = capacity
+        self.windows_hours = tuple(windows_hours)
+        self.max_devices = max_devices
+        self.max_zones = max_zones
+        self.buckets = buckets
+        self.zone_specs = SharedDeviceState.zone_specs(capacity, len(self.windows_hours),
+                                                       buckets)
+        self.device_size = (_size(SharedDeviceState.header_specs(max_zones))
+                            + max_zones * _size(self.zone_specs))
+
+        os.makedirs(path, exist_ok=True)
+        self.lock_fd = os.open(os.path.join(path, 'locks'), os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock = SharedLock(self.lock_fd, 0)
+        settings = (_FORMAT, capacity, max_zones, max_devices, buckets,
+                    zlib.crc32(repr(self.windows_hours).encode()))
+        registry_path = os.path.join(path, 'registry')
+        specs = [((8,), np.int64), ((max_devices,), np.int64),
+                 ((max_devices, DEVICE_ID_BYTES), np.uint8)]
+        with self._lock:
+            self.created = not os.path.exists(registry_path)
+            self._buffer = _map(registry_path, _size(specs), self.created)
+            (self._header, self._id_lengths, self._ids), _ = _views(self._buffer, 0, specs)
+            if self.created:
+                self._header[_SETTINGS] = settings
+            elif tuple(self._header[_SETTINGS].tolist()) != settings:
+                raise ValueError(f'{path} holds device state laid out with other settings; '
+                                 f'remove it or choose another SHARED_STATE_DIR')
+
+        self._states: List[SharedDeviceState] = []
+        self._devices: Dict[str, SharedDeviceState] = {}
+        self._attach_lock = threading.Lock()
+
+    def _refresh(self):
+        """Attach devices other workers have added since the last call."""
+        with self._attach_lock:
+            for index in range(len(self._states), int(self._header[_COUNT])):
+                device_id = self._ids[index, :self._id_lengths[index]].tobytes().decode()
+                state = SharedDeviceState(device_id, self._device_path(index), self, index)
+                self._states.append(state)
+                self._devices[device_id] = state
+
+    def _device_path(self, index: int) -> str:
+        return os.path.join(self.path, f'device-{index}')
+
+    def __contains__(self, device_id: str) -> bool:
+        return self.get(device_id) is not None
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._states)
+
+    def __iter__(self) -> Iterator[DeviceState]:
+        self._refresh()
+        yield from list(self._states)
+
+    def get(self, device_id: str) -> Optional[DeviceState]:
+        state = self._devices.get(device_id)
+        if state is None:
+            self._refresh()
+            state = self._devices.get(device_id)
+        return state
+
+    def get_or_create(self, device_id: str,
+                      zone_configs: Optional[Dict[int, Dict]] = None) -> DeviceState:
+        state = self.get(device_id)
+        if state is not None:
+            return state
+        with self._lock:
+            state = self.get(device_id)
+            if state is None:
+                state = self._create(device_id, zone_configs)
+        return state
+
+    def _create(self, device_id: str, zone_configs: Optional[Dict[int, Dict]]
+                ) -> SharedDeviceState:
+        encoded = device_id.encode()
+        if len(encoded) > DEVICE_ID_BYTES:
+            raise ValueError('device_id is too long')
+        self._refresh()
+        index = int(self._header[_COUNT])
+        if index >= self.max_devices:
+            raise CapacityExceeded(f'shared state holds {self.max_devices} devices; '
+                                   f'raise SHARED_MAX_DEVICES')
+        state = SharedDeviceState(device_id, self._device_path(index), self, index,
+                                  create=True)
+        if zone_configs:
+            with state.lock:
+                state.zone_configs.update(zone_configs)
+        self._ids[index, :len(encoded)] = np.frombuffer(encoded, dtype=np.uint8)
+        self._id_lengths[index] = len(encoded)
+        with self._attach_lock:
+            # Published last, once the device file is complete
+            self._header[_COUNT] = index + 1
+            self._states.append(state)
+            self._devices[device_id] = state
+        return state
@@ -7,18 +7,23 @@ import requests
 import time
 import random
 import json
+from collections import deque
 from datetime import datetime
 
 API_URL = "http://localhost:5000/api/sensor-data"
+BATCH_URL = API_URL + "/batch"
+# Readings kept while the backend is unreachable, like the firmware's buffer
+BUFFER_CAPACITY = 240
+MAX_UPLOAD_SAMPLES = 30
 
-def simulate_sensor_reading():
-    """Generate realistic sensor data for 4 zones."""
+def simulate_sensor_reading(num_zones=4):
+    """Generate realistic sensor data for `num_zones` zones."""
     data = {
         "pump_running": False,
         "active_zones": []
     }
     
-    for zone_id in range(4):
+    for zone_id in range(num_zones):
         # Simulate realistic sensor values
         soil_moisture = random.uniform(30, 75)
         temperature = random.uniform(18, 28)
@@ -51,25 +56,72 @@ def simulate_sensor_reading():
     
     return data
 
+def backlog_payload(backlog):
+    """Batch payload replaying the oldest buffered samples."""
+    readings = []
+    for seq, taken_at, sensor_data in list(backlog)[:MAX_UPLOAD_SAMPLES]:
+        for zone_id in range(4):
+            readings.append({"zone_id": zone_id, "seq": seq, "timestamp": taken_at,
+                             **sensor_data[str(zone_id)]})
+    latest = backlog[-1][2]
+    return {"pump_running": latest["pump_running"],
+            "active_zones": latest["active_zones"],
+            "readings": readings}
+
+def acknowledge(backlog, ack_seq):
+    """Drop buffered samples the backend has acknowledged (ack_seq is None until one is stored)."""
+    while backlog and ack_seq is not None and backlog[0][0] <= ack_seq:
+        backlog.popleft()
+
+def send_backlog(backlog):
+    """Send buffered samples oldest first, one upload at a time, until all are acknowledged.
+    
+    Stops early, keeping the rest buffered, on an error or an upload that
+    acknowledged nothing. Returns whether the backlog was emptied.
+    """
+    while backlog:
+        if len(backlog) == 1:
+            response = requests.post(
+                API_URL,
+                json={**backlog[0][2], "seq": backlog[0][0]},
+                headers={"Content-Type": "application/json"},
+                timeout=5
+            )
+        else:
+            # Replay what was buffered while the backend was unreachable
+            response = requests.post(BATCH_URL, json=backlog_payload(backlog), timeout=5)
+        
+        if response.status_code != 200:
+            print(f"Error: HTTP {response.status_code}, {len(backlog)} samples buffered")
+            return False
+        before = len(backlog)
+        acknowledge(backlog, response.json().get("ack_seq"))
+        if len(backlog) == before:
+            print(f"Nothing acknowledged, {len(backlog)} samples buffered")
+            return False
+        if before > 1:
+            print(f"Replayed backlog, {before - len(backlog)} samples acknowledged, "
+                  f"{len(backlog)} buffered")
+    return True
+
 def run_simulation():
     """Run the simulation and send data to the API."""
     print("Starting Irrigation Controller Simulation...")
     print(f"Sending data to: {API_URL}")
     print("Press Ctrl+C to stop\n")
     
+    # Sequence numbers start at the clock so restarts keep them increasing
+    seq = int(time.time())
+    backlog = deque(maxlen=BUFFER_CAPACITY)
+    
     try:
         while True:
             sensor_data = simulate_sensor_reading()
+            backlog.append((seq, time.time(), sensor_data))
+            seq += 1
             
             try:
-                response = requests.post(
-                    API_URL,
-                    json=sensor_data,
-                    headers={"Content-Type": "application/json"},
-                    timeout=5
-                )
-                
-                if response.status_code == 200:
+                if send_backlog(backlog):
                     timestamp = datetime.now().strftime("%H:%M:%S")
                     active_zones = sensor_data.get("active_zones", [])
                     pump_status = "ON" if sensor_data.get("pump_running") else "OFF"
@@ -82,11 +134,9 @@ def run_simulation():
                               f"Temp={zone_data['temperature']:.1f}°C, "
                               f"Humidity={zone_data['humidity']:.1f}%, "
                               f"Prediction={zone_data['water_prediction']:.1f}ml")
-                else:
-                    print(f"Error: HTTP {response.status_code}")
                     
             except requests.exceptions.RequestException as e:
-                print(f"Error sending data: {e}")
+                print(f"Error sending data: {e}, {len(backlog)} samples buffered")
             
             # Wait before next reading
             time.sleep(30)  # Send data every 30 seconds
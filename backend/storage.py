@@ -0,0 +1,342 @@
+"""
+Columnar time-series storage for sensor readings.
+Each zone keeps a fixed-capacity circular buffer backed by NumPy arrays.
+"""
+
+import uuid
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+CHANNELS = ('soil_moisture', 'temperature', 'humidity',
+            'water_prediction', 'water_applied')
+CHANNEL_INDEX = {name: i for i, name in enumerate(CHANNELS)}
+
+DEFAULT_CAPACITY = 1000
+
+# float32 cannot represent most decimal sensor values exactly; rounding on
+# the way out keeps 40.1 from being reported as 40.099998474121094.
+OUTPUT_DECIMALS = 4
+
+
+def _to_float(value) -> float:
+    """Convert a JSON value to float, mapping missing/invalid values to NaN."""
+    if value is None or isinstance(value, bool):
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def reading_values(reading: Dict) -> Tuple[float, ...]:
+    """Extract channel values from a reading dict in CHANNELS order."""
+    values = tuple(_to_float(reading.get(name)) for name in CHANNELS)
+    if np.isnan(values[-1]):
+        # Devices omit water_applied when no zone was watered
+        values = values[:-1] + (0.0,)
+    return values
+
+
+class SerialCounter:
+    """Hands out increasing serial numbers, in blocks for runs of readings."""
+
+    def __init__(self):
+        self.last = -1
+
+    def take(self, n: int = 1) -> int:
+        """Reserve `n` consecutive serials and return the first."""
+        first = self.last + 1
+        self.last += n
+        return first
+
+
+class ZoneBuffer:
+    """Fixed-capacity circular buffer of readings for a single zone.
+
+    Every reading is written twice, at slot ``i`` and ``i + capacity``, so the
+    most recent ``capacity`` readings always sit in one contiguous slice and
+    any window can be returned as a view without copying.
+
+    Each stored reading also gets a serial number in insertion order (shared
+    with the other zones of a SensorStore), so clients can ask for exactly
+    the readings added after the last one they saw; see after().
+
+    `arrays` optionally supplies preallocated (timestamps, values, serials)
+    of shape (2 * capacity,), (len(CHANNELS), 2 * capacity) and
+    (2 * capacity,), e.g. views into shared memory.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY,
+                 serials: Optional[SerialCounter] = None,
+                 arrays: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None):
+        if capacity <= 0:
+            raise ValueError('capacity must be positive')
+        self.capacity = capacity
+        if arrays is None:
+            arrays = (np.zeros(2 * capacity, dtype=np.float64),
+                      np.full((len(CHANNELS), 2 * capacity), np.nan, dtype=np.float32),
+                      np.zeros(2 * capacity, dtype=np.int64))
+        self._timestamps, self._values, self._serials = arrays
+        self._counter = serials or SerialCounter()
+        self._head = 0  # next slot to write, in [0, capacity)
+        self._size = 0
+        self._last_serial = -1  # newest serial stored in this zone
+        self._evicted_serial = -1  # newest serial overwritten or dropped
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes allocated for this buffer's arrays."""
+        return self._timestamps.nbytes + self._values.nbytes + self._serials.nbytes
+
+    def append(self, timestamp: float, values: Tuple[float, ...]):
+        """Append one reading, overwriting the oldest when full.
+
+        In-order readings are O(1). A reading older than the latest one is
+        inserted at its sorted position so the time index stays ordered.
+        """
+        if self._size and timestamp < self._timestamps[self._head + self.capacity - 1]:
+            self._insert(timestamp, values)
+            return
+        i = self._head
+        j = i + self.capacity
+        if self._size == self.capacity:
+            self._evict(self._serials[i:i + 1])
+        serial = self._counter.take()
+        self._timestamps[i] = self._timestamps[j] = timestamp
+        self._values[:, i] = self._values[:, j] = values
+        self._serials[i] = self._serials[j] = self._last_serial = serial
+        self._head = (i + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+
+    def extend(self, timestamps: np.ndarray, values: np.ndarray):
+        """Append a run of readings sorted by timestamp.
+
+        `values` has shape (len(CHANNELS), n). A run that starts after the
+        latest stored reading is written with one vectorized copy; otherwise
+        it is merged with the retained readings.
+        """
+        if not len(timestamps):
+            return
+        first = self._counter.take(len(timestamps))
+        serials = np.arange(first, first + len(timestamps), dtype=np.int64)
+        self._last_serial = int(serials[-1])
+        if self._size and timestamps[0] < self._timestamps[self._head + self.capacity - 1]:
+            lo, hi = self._bounds()
+            merged = np.concatenate((self._timestamps[lo:hi], timestamps))
+            order = np.argsort(merged, kind='stable')
+            all_serials = np.concatenate((self._serials[lo:hi], serials))
+            self._evict(all_serials[order[:-self.capacity]])
+            order = order[-self.capacity:]
+            values = np.concatenate((self._values[:, lo:hi], values), axis=1)[:, order]
+            timestamps = merged[order]
+            serials = all_serials[order]
+            self._head = self._size = 0
+        else:
+            self._evict(serials[:-self.capacity])
+            overflow = self._size + min(len(timestamps), self.capacity) - self.capacity
+            if overflow > 0:
+                lo = self._bounds()[0]
+                self._evict(self._serials[lo:lo + overflow])
+            timestamps = timestamps[-self.capacity:]
+            values = values[:, -self.capacity:]
+            serials = serials[-self.capacity:]
+        self._write(self._head, timestamps, values, serials)
+        self._head = (self._head + len(timestamps)) % self.capacity
+        self._size = min(self._size + len(timestamps), self.capacity)
+
+    def _insert(self, timestamp: float, values: Tuple[float, ...]):
+        lo, hi = self._bounds()
+        pos = lo + int(np.searchsorted(self._timestamps[lo:hi], timestamp,
+                                       side='right'))
+        if self._size == self.capacity and pos == lo:
+            return  # older than everything retained, nothing to keep
+        new_ts = np.array([timestamp], dtype=np.float64)
+        new_values = np.array(values, dtype=np.float32).reshape(-1, 1)
+        new_serial = np.array([self._counter.take()], dtype=np.int64)
+        self._last_serial = int(new_serial[0])
+        if self._size < self.capacity:
+            # Shift [pos, hi) one slot towards the head
+            self._write(pos,
+                        np.concatenate((new_ts, self._timestamps[pos:hi])),
+                        np.concatenate((new_values, self._values[:, pos:hi]), axis=1),
+                        np.concatenate((new_serial, self._serials[pos:hi])))
+            self._head = (self._head + 1) % self.capacity
+            self._size += 1
+        else:
+            # Full: drop the oldest reading and shift (lo, pos) back by one
+            self._evict(self._serials[lo:lo + 1])
+            self._write(lo,
+                        np.concatenate((self._timestamps[lo + 1:pos], new_ts)),
+                        np.concatenate((self._values[:, lo + 1:pos], new_values), axis=1),
+                        np.concatenate((self._serials[lo + 1:pos], new_serial)))
+
+    def _write(self, start: int, timestamps: np.ndarray, values: np.ndarray,
+               serials: np.ndarray):
+        """Write a run of readings starting at a doubled-array position."""
+        slots = (start + np.arange(len(timestamps))) % self.capacity
+        for offset in (0, self.capacity):
+            self._timestamps[slots + offset] = timestamps
+            self._values[:, slots + offset] = values
+            self._serials[slots + offset] = serials
+
+    def _evict(self, serials: np.ndarray):
+        if len(serials):
+            self._evicted_serial = max(self._evicted_serial, int(serials.max()))
+
+    def _bounds(self) -> Tuple[int, int]:
+        end = self._head + self.capacity
+        return end - self._size, end
+
+    def window(self, since: Optional[float] = None,
+               until: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (timestamps, values) views of readings in [since, until).
+
+        Bounds are located by bisection on the ordered time index, so the
+        cost is independent of how much history is stored. `values` has
+        shape (len(CHANNELS), n). Both arrays are views into the buffer and
+        are only valid until the next append.
+        """
+        lo, hi = self._bounds()
+        timestamps = self._timestamps[lo:hi]
+        if until is not None:
+            hi = lo + int(np.searchsorted(timestamps, until, side='left'))
+        if since is not None:
+            lo += int(np.searchsorted(timestamps, since, side='left'))
+        hi = max(lo, hi)
+        return self._timestamps[lo:hi], self._values[:, lo:hi]
+
+    def after(self, serial: int, since: Optional[float] = None
+              ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Copies of the readings stored after `serial`, in time order.
+
+        Returns None when some of them have already been overwritten, i.e.
+        the caller fell too far behind and has to reload the whole window.
+        Readings before `since` are left out.
+        """
+        if self._evicted_serial > serial:
+            return None
+        if self._last_serial <= serial:
+            return self._timestamps[:0].copy(), self._values[:, :0].copy()
+        lo, hi = self._bounds()
+        if since is not None:
+            lo += int(np.searchsorted(self._timestamps[lo:hi], since, side='left'))
+        index = lo + np.flatnonzero(self._serials[lo:hi] > serial)
+        return self._timestamps[index], self._values[:, index]
+
+    def oldest(self) -> Optional[float]:
+        """Timestamp of the oldest retained reading, or None when empty."""
+        if not self._size:
+            return None
+        return float(self._timestamps[self._head + self.capacity - self._size])
+
+    def latest(self) -> Optional[float]:
+        """Timestamp of the most recent reading, or None when empty."""
+        if not self._size:
+            return None
+        return float(self._timestamps[self._head + self.capacity - 1])
+
+
+def records_from_arrays(timestamps: np.ndarray, values: np.ndarray) -> List[Dict]:
+    """Convert timestamp/value arrays into JSON-ready reading dicts."""
+    rounded = values.astype(np.float64).round(OUTPUT_DECIMALS)
+    columns = []
+    for channel in rounded:
+        column = channel.tolist()
+        if np.isnan(channel).any():
+            column = [None if v != v else v for v in column]
+        columns.append(column)
+
+    records = []
+    for row, ts in enumerate(timestamps.tolist()):
+        record = {'timestamp': datetime.fromtimestamp(ts).isoformat()}
+        for name, column in zip(CHANNELS, columns):
+            record[name] = column[row]
+        records.append(record)
+    return records
+
+
+def parse_timestamp(value) -> float:
+    """Parse an epoch number (seconds or milliseconds) or ISO-8601 string."""
+    if isinstance(value, bool):
+        raise ValueError('invalid timestamp')
+    if isinstance(value, (int, float)):
+        timestamp = float(value)
+        # ESP32/JS clocks commonly report milliseconds
+        return timestamp / 1000 if timestamp > 1e11 else timestamp
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp()
+    raise ValueError('invalid timestamp')
+
+
+class SensorStore:
+    """Per-zone collection of ring buffers.
+
+    Serial numbers are shared by all zones, so one cursor marks a point in
+    the store's history. Cursors carry the store's random generation and
+    are refused by any other store, e.g. the one rebuilt after a restart.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.generation = uuid.uuid4().hex[:8]
+        self._serials = SerialCounter()
+        self._zones: Dict[int, ZoneBuffer] = {}
+
+    def __contains__(self, zone_id: int) -> bool:
+        return zone_id in self._zones
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._zones)
+
+    def zone(self, zone_id: int) -> Optional[ZoneBuffer]:
+        """Return the buffer for a zone, or None if it has no readings."""
+        return self._zones.get(zone_id)
+
+    def zone_ids(self) -> List[int]:
+        return list(self._zones)
+
+    def append(self, zone_id: int, timestamp: float, values: Tuple[float, ...]):
+        """Store a reading for a zone, creating its buffer on first use.
+
+        `values` are in CHANNELS order, as returned by reading_values().
+        """
+        buffer = self._zones.get(zone_id)
+        if buffer is None:
+            buffer = self._zones[zone_id] = self._new_zone(zone_id)
+        buffer.append(timestamp, values)
+
+    def extend(self, zone_id: int, timestamps: np.ndarray, values: np.ndarray):
+        """Store a sorted run of readings for a zone (see ZoneBuffer.extend)."""
+        buffer = self._zones.get(zone_id)
+        if buffer is None:
+            buffer = self._zones[zone_id] = self._new_zone(zone_id)
+        buffer.extend(timestamps, values)
+
+    def _new_zone(self, zone_id: int) -> ZoneBuffer:
+        return ZoneBuffer(self.capacity, self._serials)
+
+    def cursor(self) -> str:
+        """Opaque token for everything stored so far."""
+        return f'{self.generation}-{self._serials.last}'
+
+    def parse_cursor(self, cursor: str) -> Optional[int]:
+        """Serial number of a cursor issued by this store, or None if it is foreign."""
+        generation, _, serial = cursor.partition('-')
+        if generation != self.generation:
+            return None
+        try:
+            serial = int(serial)
+        except ValueError:
+            return None
+        return serial if -1 <= serial <= self._serials.last else None
+
+    @property
+    def nbytes(self) -> int:
+        """Total bytes allocated across all zone buffers."""
+        return sum(buffer.nbytes for buffer in self._zones.values())
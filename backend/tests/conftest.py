@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The app module starts its workers on import; keep it in memory and model-free
+os.environ.setdefault('DATABASE_URL', 'none')
+os.environ.setdefault('NUMPY_MODEL_PATH', '')
+os.environ.setdefault('MODEL_PATH', '')
+
+
+@pytest.fixture(scope='session')
+def backend():
+    import app
+    return app
+
+
+@pytest.fixture
+def client(backend):
+    return backend.app.test_client()
@@ -0,0 +1,71 @@
+import time
+
+from ingest import IngestJob, parse_batch
+
+
+def upload(client, device_id, seqs):
+    return client.post('/api/sensor-data/batch', json={'device_id': device_id, 'readings': [
+        {'zone_id': 0, 'seq': seq, 'soil_moisture': 40.0, 'age': 100 - seq} for seq in seqs]})
+
+
+def test_uploads_are_acknowledged_once_stored(backend, client):
+    body = upload(client, 'ack-stored', [1, 2, 3]).get_json()
+    assert body['accepted'] == 3
+    backend.ingest_queue.join()
+    backend.persistence.flush()
+    # The replay of stored readings is a duplicate and carries the ack
+    body = upload(client, 'ack-stored', [2, 3, 4]).get_json()
+    assert body['duplicates'] == 2
+    assert body['ack_seq'] == 3
+
+
+def test_single_uploads_are_acknowledged_once_stored(backend, client):
+    reading = {'device_id': 'ack-single', 'seq': 7, '0': {'soil_moisture': 40}}
+    assert client.post('/api/sensor-data', json=reading).status_code == 200
+    backend.ingest_queue.join()
+    body = client.post('/api/sensor-data', json=reading).get_json()
+    assert body == {'status': 'duplicate', 'ack_seq': 7}
+
+
+def apply(backend, device_id, seqs):
+    device = backend.devices.get_or_create(device_id)
+    with device.lock:
+        epoch = device.seq_epoch
+        device.accepted_seq = max(seqs)
+    batch = parse_batch({'device_id': device_id, 'readings': [
+        {'zone_id': 0, 'seq': seq, 'soil_moisture': 40.0} for seq in seqs]},
+        time.time(), 'default')
+    backend.apply_ingest([IngestJob(batch.groups, batch.device_ids, {}, time.time(),
+                                    batch.accepted, {device_id: epoch})])
+    return device
+
+
+class FailingPersistence:
+    def write_many(self, *args, on_commit=None):
+        if on_commit is not None:
+            on_commit(False)
+
+
+def test_readings_the_database_lost_are_not_acknowledged(backend, monkeypatch):
+    device = apply(backend, 'ack-lost', [1, 2])
+    assert device.last_seq == 2
+    monkeypatch.setattr(backend, 'persistence', FailingPersistence())
+    apply(backend, 'ack-lost', [3, 4])
+    assert device.last_seq == 2
+    # The device's replay is queued again rather than dropped as a duplicate
+    assert device.accepted_seq == 2
+
+
+def test_readings_queued_before_a_loss_do_not_skip_past_it(backend):
+    device = backend.devices.get_or_create('ack-epoch')
+    with device.lock:
+        device.last_seq, device.accepted_seq = 5, 12
+        epoch = device.seq_epoch
+    backend.acknowledge('ack-epoch', [(epoch, 8)], True)
+    assert device.last_seq == 8
+    backend.acknowledge('ack-epoch', [(epoch, 10)], False)
+    backend.acknowledge('ack-epoch', [(epoch, 12)], True)
+    assert device.last_seq == 8
+    assert device.accepted_seq == 8
+    backend.acknowledge('ack-epoch', [(epoch + 1, 12)], True)
+    assert device.last_seq == 12
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from aggregates import (BUCKETS_PER_WINDOW, DEFAULT_WINDOWS_HOURS, StatsAggregator,
+                        ZoneAggregates, summarize_window)
+from storage import CHANNELS
+
+WINDOWS = [hours * 3600 for hours in DEFAULT_WINDOWS_HOURS]
+START = 1_700_000_000.0
+
+
+def raw_summary(timestamps, values, window, now):
+    """summarize_window() over the buckets the window covers at `now`."""
+    width = window / BUCKETS_PER_WINDOW
+    newest = now // width
+    buckets = timestamps // width
+    inside = (buckets > newest - BUCKETS_PER_WINDOW) & (buckets <= newest)
+    return summarize_window(values[:, inside])
+
+
+def random_readings(rng, n, start):
+    timestamps = start + np.cumsum(rng.exponential(900, n))
+    # Whole numbers keep the sums exact whichever order they are added in
+    values = rng.integers(0, 100, (len(CHANNELS), n)).astype(np.float64)
+    values[rng.random(values.shape) < 0.2] = np.nan
+    values[1:3, rng.random(n) < 0.1] = np.nan
+    return timestamps, values
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_windows_match_raw_readings_as_they_roll_over(seed):
+    rng = np.random.default_rng(seed)
+    zone = ZoneAggregates(WINDOWS)
+    seen_timestamps, seen_values = np.empty(0), np.empty((len(CHANNELS), 0))
+    start = START
+    # About 20 days of readings, so every window rolls over several times
+    for _ in range(40):
+        n = int(rng.integers(1, 100))
+        timestamps, values = random_readings(rng, n, start)
+        start = timestamps[-1]
+        if rng.random() < 0.3:
+            # A few late readings, up to two hours old
+            late = rng.random(n) < 0.2
+            timestamps[late] -= rng.uniform(0, 7200, late.sum())
+            for i in range(n):
+                zone.add(timestamps[i], values[:, i])
+        else:
+            zone.add_many(timestamps, values)
+        seen_timestamps = np.concatenate((seen_timestamps, timestamps))
+        seen_values = np.concatenate((seen_values, values), axis=1)
+
+        for now in (start, start + rng.uniform(0, 3 * 86400)):
+            for window, seconds in enumerate(WINDOWS):
+                assert zone.summary(window, now) == raw_summary(
+                    seen_timestamps, seen_values, seconds, now)
+
+
+def test_single_and_batch_adds_agree():
+    rng = np.random.default_rng(1)
+    timestamps, values = random_readings(rng, 500, START)
+    one, many = ZoneAggregates(WINDOWS), ZoneAggregates(WINDOWS)
+    for i in range(len(timestamps)):
+        one.add(timestamps[i], values[:, i])
+    many.add_many(timestamps, values)
+    for window in range(len(WINDOWS)):
+        assert one.summary(window, timestamps[-1]) == many.summary(window, timestamps[-1])
+
+
+def test_channels_without_values_have_no_stats():
+    zone = ZoneAggregates(WINDOWS)
+    zone.add_many(np.array([START, START + 1]), np.full((len(CHANNELS), 2), np.nan))
+    summary = zone.summary(0, START + 1)
+    assert summary['readings'] == 2
+    assert summary['channels']['soil_moisture'] == {
+        'count': 0, 'mean': 0, 'min': None, 'max': None, 'variance': None}
+
+
+def test_stats_aggregator_only_answers_for_known_zones_and_windows():
+    stats = StatsAggregator()
+    stats.add(3, START, [40.0, 20.0, 50.0, 0.0, 1.0])
+    assert stats.covers(24) and not stats.covers(6)
+    assert stats.summary(4, 24, START) is None
+    assert stats.summary(3, 24, START)['channels']['soil_moisture']['mean'] == 40.0
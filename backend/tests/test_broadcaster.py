@@ -0,0 +1,73 @@
+from broadcaster import Broadcaster, device_room, zone_room
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, event, payload, to=None):
+        self.emitted.append((event, to, payload))
+
+    def take(self):
+        emitted, self.emitted = self.emitted, []
+        return {room: payload['data'] | ({'status': payload['status']}
+                                         if 'status' in payload else {})
+                for _, room, payload in emitted}
+
+
+def test_updates_are_coalesced_into_diffs_per_room():
+    socketio = FakeSocketIO()
+    broadcaster = Broadcaster(socketio)
+    broadcaster.publish('d', {0: {'soil_moisture': 40.0, 'temperature': 20.0}},
+                        status={'pump_running': False})
+    broadcaster.publish('d', {0: {'soil_moisture': 41.0}, 1: {'soil_moisture': 30.0}})
+    broadcaster.flush()
+    assert socketio.take() == {
+        device_room('d'): {'0': {'soil_moisture': 41.0, 'temperature': 20.0},
+                           '1': {'soil_moisture': 30.0},
+                           'status': {'pump_running': False}},
+        zone_room('d', 0): {'0': {'soil_moisture': 41.0, 'temperature': 20.0}},
+        zone_room('d', 1): {'1': {'soil_moisture': 30.0}},
+    }
+
+    # Only the fields that changed are sent, and unchanged zones not at all
+    broadcaster.publish('d', {0: {'soil_moisture': 41.0, 'temperature': 21.0},
+                              1: {'soil_moisture': 30.0}},
+                        status={'pump_running': False})
+    broadcaster.flush()
+    assert socketio.take() == {
+        device_room('d'): {'0': {'temperature': 21.0}},
+        zone_room('d', 0): {'0': {'temperature': 21.0}},
+    }
+    broadcaster.publish('d', {1: {'soil_moisture': 30.0}})
+    broadcaster.flush()
+    assert socketio.take() == {}
+    assert broadcaster.snapshot('d', [0]) == (
+        {'0': {'soil_moisture': 41.0, 'temperature': 21.0}}, {'pump_running': False})
+
+
+def test_full_zones_are_sent_without_diffs():
+    socketio = FakeSocketIO()
+    broadcaster = Broadcaster(socketio, diffs=False)
+    for _ in range(2):
+        broadcaster.publish('d', {0: {'soil_moisture': 40.0, 'temperature': 20.0}})
+        broadcaster.flush()
+        assert socketio.take()[device_room('d')] == {
+            '0': {'soil_moisture': 40.0, 'temperature': 20.0}}
+
+
+def test_idle_devices_are_forgotten():
+    socketio = FakeSocketIO()
+    broadcaster = Broadcaster(socketio, idle_seconds=0)
+    broadcaster.publish('d', {0: {'soil_moisture': 40.0}})
+    broadcaster.publish('e', {0: {'soil_moisture': 40.0}})
+    broadcaster.flush()
+    broadcaster.publish('e', {0: {'soil_moisture': 41.0}})
+    broadcaster.flush()
+    assert set(broadcaster._sent_zones) == {'e'}
+    assert broadcaster.snapshot('d') == ({}, {})
+    # A forgotten device's next update is sent whole
+    socketio.take()
+    broadcaster.publish('d', {0: {'soil_moisture': 40.0}})
+    broadcaster.flush()
+    assert socketio.take()[device_room('d')] == {'0': {'soil_moisture': 40.0}}
@@ -0,0 +1,99 @@
+import json
+
+import numpy as np
+import pytest
+
+from codec import (PACKED_HEADER, PACKED_RECORD, UnsupportedEncoding,
+                   decode_document, decode_packed, encode_packed)
+from ingest import MAX_BATCH_READINGS, MAX_DEVICE_ID_LENGTH
+
+NOW = 1_700_000_000.0
+NAN = float('nan')
+
+
+def test_packed_uploads_round_trip():
+    body = encode_packed('esp32-a', [
+        (1, NOW - 10, [40.5, 21.0, 55.0, 3.0, 1.5]),
+        (0, 0, [41.0, 22.0, 56.0, 0.0, NAN]),
+        (1, NOW - 20, [39.5, 20.0, 54.0, 2.0, 0.0]),
+    ], pump_running=True, active_zones=[1, 31])
+    packed = decode_packed(body, NOW)
+    assert packed.device_id == 'esp32-a'
+    assert packed.pump_running
+    assert packed.active_zones == [1, 31]
+    assert packed.batch.accepted == 3
+    groups = {group.zone_id: group for group in packed.batch.groups}
+    # Timestamp 0 is stamped with the server time, a missing water_applied is 0
+    np.testing.assert_array_equal(groups[0].timestamps, [NOW])
+    np.testing.assert_array_equal(groups[0].values[:, 0], [41.0, 22.0, 56.0, 0.0, 0.0])
+    np.testing.assert_array_equal(groups[1].timestamps, [NOW - 20, NOW - 10])
+    np.testing.assert_array_equal(groups[1].values[0], [39.5, 40.5])
+
+
+def test_packed_readings_without_sensor_values_are_rejected():
+    body = encode_packed('esp32-a', [(0, NOW, [NAN, NAN, NAN, NAN, NAN]),
+                                     (0, NOW, [NAN, 20.0, NAN, NAN, NAN]),
+                                     (40, NOW, [40.0, 20.0, 50.0, 0.0, 0.0])])
+    batch = decode_packed(body, NOW).batch
+    assert batch.accepted == 1
+    assert [result.get('error') for result in batch.results] == [
+        'no sensor values', None, 'invalid zone_id']
+
+
+def test_empty_packed_uploads_decode():
+    packed = decode_packed(encode_packed('esp32-a', []), NOW)
+    assert packed.batch.accepted == 0 and packed.batch.results == []
+
+
+def with_header(body, **fields):
+    header = dict(zip(('magic', 'version', 'flags', 'id_length', 'count', 'zones'),
+                      PACKED_HEADER.unpack_from(body)))
+    header.update(fields)
+    return PACKED_HEADER.pack(*header.values()) + body[PACKED_HEADER.size:]
+
+
+@pytest.mark.parametrize('mutate, message', [
+    (lambda body: body[:PACKED_HEADER.size - 1], 'shorter than its header'),
+    (lambda body: with_header(body, magic=b'JUNK'), 'Not a packed'),
+    (lambda body: with_header(body, version=2), 'Not a packed'),
+    (lambda body: body[:-1], 'does not match its record count'),
+    (lambda body: body + b'\0' * PACKED_RECORD.itemsize, 'does not match its record count'),
+    (lambda body: with_header(body, count=3), 'does not match its record count'),
+    (lambda body: with_header(body, count=MAX_BATCH_READINGS + 1), 'At most'),
+])
+def test_malformed_packed_uploads_are_refused(mutate, message):
+    body = encode_packed('esp32-a', [(0, NOW, [40.0] * 5), (1, NOW, [41.0] * 5)])
+    with pytest.raises(ValueError, match=message):
+        decode_packed(mutate(body), NOW)
+
+
+def test_packed_device_ids_are_checked():
+    for device_id in ('', 'x' * (MAX_DEVICE_ID_LENGTH + 1)):
+        with pytest.raises(ValueError, match='invalid device_id'):
+            decode_packed(encode_packed(device_id, [(0, NOW, [40.0] * 5)]), NOW)
+    body = encode_packed('ab', [(0, NOW, [40.0] * 5)])
+    with pytest.raises(ValueError):
+        decode_packed(body.replace(b'ab', b'\xff\xfe', 1), NOW)
+
+
+def test_documents_are_decoded_by_content_type():
+    assert decode_document('application/json; charset=utf-8', b'{"a": 1}') == {'a': 1}
+    assert decode_document(None, json.dumps([1]).encode()) == [1]
+    with pytest.raises(UnsupportedEncoding):
+        decode_document('text/plain', b'a')
+
+
+def test_packed_uploads_are_ingested(backend, client):
+    body = encode_packed('packed-upload', [(0, 0, [40.0] * 5), (2, 0, [41.0] * 5)],
+                         pump_running=True, active_zones=[2])
+    response = client.post('/api/sensor-data/batch', data=body,
+                           content_type='application/x-irrigation-packed')
+    assert response.status_code == 200
+    assert response.get_json()['accepted'] == 2
+    backend.ingest_queue.join()
+    device = backend.devices.get('packed-upload')
+    assert device.readings.zone_ids() == [0, 2]
+    assert device.status['pump_running'] and device.status['active_zones'] == [2]
+    response = client.post('/api/sensor-data/batch', data=body[:-1],
+                           content_type='application/x-irrigation-packed')
+    assert response.status_code == 400
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from downsample import bucket_stats, downsample, lttb_indices
+from storage import CHANNELS
+
+
+def series(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.arange(n, dtype=np.float64), rng.normal(size=n).cumsum()
+
+
+@pytest.mark.parametrize('n, threshold', [(0, 5), (1, 1), (5, 5), (5, 10)])
+def test_short_series_are_kept_whole(n, threshold):
+    x, y = series(n)
+    assert lttb_indices(x, y, threshold).tolist() == list(range(n))
+
+
+@pytest.mark.parametrize('threshold', [1, 2, 3, 10, 99])
+def test_lttb_keeps_the_ends_and_one_point_per_bucket(threshold):
+    x, y = series(100)
+    indices = lttb_indices(x, y, threshold)
+    assert len(indices) == threshold
+    assert indices[-1] == 99
+    if threshold > 1:
+        assert indices[0] == 0
+    assert (np.diff(indices) > 0).all()
+
+
+def test_lttb_keeps_spikes():
+    x, y = series(1000)
+    y[437] = 100.0
+    assert 437 in lttb_indices(x, y, 20)
+
+
+def test_buckets_without_readings_are_left_out():
+    timestamps = np.array([0.0, 1.0, 2.0, 7.0, 9.5, 10.0])
+    values = np.tile(np.arange(6, dtype=np.float64), (len(CHANNELS), 1))
+    starts, readings, mean, minimum, maximum = bucket_stats(timestamps, values, 0.0, 10.0, 5)
+    # The end of the range falls into the last bucket
+    assert starts.tolist() == [0.0, 2.0, 6.0, 8.0]
+    assert readings.tolist() == [2, 1, 1, 2]
+    assert mean[0].tolist() == [0.5, 2.0, 3.0, 4.5]
+    assert minimum[0].tolist() == [0.0, 2.0, 3.0, 4.0]
+    assert maximum[0].tolist() == [1.0, 2.0, 3.0, 5.0]
+
+
+def test_channels_without_values_have_no_bucket_stats():
+    timestamps = np.arange(10, dtype=np.float64)
+    values = np.ones((len(CHANNELS), 10))
+    values[1] = np.nan
+    values[0, :5] = np.nan
+    _, readings, mean, minimum, maximum = bucket_stats(timestamps, values, 0.0, 10.0, 2)
+    assert readings.tolist() == [5, 5]
+    assert np.isnan(mean[1]).all() and np.isnan(minimum[1]).all() and np.isnan(maximum[1]).all()
+    assert np.isnan(mean[0, 0]) and mean[0, 1] == 1.0
+
+
+def test_lttb_skips_readings_without_the_channel():
+    timestamps = np.arange(10, dtype=np.float64)
+    values = np.ones((len(CHANNELS), 10))
+    values[0] = np.nan
+    assert downsample(timestamps, values, 0.0, 10.0, 3, 'lttb') == []
+    values[0, [2, 5, 8]] = [1.0, 2.0, 3.0]
+    records = downsample(timestamps, values, 0.0, 10.0, 2, 'lttb')
+    assert [record['soil_moisture'] for record in records] == [1.0, 3.0]
@@ -0,0 +1,107 @@
+import gzip
+import json
+import re
+import time
+
+import numpy as np
+
+from persistence import SQLPersistence
+from storage import CHANNELS
+
+
+def fill(backend, device_id, readings, zones=(0, 1)):
+    device = backend.devices.get_or_create(device_id)
+    timestamps = time.time() - np.arange(readings, 0, -1, dtype=np.float64)
+    with device.lock:
+        for zone_id in zones:
+            device.add_many(zone_id, timestamps, np.full((len(CHANNELS), readings), 40.0))
+        device.version += 1
+
+
+def test_small_windows_are_cached_and_revalidated(backend, client):
+    fill(backend, 'history-small', 10)
+    response = client.get('/api/devices/history-small/sensor-data')
+    assert {zone: len(records) for zone, records in response.get_json().items()} == {
+        '0': 10, '1': 10}
+    assert response.headers['X-Rollup-Tier'] == 'raw'
+    etag = response.headers['ETag']
+    response = client.get('/api/devices/history-small/sensor-data',
+                          headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_large_windows_are_streamed(backend, client, monkeypatch):
+    monkeypatch.setattr(backend, 'CHUNK_SIZE', 15)
+    fill(backend, 'history-large', 20)
+    response = client.get('/api/devices/history-large/sensor-data')
+    assert 'ETag' not in response.headers
+    assert {zone: len(records) for zone, records in response.get_json().items()} == {
+        '0': 20, '1': 20}
+    response = client.get('/api/devices/history-large/sensor-data?zone_id=1',
+                          headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(json.loads(gzip.decompress(response.get_data()))['data']) == 20
+
+
+def test_export_formats(backend, client):
+    fill(backend, 'history-export', 3)
+    response = client.get('/api/devices/history-export/sensor-data?format=ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data().splitlines()]
+    assert [line['zone_id'] for line in lines] == [0, 0, 0, 1, 1, 1]
+    response = client.get('/api/devices/history-export/sensor-data?format=columnar&zone_id=0')
+    blocks = response.get_json()['data']
+    assert len(blocks) == 1 and blocks[0]['soil_moisture'] == [40.0] * 3
+
+
+def request_count(backend, route):
+    pattern = (r'irrigation_http_request_duration_seconds_count\{route="'
+               + re.escape(route) + r'",method="GET",status="200"\} (\d+)')
+    match = re.search(pattern, backend.metrics.render())
+    return int(match.group(1)) if match else 0
+
+
+def test_streamed_requests_are_timed_once_sent(backend, client):
+    fill(backend, 'history-timed', 3)
+    route = '/api/devices/<device_id>/sensor-data'
+    before = request_count(backend, route)
+    response = client.get('/api/devices/history-timed/sensor-data?format=ndjson')
+    assert request_count(backend, route) == before
+    response.get_data()
+    response.close()
+    assert request_count(backend, route) == before + 1
+
+
+class PendingWrites:
+    """SQL persistence whose writer has not got round to the queued readings."""
+
+    def __init__(self, store):
+        self.store = store
+        self.tiers = store.tiers
+        self.pending = []
+
+    def write_many(self, *args, **kwargs):
+        self.pending.append((args, kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+
+def test_cursor_loads_include_readings_not_yet_written(backend, client, monkeypatch, tmp_path):
+    store = SQLPersistence(f'sqlite:///{tmp_path / "readings.db"}')
+    monkeypatch.setattr(backend, 'persistence', PendingWrites(store))
+    url = '/api/devices/history-cursor/sensor-data?zone_id=0&hours=24&max_points=50'
+    reading = {'device_id': 'history-cursor', '0': {'soil_moisture': 40}}
+    try:
+        client.post('/api/sensor-data', json=reading)
+        backend.ingest_queue.join()
+        body = client.get(url + '&cursor=').get_json()
+        assert [point['soil_moisture'] for point in body['data']] == [40.0]
+        client.post('/api/sensor-data', json={**reading, '0': {'soil_moisture': 41}})
+        backend.ingest_queue.join()
+        body = client.get(f"{url}&cursor={body['cursor']}").get_json()
+        assert not body['reset']
+        assert [point['soil_moisture'] for point in body['data']] == [41.0]
+        assert client.get(url + '&cursor=&tier=1h').status_code == 400
+    finally:
+        store.close()
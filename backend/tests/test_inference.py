@@ -0,0 +1,218 @@
+import os
+import pickle
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import inference
+from inference import FEATURES, InferenceService, NumpyModel, TFLiteModel, load_model
+from ingest import ReadingGroup
+from storage import CHANNEL_INDEX, CHANNELS
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'models'))
+from export_numpy import save_npz, verify  # noqa: E402
+
+WEIGHTS = np.arange(1, len(FEATURES) + 1, dtype=np.float32)
+
+
+class LinearModel:
+    """Predicts features @ WEIGHTS and records every batch it was given."""
+
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, features):
+        self.batches.append(len(features))
+        return features @ WEIGHTS
+
+
+@pytest.fixture
+def service():
+    def create(model=None, **kwargs):
+        created = InferenceService(model or LinearModel(), **kwargs)
+        created.start()
+        return created
+    return create
+
+
+def rows(n, start=0):
+    return np.arange(start, start + n * len(FEATURES), dtype=np.float32).reshape(n, -1)
+
+
+def test_requests_within_a_tick_share_one_batch(service):
+    model = LinearModel()
+    # A long tick, cut short once max_batch rows are waiting
+    service = service(model, tick=30, max_batch=8)
+    futures = [service.submit(rows(n, 100 * n)) for n in (3, 1, 4)]
+    for n, future in zip((3, 1, 4), futures):
+        np.testing.assert_array_equal(future.result(5), rows(n, 100 * n) @ WEIGHTS)
+    assert model.batches == [8]
+    metrics = service.metrics()
+    assert metrics['requests'] == 3 and metrics['batches'] == 1
+    assert metrics['mean_batch_size'] == 8
+
+
+def test_batches_are_flushed_after_a_tick(service):
+    model = LinearModel()
+    service = service(model, tick=0.01)
+    np.testing.assert_array_equal(service.predict(rows(2)), rows(2) @ WEIGHTS)
+    np.testing.assert_array_equal(service.predict(rows(1)), rows(1) @ WEIGHTS)
+    assert model.batches == [2, 1]
+
+
+def test_model_errors_fail_the_whole_batch(service):
+    class Broken:
+        def predict(self, features):
+            raise ValueError('broken')
+
+    service = service(Broken(), tick=0.01)
+    with pytest.raises(ValueError, match='broken'):
+        service.predict(rows(1))
+    assert service.metrics()['errors'] == 1
+
+
+def test_unavailable_services_refuse_requests():
+    service = InferenceService(None, error='no model')
+    with pytest.raises(inference.ModelUnavailable, match='no model'):
+        service.submit(rows(1))
+    service.backfill([ReadingGroup('d', 0, np.array([0.0]), np.zeros((len(CHANNELS), 1)))])
+
+
+def test_backfill_fills_missing_predictions_and_tracks_drift(service):
+    service = service(tick=0.01)
+    column = CHANNEL_INDEX['water_prediction']
+
+    def group(device_id, zone_id, reported):
+        values = np.full((len(CHANNELS), len(reported)), 10.0)
+        values[column] = reported
+        return ReadingGroup(device_id, zone_id, np.zeros(len(reported)), values)
+
+    groups = [group('a', 0, [np.nan, 1.0]), group('b', 1, [np.nan])]
+    # A reading without the model inputs is left alone
+    groups[1].values[CHANNEL_INDEX['temperature'], 0] = np.nan
+    expected = inference.features_from_readings(
+        np.zeros(2), groups[0].timestamps, groups[0].values) @ WEIGHTS
+    service.backfill(groups)
+    np.testing.assert_allclose(groups[0].values[column], [expected[0], 1.0])
+    assert np.isnan(groups[1].values[column, 0])
+    metrics = service.metrics()
+    assert metrics['backfilled'] == 1
+    assert metrics['drift_mae'] == {'a': round(float(abs(expected[1] - 1.0)), 4)}
+
+
+class FakeInterpreter:
+    """Float TFLite interpreter computing inputs @ WEIGHTS, recording resizes."""
+
+    resizes = []
+
+    def __init__(self, model_path):
+        self.shape = [1, len(FEATURES)]
+        self.tensors = {}
+
+    def allocate_tensors(self):
+        pass
+
+    def get_input_details(self):
+        return [{'index': 0, 'shape': np.array(self.shape), 'dtype': np.float32,
+                 'quantization': (0.0, 0)}]
+
+    def get_output_details(self):
+        return [{'index': 1, 'shape': np.array([self.shape[0], 1]), 'dtype': np.float32,
+                 'quantization': (0.0, 0)}]
+
+    def resize_tensor_input(self, index, shape):
+        self.resizes.append(shape[0])
+        self.shape = list(shape)
+
+    def set_tensor(self, index, value):
+        assert list(value.shape) == self.shape
+        self.tensors[index] = value
+
+    def invoke(self):
+        self.tensors[1] = (self.tensors[0] @ WEIGHTS)[:, None]
+
+    def get_tensor(self, index):
+        return self.tensors[index]
+
+
+@pytest.fixture
+def tflite_model(tmp_path, monkeypatch):
+    monkeypatch.setattr(inference, '_interpreter_class', lambda: FakeInterpreter)
+    monkeypatch.setattr(FakeInterpreter, 'resizes', [])
+    (tmp_path / 'model.tflite').write_bytes(b'')
+    scaler = SimpleNamespace(mean_=np.ones(len(FEATURES)), scale_=np.full(len(FEATURES), 2.0))
+    with open(tmp_path / 'scaler.pkl', 'wb') as f:
+        pickle.dump(scaler, f)
+    return TFLiteModel(str(tmp_path / 'model.tflite'), str(tmp_path / 'scaler.pkl'))
+
+
+def test_tflite_batches_are_padded_to_powers_of_two(tflite_model):
+    for n in (1, 3, 4, 5, 8, 3, 100):
+        features = rows(n)
+        np.testing.assert_allclose(tflite_model.predict(features),
+                                   (features - 1) / 2 @ WEIGHTS, rtol=1e-6)
+    # Only changes of size class reallocate
+    assert FakeInterpreter.resizes == [4, 8, 4, 128]
+
+
+def tiny_model(path, rng, activations=('relu', 'tanh', 'linear')):
+    """Export a small random Dense network as export_numpy does."""
+    sizes = [len(FEATURES), 8, 4, 1]
+    layers = [(rng.normal(size=(n_in, n_out)), rng.normal(size=n_out), activation)
+              for n_in, n_out, activation in zip(sizes, sizes[1:], activations)]
+    mean, scale = rng.normal(size=len(FEATURES)), rng.uniform(0.5, 2, len(FEATURES))
+    return save_npz(str(path), mean, scale, layers), mean, scale, layers
+
+
+def test_numpy_model_runs_the_exported_layers(tmp_path):
+    rng = np.random.default_rng(0)
+    path, mean, scale, layers = tiny_model(tmp_path / 'model.npz', rng)
+    features = rng.normal(size=(50, len(FEATURES)))
+    x = (features - mean) / scale
+    for kernel, bias, activation in layers:
+        x = x @ kernel + bias
+        x = {'relu': lambda x: np.maximum(x, 0), 'tanh': np.tanh,
+             'linear': lambda x: x}[activation](x)
+    model = NumpyModel(path)
+    np.testing.assert_allclose(model.predict(features), x[:, 0], rtol=1e-4, atol=1e-5)
+    assert isinstance(load_model(path, '', ''), NumpyModel)
+
+
+def test_numpy_models_need_known_activations(tmp_path):
+    path, *_ = tiny_model(tmp_path / 'model.npz', np.random.default_rng(0),
+                          ('relu', 'softplus', 'linear'))
+    with pytest.raises(inference.ModelUnavailable, match='softplus'):
+        NumpyModel(path)
+    with pytest.raises(inference.ModelUnavailable, match='not found'):
+        NumpyModel(str(tmp_path / 'missing.npz'))
+
+
+def test_numpy_model_matches_tflite(tmp_path, tflite_model):
+    path = save_npz(str(tmp_path / 'model.npz'), tflite_model.mean, tflite_model.scale,
+                    [(WEIGHTS[:, None], np.zeros(1), 'linear')])
+    features = rows(37)
+    np.testing.assert_allclose(NumpyModel(path).predict(features),
+                               tflite_model.predict(features), rtol=1e-6)
+
+
+def test_exported_model_verifies_against_tflite(tmp_path):
+    tf = pytest.importorskip('tensorflow')
+    keras_model = tf.keras.Sequential([
+        tf.keras.Input(shape=(len(FEATURES),)),
+        tf.keras.layers.Dense(8, activation='relu'),
+        tf.keras.layers.Dense(1, activation='linear'),
+    ])
+    (tmp_path / 'model.tflite').write_bytes(
+        tf.lite.TFLiteConverter.from_keras_model(keras_model).convert())
+    rng = np.random.default_rng(0)
+    mean, scale = rng.normal(size=len(FEATURES)), rng.uniform(0.5, 2, len(FEATURES))
+    layers = [(*layer.get_weights(), tf.keras.activations.serialize(layer.activation))
+              for layer in keras_model.layers]
+    path = save_npz(str(tmp_path / 'model.npz'), mean, scale, layers)
+    assert verify(path, str(tmp_path / 'model.tflite'), samples=100)
+    # Weights that differ from the TFLite model's are caught
+    layers[-1] = (layers[-1][0] * 2, *layers[-1][1:])
+    save_npz(path, mean, scale, layers)
+    assert not verify(path, str(tmp_path / 'model.tflite'), samples=100)
@@ -0,0 +1,122 @@
+import threading
+
+import numpy as np
+import pytest
+
+from ingest import MAX_ZONES, IngestJob, QueueFull, ShardedIngestQueue, parse_batch
+
+NOW = 1_700_000_000.0
+
+
+def reading(**fields):
+    return {'zone_id': 0, 'soil_moisture': 40.0, 'age': 10, **fields}
+
+
+def test_parse_batch_groups_by_device_and_zone():
+    batch = parse_batch({'device_id': 'a', 'readings': [
+        reading(zone_id=1, age=5), reading(zone_id=0), reading(zone_id=1, age=20),
+        reading(device_id='b')]}, NOW, 'default')
+    assert batch.accepted == 4
+    assert batch.device_ids == ['a', 'b']
+    groups = {(group.device_id, group.zone_id): group for group in batch.groups}
+    assert sorted(groups) == [('a', 0), ('a', 1), ('b', 0)]
+    np.testing.assert_array_equal(groups['a', 1].timestamps, [NOW - 20, NOW - 5])
+
+
+@pytest.mark.parametrize('zone_id', [-1, MAX_ZONES, 10 ** 30, 1e309, 'x', None])
+def test_parse_batch_rejects_invalid_zone_ids(zone_id):
+    batch = parse_batch([reading(zone_id=zone_id), reading()], NOW, 'default')
+    assert batch.accepted == 1
+    assert batch.results[0] == {'index': 0, 'status': 'rejected', 'error': 'invalid zone_id'}
+
+
+def test_parse_batch_rejects_bad_readings():
+    batch = parse_batch([reading(seq=-1), reading(timestamp=NOW + 3600),
+                         reading(soil_moisture=None), 'reading'], NOW, 'default')
+    assert batch.accepted == 0
+    assert [result['error'] for result in batch.results] == [
+        'invalid seq', 'timestamp is in the future', 'no sensor values',
+        'reading must be an object']
+
+
+def test_parse_batch_marks_repeated_seqs_as_duplicates():
+    batch = parse_batch([reading(seq=1), reading(seq=1), reading(seq=2)], NOW, 'default')
+    assert batch.accepted == 2
+    assert batch.duplicates == 1
+    assert batch.results[1] == {'index': 1, 'status': 'duplicate'}
+
+
+def test_single_and_bulk_uploads_share_zone_bounds(client):
+    for zone_id in (-1, MAX_ZONES):
+        response = client.post('/api/sensor-data', json={
+            'device_id': 'zone-bounds', str(zone_id): {'soil_moisture': 40}})
+        assert response.status_code == 400
+        response = client.post('/api/sensor-data/batch', json={
+            'device_id': 'zone-bounds', 'readings': [reading(zone_id=zone_id)]})
+        assert response.status_code == 400
+    response = client.post('/api/sensor-data', json={
+        'device_id': 'zone-bounds', str(MAX_ZONES - 1): {'soil_moisture': 40}})
+    assert response.status_code == 200
+
+
+def job(device_ids, readings=1):
+    batch = parse_batch([reading(device_id=device_id, age=i) for device_id in device_ids
+                         for i in range(readings)], NOW, 'default')
+    return IngestJob(batch.groups, batch.device_ids, {}, NOW, batch.accepted)
+
+
+def two_shard_devices(queue):
+    """Two device IDs that land on different shards."""
+    first = 'device-0'
+    other = next(f'device-{i}' for i in range(1, 100)
+                 if queue.shard(f'device-{i}') != queue.shard(first))
+    return first, other
+
+
+def test_sharded_uploads_are_accepted_or_refused_whole():
+    # Never started, as if the workers were stuck
+    queue = ShardedIngestQueue(lambda jobs: None, shards=2, max_readings=20)
+    first, other = two_shard_devices(queue)
+    queue.submit(job([first], 10))
+    with pytest.raises(QueueFull):
+        queue.submit(job([first, other], 5))
+    depths = queue.metrics()['shards']
+    assert sorted(shard['pending_readings'] for shard in depths) == [0, 10]
+
+
+def test_concurrent_uploads_do_not_overfill_a_shard():
+    queue = ShardedIngestQueue(lambda jobs: None, shards=2, max_readings=40)
+    first, other = two_shard_devices(queue)
+    start = threading.Barrier(8)
+
+    def upload():
+        start.wait()
+        for _ in range(10):
+            try:
+                queue.submit(job([first, other], 3))
+            except QueueFull:
+                pass
+
+    threads = [threading.Thread(target=upload) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [shard['pending_readings'] for shard in queue.metrics()['shards']] == [18, 18]
+
+
+def test_saturated_uploads_are_told_to_retry(backend, client, monkeypatch):
+    queue = ShardedIngestQueue(backend.apply_ingest, shards=1, max_readings=10)
+    monkeypatch.setattr(backend, 'ingest_queue', queue)
+    upload = {'device_id': 'saturated', 'readings': [reading(age=i) for i in range(7)]}
+    assert client.post('/api/sensor-data/batch', json=upload).status_code == 200
+    # Past the high-water mark backlogs back off while live readings still fit
+    response = client.post('/api/sensor-data/batch', json=upload)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+    single = {'device_id': 'saturated', '0': {'soil_moisture': 40}}
+    for _ in range(3):
+        assert client.post('/api/sensor-data', json=single).status_code == 200
+    response = client.post('/api/sensor-data', json=single)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
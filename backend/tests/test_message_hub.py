@@ -0,0 +1,43 @@
+import socket
+import time
+
+import pytest
+
+from message_hub import _LENGTH, MessageHub, _read_frame
+
+
+@pytest.fixture
+def hub(tmp_path):
+    hub = MessageHub(str(tmp_path / 'hub.sock'), max_pending=4)
+    hub.start()
+    yield hub
+    hub.close()
+
+
+def connect(hub):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(hub.path)
+    sock.settimeout(10)
+    return sock
+
+
+def test_a_stalled_connection_does_not_hold_up_the_others(hub):
+    sender, reader, stalled = connect(hub), connect(hub), connect(hub)
+    # Frames only reach connections the hub has accepted
+    deadline = time.monotonic() + 10
+    while len(hub._outboxes) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    payload = b'x' * 65536
+    # Far more than the stalled connection's socket buffer and outbox hold
+    for _ in range(200):
+        sender.sendall(_LENGTH.pack(len(payload)) + payload)
+        assert _read_frame(reader) == payload
+    # The connection that never read was dropped once its outbox filled up
+    stalled.settimeout(1)
+    try:
+        while stalled.recv(1 << 20):
+            pass
+    except ConnectionResetError:
+        pass
+    for sock in (sender, reader, stalled):
+        sock.close()
@@ -0,0 +1,57 @@
+import time
+
+import numpy as np
+import pytest
+
+from persistence import SQLPersistence
+from rollups import DEFAULT_TIERS
+
+# Recent enough that the writer doesn't prune the rollups
+NOW = float(int(time.time()))
+
+
+@pytest.fixture
+def store(tmp_path):
+    persistence = SQLPersistence(f'sqlite:///{tmp_path / "readings.db"}')
+    yield persistence
+    persistence.close()
+
+
+def write(store, timestamps, seqs=None):
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.vstack([np.full(len(timestamps), 40.0),
+                        np.full((4, len(timestamps)), np.nan)])
+    store.write_many('dev', 0, timestamps,
+                     values, None if seqs is None else np.asarray(seqs, dtype=np.int64))
+    store.flush()
+
+
+def rollup_counts(store):
+    return {tier.name: int(store.rollups('dev', 0, tier, NOW - 3600).readings.sum())
+            for tier in DEFAULT_TIERS}
+
+
+def test_replayed_readings_are_not_counted_again_in_rollups(store):
+    write(store, [NOW - 30, NOW - 20, NOW - 10], seqs=[1, 2, 3])
+    # A device replaying its backlog after a lost ack
+    write(store, [NOW - 30, NOW - 20, NOW - 10, NOW], seqs=[1, 2, 3, 4])
+    assert len(store.query('dev', 0)[0]) == 4
+    assert rollup_counts(store) == {tier.name: 4 for tier in DEFAULT_TIERS}
+
+
+def test_rollups_match_raw_readings(store):
+    write(store, [NOW - 30, NOW - 20])
+    write(store, [NOW - 10], seqs=[7])
+    rollup = store.rollups('dev', 0, DEFAULT_TIERS[0], NOW - 3600)
+    assert int(rollup.readings.sum()) == 3
+    assert rollup.total[0].sum() == pytest.approx(120.0)
+    # Channels without values are not counted
+    assert int(rollup.count[1].sum()) == 0
+
+
+def test_on_commit_runs_after_the_readings_are_stored(store):
+    results = []
+    store.write_many('dev', 0, np.array([NOW]), np.full((5, 1), 40.0),
+                     on_commit=lambda stored: results.append((stored, len(store.query('dev', 0)[0]))))
+    store.flush()
+    assert results == [(True, 1)]
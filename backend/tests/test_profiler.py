@@ -0,0 +1,17 @@
+import pytest
+
+
+@pytest.mark.parametrize('interval', [True, False, 0, 11, '0.01', [0.01]])
+def test_profiler_rejects_invalid_intervals(backend, client, monkeypatch, interval):
+    monkeypatch.setattr(backend, 'PROFILER_ENABLED', True)
+    response = client.post('/api/profiler', json={'interval': interval})
+    assert response.status_code == 400
+    assert backend.profiler.status()['interval'] != interval
+
+
+def test_profiler_interval_can_be_changed(backend, client, monkeypatch):
+    monkeypatch.setattr(backend, 'PROFILER_ENABLED', True)
+    monkeypatch.setattr(backend.profiler, 'interval', backend.profiler.interval)
+    response = client.post('/api/profiler', json={'interval': 0.02})
+    assert response.status_code == 200
+    assert response.get_json()['interval'] == 0.02
@@ -0,0 +1,38 @@
+from response_cache import ResponseCache
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.put('a', b'1')
+    cache.put('b', b'2')
+    cache.get('a')
+    cache.put('c', b'3')
+    assert cache.get('b') is None
+    assert cache.get('a').body == b'1'
+    assert cache.metrics()['evictions'] == 1
+
+
+def test_entries_are_bounded_by_bytes():
+    cache = ResponseCache(max_bytes=4)
+    cache.put('a', b'123')
+    cache.put('b', b'45')
+    assert cache.get('a') is None
+    # Bodies larger than the whole cache are not kept
+    cache.put('c', b'12345')
+    assert cache.get('c') is None
+    assert cache.metrics()['bytes'] == 2
+
+
+def test_zones_are_revalidated_until_they_change(backend, client):
+    device = backend.devices.get_or_create('cache-zones')
+    with device.lock:
+        device.zone_configs[0] = backend.default_zone_config(0)
+        device.version += 1
+    url = '/api/devices/cache-zones/zones'
+    etag = client.get(url).headers['ETag']
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    response = client.put('/api/devices/cache-zones/zones/0', json={'min_moisture': 30})
+    assert response.status_code == 200
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from devices import CapacityExceeded
+from ingest import IngestJob, parse_batch
+from shared_state import SharedDeviceRegistry
+
+
+@pytest.fixture
+def shared(tmp_path):
+    return SharedDeviceRegistry(str(tmp_path / 'state'), capacity=16, max_devices=2,
+                                max_zones=2)
+
+
+def readings(device_id, zone_ids):
+    return {'device_id': device_id, 'readings': [
+        {'zone_id': zone_id, 'soil_moisture': 40.0, 'age': 1} for zone_id in zone_ids]}
+
+
+def test_zones_are_reserved_only_when_they_all_fit(shared):
+    device = shared.get_or_create('a')
+    with device.lock:
+        device.reserve_zones([1])
+        with pytest.raises(CapacityExceeded):
+            device.reserve_zones([2, 3])
+        device.reserve_zones([1, 3])
+        assert device.readings.zone_ids() == [1, 3]
+
+
+def test_devices_beyond_capacity_are_refused(shared):
+    shared.get_or_create('a')
+    shared.get_or_create('b')
+    with pytest.raises(CapacityExceeded):
+        shared.get_or_create('c')
+    assert shared.device_ids() == ['a', 'b']
+
+
+def test_uploads_that_do_not_fit_are_refused_before_queueing(backend, client, shared,
+                                                             monkeypatch):
+    monkeypatch.setattr(backend, 'devices', shared)
+    response = client.post('/api/sensor-data/batch', json=readings('a', [0, 1, 2]))
+    assert response.status_code == 507
+    assert client.post('/api/sensor-data', json={
+        'device_id': 'a', '0': {'soil_moisture': 40}, '1': {'soil_moisture': 40},
+        '2': {'soil_moisture': 40}}).status_code == 507
+    assert client.post('/api/sensor-data', json={
+        'device_id': 'b', '0': {'soil_moisture': 40}}).status_code == 200
+    assert client.post('/api/sensor-data', json={
+        'device_id': 'c', '0': {'soil_moisture': 40}}).status_code == 507
+    backend.ingest_queue.join()
+    assert shared.get('a').readings.zone_ids() == []
+
+
+def test_one_device_failing_does_not_drop_the_others(backend, shared, monkeypatch):
+    monkeypatch.setattr(backend, 'devices', shared)
+    batches = [parse_batch(readings(device_id, zone_ids), time.time(), 'default')
+               for device_id, zone_ids in (('full', [0, 1, 2]), ('ok', [0]))]
+    backend.apply_ingest([IngestJob(batch.groups, batch.device_ids, {}, time.time(),
+                                    batch.accepted) for batch in batches])
+    assert shared.get('full').readings.zone_ids() == []
+    assert len(shared.get('ok').readings.zone(0)) == 1
@@ -0,0 +1,144 @@
+import numpy as np
+import pytest
+
+from storage import CHANNELS, SensorStore, ZoneBuffer
+
+CAPACITY = 8
+
+
+class Reference:
+    """The newest `capacity` readings as a plain list, sorted by timestamp.
+
+    Readings with equal timestamps stay in the order they were stored.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.readings = []  # (timestamp, order, value)
+        self.stored = 0
+
+    def add(self, timestamp, value):
+        self.readings.append((timestamp, self.stored, value))
+        self.stored += 1
+        self.readings.sort(key=lambda reading: reading[:2])
+        del self.readings[:-self.capacity]
+
+    def window(self, since=None, until=None):
+        return [(timestamp, value) for timestamp, _, value in self.readings
+                if (since is None or timestamp >= since) and (until is None or timestamp < until)]
+
+
+def values_of(column):
+    return np.tile(np.asarray(column, dtype=np.float64), (len(CHANNELS), 1))
+
+
+def contents(buffer, since=None, until=None):
+    timestamps, values = buffer.window(since, until)
+    assert (values == values[0]).all()
+    return list(zip(timestamps.tolist(), values[0].tolist()))
+
+
+def check_layout(buffer):
+    # Every slot holds the same reading as its twin `capacity` further on
+    capacity = buffer.capacity
+    lo, hi = buffer._bounds()
+    slots = np.arange(lo, hi) % capacity
+    np.testing.assert_array_equal(buffer._timestamps[slots],
+                                  buffer._timestamps[slots + capacity])
+    np.testing.assert_array_equal(buffer._serials[slots], buffer._serials[slots + capacity])
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_zone_buffer_matches_a_sorted_list(seed):
+    rng = np.random.default_rng(seed)
+    buffer, reference = ZoneBuffer(CAPACITY), Reference(CAPACITY)
+    latest, value = 0.0, 0
+    for _ in range(60):
+        kind = rng.integers(4)
+        if kind == 0:
+            # In order, sometimes repeating the latest timestamp
+            latest += float(rng.integers(0, 3))
+            timestamps = [latest]
+        elif kind == 1:
+            # Out of order, possibly older than everything retained
+            timestamps = [latest - float(rng.integers(0, 15))]
+        elif kind == 2:
+            # A run after the latest reading, possibly longer than the buffer
+            run = int(rng.integers(1, 2 * CAPACITY))
+            timestamps = (latest + np.cumsum(rng.integers(0, 3, run))).tolist()
+            latest = timestamps[-1]
+        else:
+            # A run overlapping the retained readings, merged into them
+            run = int(rng.integers(1, CAPACITY))
+            timestamps = np.sort(latest - rng.integers(-3, 15, run)).astype(float).tolist()
+            latest = max(latest, timestamps[-1])
+        column = list(range(value, value + len(timestamps)))
+        value += len(timestamps)
+        if len(timestamps) == 1:
+            buffer.append(timestamps[0], tuple(values_of(column)[:, 0]))
+        else:
+            buffer.extend(np.array(timestamps), values_of(column))
+        for timestamp, v in zip(timestamps, column):
+            reference.add(timestamp, v)
+
+        assert contents(buffer) == reference.window()
+        assert len(buffer) == len(reference.readings)
+        check_layout(buffer)
+        since, until = sorted(rng.uniform(latest - 20, latest + 1, 2).tolist())
+        assert contents(buffer, since, until) == reference.window(since, until)
+        assert buffer.oldest() == reference.readings[0][0]
+        assert buffer.latest() == reference.readings[-1][0]
+
+
+def test_window_is_a_view_of_the_contiguous_copy():
+    buffer = ZoneBuffer(4)
+    for i in range(6):
+        buffer.append(float(i), tuple(values_of([i])[:, 0]))
+    timestamps, _ = buffer.window()
+    assert timestamps.base is not None
+    assert timestamps.tolist() == [2.0, 3.0, 4.0, 5.0]
+
+
+def store_with(zones):
+    store = SensorStore(CAPACITY)
+    for zone_id, timestamps in zones.items():
+        store.extend(zone_id, np.array(timestamps, dtype=np.float64),
+                     values_of(range(len(timestamps))))
+    return store
+
+
+def test_cursors_from_another_store_are_refused():
+    store, other = store_with({0: [1.0]}), store_with({0: [1.0]})
+    assert store.parse_cursor(store.cursor()) == 0
+    assert other.parse_cursor(store.cursor()) is None
+    assert store.parse_cursor('garbage') is None
+    # A serial the store never issued
+    assert store.parse_cursor(f'{store.generation}-5') is None
+
+
+def test_cursor_increments_cover_batches_per_zone():
+    store = store_with({0: [1.0, 2.0, 3.0]})
+    serial = store.parse_cursor(store.cursor())
+    assert serial == 2
+    store.extend(1, np.array([4.0, 5.0]), values_of([10, 11]))
+    store.extend(0, np.array([6.0]), values_of([12]))
+    store.append(0, 0.5, tuple(values_of([13])[:, 0]))
+    timestamps, values = store.zone(0).after(serial)
+    # The late reading is returned too, in time order
+    assert timestamps.tolist() == [0.5, 6.0]
+    assert values[0].tolist() == [13, 12]
+    assert store.zone(1).after(serial)[0].tolist() == [4.0, 5.0]
+    assert store.zone(1).after(serial, since=5.0)[0].tolist() == [5.0]
+    assert len(store.zone(0).after(store.parse_cursor(store.cursor()))[0]) == 0
+
+
+def test_cursors_behind_evicted_readings_need_a_reset():
+    store = store_with({0: [1.0]})
+    serial = store.parse_cursor(store.cursor())
+    store.extend(0, np.arange(2.0, 2.0 + CAPACITY - 1), values_of(range(CAPACITY - 1)))
+    # Full, but nothing after the cursor has been dropped yet
+    assert len(store.zone(0).after(serial)[0]) == CAPACITY - 1
+    store.append(0, 100.0, tuple(values_of([0])[:, 0]))
+    assert len(store.zone(0).after(serial)[0]) == CAPACITY
+    store.append(0, 101.0, tuple(values_of([0])[:, 0]))
+    assert store.zone(0).after(serial) is None
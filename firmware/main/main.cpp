@@ -6,6 +6,7 @@
  * - Edge AI inference using TensorFlow Lite
  * - Automated pump and valve control
  * - WiFi connectivity for data transmission
+ * - Offline buffering with acknowledged replay after outages
  * - Real-time irrigation optimization
  * 
  * Hardware:
@@ -20,6 +21,7 @@
 #include <HTTPClient.h>
 #include <ArduinoJson.h>
 #include <DHT.h>
+#include <Preferences.h>
 #include "tensorflow/lite/micro/all_ops_resolver.h"
 #include "tensorflow/lite/micro/micro_interpreter.h"
 #include "tensorflow/lite/schema/schema_generated.h"
@@ -80,6 +82,39 @@ struct ZoneData {
 
 ZoneData zones[NUM_ZONES];
 
+// Offline Buffer
+// Every sample gets the next sequence number and stays buffered until the
+// server acknowledges it (ack_seq), so readings taken during a WiFi outage
+// are replayed oldest first once the connection is back.
+#define BUFFER_CAPACITY 240     // 2 hours of samples at SENSOR_INTERVAL
+#define MAX_UPLOAD_SAMPLES 30   // Samples per batch POST
+#define SEQ_BLOCK 1000          // Sequence numbers reserved per flash write
+
+struct BufferedSample {
+  uint32_t seq;
+  unsigned long taken_at;  // millis() when the sensors were read
+  float soil_moisture[NUM_ZONES];
+  float temperature[NUM_ZONES];
+  float humidity[NUM_ZONES];
+  float water_prediction[NUM_ZONES];
+  float water_applied[NUM_ZONES];
+};
+
+BufferedSample sampleBuffer[BUFFER_CAPACITY];
+int bufferStart = 0;  // Oldest unacknowledged sample
+int bufferCount = 0;
+
+// Sequence numbers must keep increasing across reboots, so the firmware
+// persists the end of a reserved block rather than every number
+Preferences preferences;
+uint32_t nextSeq = 0;
+uint32_t seqLimit = 0;
+
+void reserveSeqBlock() {
+  seqLimit = nextSeq + SEQ_BLOCK;
+  preferences.putUInt("seq_limit", seqLimit);
+}
+
 void setup() {
   Serial.begin(115200);
   delay(1000);
@@ -91,6 +126,11 @@ void setup() {
     dhts[i].begin();
   }
   
+  // Resume sequence numbers after the last reserved block
+  preferences.begin("irrigation", false);
+  nextSeq = preferences.getUInt("seq_limit", 0);
+  reserveSeqBlock();
+  
   // Initialize control pins
   pinMode(PUMP_PIN, OUTPUT);
   digitalWrite(PUMP_PIN, LOW);
@@ -160,11 +200,22 @@ float predictWaterRequirement(int zone_id) {
   
   // Normalize inputs (should match training data normalization)
   // For simplicity, using basic normalization - should match scaler from training
-  input->data.f[0] = (zones[zone_id].soil_moisture - 50.0) / 30.0;  // Normalized
-  input->data.f[1] = (zones[zone_id].temperature - 25.0) / 10.0;
-  input->data.f[2] = (zones[zone_id].humidity - 60.0) / 30.0;
-  input->data.f[3] = zone_id / 4.0;  // Normalize zone ID
-  input->data.f[4] = (hour - 12.0) / 12.0;  // Normalize hour
+  float features[5];
+  features[0] = (zones[zone_id].soil_moisture - 50.0) / 30.0;  // Normalized
+  features[1] = (zones[zone_id].temperature - 25.0) / 10.0;
+  features[2] = (zones[zone_id].humidity - 60.0) / 30.0;
+  features[3] = zone_id / 4.0;  // Normalize zone ID
+  features[4] = (hour - 12.0) / 12.0;  // Normalize hour
+  
+  // Full-integer (int8) models take quantized inputs
+  for (int i = 0; i < 5; i++) {
+    if (input->type == kTfLiteInt8) {
+      int32_t q = lroundf(features[i] / input->params.scale) + input->params.zero_point;
+      input->data.int8[i] = (int8_t)constrain(q, -128, 127);
+    } else {
+      input->data.f[i] = features[i];
+    }
+  }
   
   // Run inference
   TfLiteStatus invoke_status = interpreter->Invoke();
@@ -174,7 +225,9 @@ float predictWaterRequirement(int zone_id) {
   }
   
   // Get prediction (denormalize if needed)
-  float prediction = output->data.f[0];
+  float prediction = output->type == kTfLiteInt8
+      ? (output->data.int8[0] - output->params.zero_point) * output->params.scale
+      : output->data.f[0];
   return constrain(prediction, 0, 100);  // Water requirement in ml
 }
 
@@ -236,46 +289,123 @@ void controlIrrigation() {
   }
 }
 
-void sendDataToServer() {
-  if (WiFi.status() != WL_CONNECTED) {
-    Serial.println("WiFi not connected, skipping data send");
-    return;
+void bufferSample() {
+  if (bufferCount == BUFFER_CAPACITY) {
+    // Buffer full: drop the oldest sample to keep the newest readings
+    bufferStart = (bufferStart + 1) % BUFFER_CAPACITY;
+    bufferCount--;
+    Serial.println("Offline buffer full, dropping oldest sample");
   }
   
-  HTTPClient http;
-  http.begin(server_url);
-  http.addHeader("Content-Type", "application/json");
-  
-  // Create JSON payload
-  DynamicJsonDocument doc(2048);
-  doc["pump_running"] = digitalRead(PUMP_PIN);
-  
-  JsonArray active_zones_array = doc.createNestedArray("active_zones");
+  if (nextSeq >= seqLimit) {
+    reserveSeqBlock();
+  }
   
+  BufferedSample& sample = sampleBuffer[(bufferStart + bufferCount) % BUFFER_CAPACITY];
+  sample.seq = nextSeq++;
+  sample.taken_at = millis();
   for (int i = 0; i < NUM_ZONES; i++) {
-    JsonObject zone_data = doc.createNestedObject(String(i));
-    zone_data["soil_moisture"] = zones[i].soil_moisture;
-    zone_data["temperature"] = zones[i].temperature;
-    zone_data["humidity"] = zones[i].humidity;
-    zone_data["water_prediction"] = zones[i].water_prediction;
-    zone_data["water_applied"] = zones[i].needs_watering ? zones[i].water_prediction : 0;
-    
-    if (zones[i].needs_watering) {
-      active_zones_array.add(i);
-    }
+    sample.soil_moisture[i] = zones[i].soil_moisture;
+    sample.temperature[i] = zones[i].temperature;
+    sample.humidity[i] = zones[i].humidity;
+    sample.water_prediction[i] = zones[i].water_prediction;
+    sample.water_applied[i] = zones[i].needs_watering ? zones[i].water_prediction : 0;
+  }
+  bufferCount++;
+}
+
+void acknowledgeSamples(uint32_t ack_seq) {
+  while (bufferCount > 0 && sampleBuffer[bufferStart].seq <= ack_seq) {
+    bufferStart = (bufferStart + 1) % BUFFER_CAPACITY;
+    bufferCount--;
   }
   
-  String json_string;
-  serializeJson(doc, json_string);
-  
-  int httpResponseCode = http.POST(json_string);
-  if (httpResponseCode > 0) {
-    Serial.printf("Data sent successfully, response code: %d\n", httpResponseCode);
-  } else {
-    Serial.printf("Error sending data: %d\n", httpResponseCode);
+  if (ack_seq >= nextSeq) {
+    // The server has seen higher numbers, e.g. after flash was erased:
+    // renumber what is left so it isn't taken for duplicates
+    nextSeq = ack_seq + 1;
+    reserveSeqBlock();
+    for (int i = 0; i < bufferCount; i++) {
+      sampleBuffer[(bufferStart + i) % BUFFER_CAPACITY].seq = nextSeq++;
+    }
+  }
+}
+
+void sendDataToServer() {
+  if (WiFi.status() != WL_CONNECTED) {
+    Serial.printf("WiFi not connected, %d samples buffered\n", bufferCount);
+    WiFi.reconnect();
+    return;
   }
   
-  http.end();
+  // Replay the backlog oldest first, one batch per call until acknowledged
+  while (bufferCount > 0) {
+    int count = min(bufferCount, MAX_UPLOAD_SAMPLES);
+    unsigned long now = millis();
+    
+    // Create JSON payload; `age` dates readings without a real-time clock
+    DynamicJsonDocument doc(32768);
+    doc["pump_running"] = digitalRead(PUMP_PIN);
+    
+    JsonArray active_zones_array = doc.createNestedArray("active_zones");
+    for (int i = 0; i < NUM_ZONES; i++) {
+      if (zones[i].needs_watering) {
+        active_zones_array.add(i);
+      }
+    }
+    
+    JsonArray readings = doc.createNestedArray("readings");
+    for (int n = 0; n < count; n++) {
+      const BufferedSample& sample = sampleBuffer[(bufferStart + n) % BUFFER_CAPACITY];
+      for (int i = 0; i < NUM_ZONES; i++) {
+        JsonObject reading = readings.createNestedObject();
+        reading["zone_id"] = i;
+        reading["seq"] = sample.seq;
+        reading["age"] = (now - sample.taken_at) / 1000.0;
+        reading["soil_moisture"] = sample.soil_moisture[i];
+        reading["temperature"] = sample.temperature[i];
+        reading["humidity"] = sample.humidity[i];
+        reading["water_prediction"] = sample.water_prediction[i];
+        reading["water_applied"] = sample.water_applied[i];
+      }
+    }
+    
+    String json_string;
+    serializeJson(doc, json_string);
+    
+    HTTPClient http;
+    http.begin(String(server_url) + "/batch");
+    http.addHeader("Content-Type", "application/json");
+    
+    int httpResponseCode = http.POST(json_string);
+    if (httpResponseCode != 200) {
+      // Keep everything buffered; 429/503 mean the server is shedding load
+      Serial.printf("Error sending data: %d, %d samples buffered\n",
+                    httpResponseCode, bufferCount);
+      http.end();
+      return;
+    }
+    
+    // Only ack_seq is needed from the response
+    StaticJsonDocument<32> filter;
+    filter["ack_seq"] = true;
+    StaticJsonDocument<64> response;
+    DeserializationError error = deserializeJson(
+        response, http.getString(), DeserializationOption::Filter(filter));
+    http.end();
+    if (error || !response["ack_seq"].is<uint32_t>()) {
+      Serial.println("Response carried no ack_seq");
+      return;
+    }
+    
+    int before = bufferCount;
+    acknowledgeSamples(response["ack_seq"].as<uint32_t>());
+    Serial.printf("Data sent successfully, %d samples acknowledged, %d buffered\n",
+                  before - bufferCount, bufferCount);
+    if (before == bufferCount) {
+      return;  // Nothing acknowledged; retry on the next interval
+    }
+  }
 }
 
 void loop() {
@@ -286,6 +416,7 @@ void loop() {
     lastSensorRead = currentMillis;
     readSensors();
     controlIrrigation();
+    bufferSample();
   }
   
   // Send data to server periodically
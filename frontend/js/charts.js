@@ -40,20 +40,21 @@ function processHistoricalData(data) {
     }
     
     // Collect all unique timestamps first
-    const allTimestamps = [];
+    const timestampSet = new Set();
     Object.keys(data).forEach(zoneId => {
         const zoneData = data[zoneId];
         if (Array.isArray(zoneData)) {
             zoneData.forEach(reading => {
-                if (reading.timestamp && !allTimestamps.includes(reading.timestamp)) {
-                    allTimestamps.push(reading.timestamp);
+                if (reading.timestamp) {
+                    timestampSet.add(reading.timestamp);
                 }
             });
         }
     });
     
     // Sort timestamps
-    allTimestamps.sort();
+    const allTimestamps = Array.from(timestampSet).sort();
+    const timestampIndexes = new Map(allTimestamps.map((ts, i) => [ts, i]));
     
     // Convert to time labels
     chartData.labels = allTimestamps.map(ts => {
@@ -76,8 +77,8 @@ function processHistoricalData(data) {
             chartData.humidity[zid] = new Array(chartData.labels.length).fill(null);
             
             zoneData.forEach(reading => {
-                const timestampIndex = allTimestamps.indexOf(reading.timestamp);
-                if (timestampIndex !== -1) {
+                const timestampIndex = timestampIndexes.get(reading.timestamp);
+                if (timestampIndex !== undefined) {
                     chartData.moisture[zid][timestampIndex] = reading.soil_moisture;
                     chartData.temperature[zid][timestampIndex] = reading.temperature;
                     chartData.humidity[zid][timestampIndex] = reading.humidity;
@@ -251,14 +252,48 @@ function createTempHumidityChart() {
     });
 }
 
-// Update charts with new data
-function updateCharts(data) {
+// Replace the charts' contents with a full history window
+function reloadCharts(historicalData) {
+    processHistoricalData(historicalData);
+    if (moistureChart) {
+        moistureChart.data.labels = chartData.labels;
+        moistureChart.data.datasets.forEach((dataset, zid) => {
+            dataset.data = chartData.moisture[zid] || [];
+        });
+        moistureChart.update('none');
+    }
+    if (tempHumidityChart) {
+        tempHumidityChart.data.labels = chartData.labels;
+        tempHumidityChart.data.datasets[0].data = chartData.temperature[0] || [];
+        tempHumidityChart.data.datasets[1].data = chartData.humidity[0] || [];
+        tempHumidityChart.update('none');
+    }
+}
+
+// Append readings fetched since the last history cursor, oldest first
+function appendReadings(data) {
+    const byTimestamp = new Map();
+    Object.keys(data || {}).forEach(zoneId => {
+        data[zoneId].forEach(reading => {
+            if (!byTimestamp.has(reading.timestamp)) {
+                byTimestamp.set(reading.timestamp, {});
+            }
+            byTimestamp.get(reading.timestamp)[zoneId] = reading;
+        });
+    });
+    Array.from(byTimestamp.keys()).sort().forEach(timestamp => {
+        updateCharts(byTimestamp.get(timestamp), timestamp);
+    });
+}
+
+// Update charts with new data, taken at `timestamp` (default now)
+function updateCharts(data, timestamp) {
     if (!data || Object.keys(data).length === 0) {
         return; // No data to update
     }
     
     // Add new data point to chart data
-    const now = new Date();
+    const now = timestamp ? new Date(timestamp) : new Date();
     const timeLabel = now.toLocaleTimeString('en-US', { 
         hour: '2-digit', 
         minute: '2-digit' 
@@ -3,11 +3,17 @@ const CONFIG = {
     // API endpoint - update this with your server IP/URL
     API_URL: 'https://irrigation-controller-1.onrender.com/',
     WS_URL: 'https://irrigation-controller-1.onrender.com/',
+    // Set to ['websocket'] when the backend runs several workers (serve.py):
+    // long-polling requests of one session may reach different workers
+    WS_TRANSPORTS: ['polling', 'websocket'],
     
     // Update intervals (milliseconds)
     DATA_UPDATE_INTERVAL: 5000,
     CHART_UPDATE_INTERVAL: 30000,
     
+    // Points per zone requested for history charts (downsampled server-side)
+    CHART_MAX_POINTS: 50,
+    
     // Zone names (update to match your setup)
     ZONE_NAMES: {
         0: 'Zone 1 - Tomatoes',
@@ -1,7 +1,10 @@
 // Main dashboard logic
 let socket;
 let currentData = {};
+let systemStatus = {};
 let alerts = [];
+// Marks the last reading received through /api/sensor-data
+let historyCursor = null;
 
 // Initialize dashboard
 document.addEventListener('DOMContentLoaded', () => {
@@ -13,11 +16,15 @@ document.addEventListener('DOMContentLoaded', () => {
 
 // Initialize WebSocket connection
 function initializeWebSocket() {
-    socket = io(CONFIG.WS_URL);
+    socket = io(CONFIG.WS_URL, { transports: CONFIG.WS_TRANSPORTS });
     
     socket.on('connect', () => {
         console.log('Connected to server');
         updateStatus('online', 'Connected');
+        // After a reconnect, fetch only the readings missed while offline
+        if (historyCursor) {
+            loadNewReadings();
+        }
     });
     
     socket.on('disconnect', () => {
@@ -45,22 +52,31 @@ function updateStatus(status, text) {
 }
 
 // Handle incoming sensor data
+// Updates only carry the fields that changed since the previous one, so they
+// are merged into the last known state before rendering.
 function handleSensorUpdate(data) {
-    currentData = data.data;
+    const changedZones = {};
+    Object.keys(data.data || {}).forEach(zoneId => {
+        currentData[zoneId] = Object.assign({}, currentData[zoneId], data.data[zoneId]);
+        changedZones[zoneId] = currentData[zoneId];
+    });
     
     // Update zone displays
-    Object.keys(currentData).forEach(zoneId => {
-        updateZoneDisplay(parseInt(zoneId), currentData[zoneId]);
+    Object.keys(changedZones).forEach(zoneId => {
+        updateZoneDisplay(parseInt(zoneId), changedZones[zoneId]);
     });
     
     // Update system stats
-    updateSystemStats(data.status);
+    if (data.status) {
+        systemStatus = Object.assign(systemStatus, data.status);
+        updateSystemStats(systemStatus);
+    }
     
     // Check for alerts
-    checkAlerts(data.data);
+    checkAlerts(changedZones);
     
     // Update charts
-    updateCharts(data.data);
+    updateCharts(changedZones);
 }
 
 // Initialize zone cards
@@ -219,11 +235,12 @@ function updateAlertsDisplay() {
 // Load historical data for charts
 async function loadHistoricalData() {
     try {
-        const response = await fetch(`${CONFIG.API_URL}/api/sensor-data?hours=24`);
+        const response = await fetch(`${CONFIG.API_URL}/api/sensor-data?hours=24&max_points=${CONFIG.CHART_MAX_POINTS}&cursor=`);
         if (response.ok) {
-            const data = await response.json();
+            const body = await response.json();
+            historyCursor = body.cursor;
             // Re-initialize charts with historical data
-            initializeCharts(data);
+            initializeCharts(body.data);
         }
     } catch (error) {
         console.error('Error loading historical data:', error);
@@ -231,6 +248,26 @@ async function loadHistoricalData() {
     }
 }
 
+// Load the readings stored since the last history fetch
+async function loadNewReadings() {
+    try {
+        const cursor = encodeURIComponent(historyCursor);
+        const response = await fetch(`${CONFIG.API_URL}/api/sensor-data?hours=24&max_points=${CONFIG.CHART_MAX_POINTS}&cursor=${cursor}`);
+        if (response.ok) {
+            const body = await response.json();
+            historyCursor = body.cursor;
+            // A reset means the server sent the whole window again
+            if (body.reset) {
+                reloadCharts(body.data);
+            } else {
+                appendReadings(body.data);
+            }
+        }
+    } catch (error) {
+        console.error('Error loading new readings:', error);
+    }
+}
+
 // Start periodic data updates
 function startPeriodicUpdates() {
     // Update stats periodically
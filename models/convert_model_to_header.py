@@ -1,11 +1,80 @@
 """
 Convert TensorFlow Lite model to C header file for ESP32 firmware.
+
+The header records a hash of the model and the generator options, and is
+left untouched when they haven't changed so the firmware isn't rebuilt.
 """
 
+import argparse
+import hashlib
 import os
+import tempfile
+
+import numpy as np
+
+BYTES_PER_LINE = 12
+HASH_PREFIX = '// sha256: '
+# '0xNN, ' for every byte value, indexed by the byte
+_HEX_TABLE = np.array([b'0x%02x, ' % value for value in range(256)], dtype='S6')
+
+def header_hash(model_data, array_name, align):
+    """Hash identifying the header's content: the model and the generator options."""
+    digest = hashlib.sha256(model_data)
+    digest.update(f'{array_name}:{align}'.encode())
+    return digest.hexdigest()
+
+def existing_hash(output_path):
+    """The hash recorded in an existing header, or None."""
+    try:
+        with open(output_path, 'r') as f:
+            first_line = f.readline()
+    except OSError:
+        return None
+    if first_line.startswith(HASH_PREFIX):
+        return first_line[len(HASH_PREFIX):].strip()
+    return None
 
-def convert_tflite_to_header(tflite_path, output_path):
-    """Convert .tflite file to C header file."""
+def hex_lines(model_data, bytes_per_line=BYTES_PER_LINE):
+    """Yield the array body lines, formatted in bulk through a lookup table."""
+    formatted = _HEX_TABLE[np.frombuffer(model_data, dtype=np.uint8)].tobytes()
+    width = bytes_per_line * _HEX_TABLE.itemsize
+    for i in range(0, len(formatted), width):
+        yield b'  ' + formatted[i:i + width].rstrip() + b'\n'
+
+def write_atomic(output_path, chunks):
+    """Write byte chunks to a temporary file beside output_path, then rename it over."""
+    directory = os.path.dirname(output_path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-',
+                                     suffix=os.path.basename(output_path))
+    try:
+        # mkstemp creates the file owner-only; keep the mode a plain open()
+        # would give, or the existing header's
+        try:
+            mode = os.stat(output_path).st_mode & 0o7777
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(temp_path, mode)
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, output_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def convert_tflite_to_header(tflite_path, output_path, array_name='irrigation_model_tflite',
+                             align=None, force=False):
+    """Convert .tflite file to C header file.
+    
+    `align` emits alignas(align) on the array (TFLite Micro expects 16).
+    Returns False on error, True otherwise, including when the header was
+    already up to date.
+    """
     
     if not os.path.exists(tflite_path):
         print(f"Error: Model file {tflite_path} not found!")
@@ -16,28 +85,24 @@ def convert_tflite_to_header(tflite_path, output_path):
     with open(tflite_path, 'rb') as f:
         model_data = f.read()
     
+    digest = header_hash(model_data, array_name, align)
+    if not force and existing_hash(output_path) == digest:
+        print(f"{output_path} is up to date (model unchanged), not rewritten")
+        return True
+    
     # Convert to C array
-    array_name = 'irrigation_model_tflite'
-    header_content = f'#ifndef IRRIGATION_MODEL_H\n'
-    header_content += f'#define IRRIGATION_MODEL_H\n\n'
-    header_content += f'#include "tensorflow/lite/micro/micro_interpreter.h"\n\n'
-    header_content += f'const unsigned char {array_name}[] = {{\n'
-    
-    # Write bytes in hex format
-    bytes_per_line = 12
-    for i in range(0, len(model_data), bytes_per_line):
-        line_bytes = model_data[i:i+bytes_per_line]
-        hex_bytes = ', '.join(f'0x{b:02x}' for b in line_bytes)
-        header_content += f'  {hex_bytes},\n'
-    
-    header_content += '};\n\n'
-    header_content += f'const unsigned int {array_name}_len = {len(model_data)};\n\n'
-    header_content += '#endif\n'
+    attributes = f'alignas({align}) ' if align else ''
+    head = (f'{HASH_PREFIX}{digest}\n'
+            f'#ifndef IRRIGATION_MODEL_H\n'
+            f'#define IRRIGATION_MODEL_H\n\n'
+            f'#include "tensorflow/lite/micro/micro_interpreter.h"\n\n'
+            f'{attributes}const unsigned char {array_name}[] = {{\n')
+    tail = (f'}};\n\n'
+            f'const unsigned int {array_name}_len = {len(model_data)};\n\n'
+            f'#endif\n')
     
     # Write header file
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, 'w') as f:
-        f.write(header_content)
+    write_atomic(output_path, [head.encode(), *hex_lines(model_data), tail.encode()])
     
     print(f"Model converted successfully!")
     print(f"Input: {tflite_path}")
@@ -47,8 +112,14 @@ def convert_tflite_to_header(tflite_path, output_path):
     return True
 
 if __name__ == '__main__':
-    tflite_model = 'firmware/models/irrigation_model.tflite'
-    header_file = 'firmware/main/irrigation_model.h'
+    parser = argparse.ArgumentParser(description='Convert the TFLite model to a C header.')
+    parser.add_argument('--input', default='firmware/models/irrigation_model.tflite')
+    parser.add_argument('--output', default='firmware/main/irrigation_model.h')
+    parser.add_argument('--array-name', default='irrigation_model_tflite')
+    parser.add_argument('--align', type=int, default=None,
+                        help='emit alignas(N) on the model array, e.g. 16')
+    parser.add_argument('--force', action='store_true',
+                        help='rewrite the header even if the model is unchanged')
+    args = parser.parse_args()
     
-    convert_tflite_to_header(tflite_model, header_file)
-
+    convert_tflite_to_header(args.input, args.output, args.array_name, args.align, args.force)
@@ -1,11 +1,161 @@
 """
 Convert trained Keras model to TensorFlow Lite format for edge deployment.
+
+--quantization int8 produces a full-integer model (int8 inputs, weights,
+activations and outputs) calibrated on a representative dataset from the
+training data or the stored readings; --report compares it with the float
+conversions on MAE, size and latency.
 """
 
+import argparse
+import json
 import tensorflow as tf
+import numpy as np
 import os
+import pickle
+import time
+
+# Weight handling applied by the converter; 'dynamic' is Optimize.DEFAULT and
+# 'int8' is full-integer quantization calibrated on representative data
+QUANTIZATIONS = ('none', 'dynamic', 'float16', 'int8')
+REPORT_PATH = 'models/quantization_report.json'
+
+def convert_model(model, quantization='dynamic', representative_data=None):
+    """Convert a Keras model to TensorFlow Lite bytes.
+    
+    'int8' needs `representative_data`, scaled input rows used to calibrate
+    the activation ranges.
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantization}")
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != 'none':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    if quantization == 'int8':
+        if representative_data is None or len(representative_data) == 0:
+            raise ValueError("int8 quantization needs representative data")
+        samples = np.asarray(representative_data, dtype=np.float32)
+        
+        def representative_dataset():
+            for row in samples:
+                yield [row[np.newaxis, :]]
+        
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    return converter.convert()
+
+def quantize_input(inputs, details):
+    """Float inputs in the tensor's dtype, quantized if the model is integer-only."""
+    if details['dtype'] == np.float32:
+        return inputs.astype(np.float32)
+    scale, zero_point = details['quantization']
+    info = np.iinfo(details['dtype'])
+    quantized = np.round(inputs / scale + zero_point)
+    return np.clip(quantized, info.min, info.max).astype(details['dtype'])
 
-def convert_to_tflite():
+def dequantize_output(outputs, details):
+    if details['dtype'] == np.float32:
+        return outputs
+    scale, zero_point = details['quantization']
+    return (outputs.astype(np.float32) - zero_point) * scale
+
+def predict_tflite(tflite_model, inputs):
+    """Run a batch of (already scaled) inputs through a TFLite model."""
+    interpreter = tf.lite.Interpreter(model_content=tflite_model)
+    input_details = interpreter.get_input_details()[0]
+    interpreter.resize_tensor_input(input_details['index'], list(inputs.shape))
+    interpreter.allocate_tensors()
+    input_details = interpreter.get_input_details()[0]
+    output_details = interpreter.get_output_details()[0]
+    interpreter.set_tensor(input_details['index'], quantize_input(inputs, input_details))
+    interpreter.invoke()
+    return dequantize_output(interpreter.get_tensor(output_details['index']), output_details)
+
+def evaluate_tflite(tflite_model, inputs, targets):
+    """Mean absolute error (ml) of a TFLite model on scaled inputs."""
+    predictions = predict_tflite(tflite_model, inputs)
+    return float(np.mean(np.abs(predictions.reshape(-1) - np.asarray(targets).reshape(-1))))
+
+def measure_latency(tflite_model, runs=500, warmup=50):
+    """Median single-sample invoke() time in microseconds, as the device runs it."""
+    interpreter = tf.lite.Interpreter(model_content=tflite_model, num_threads=1)
+    interpreter.allocate_tensors()
+    input_details = interpreter.get_input_details()[0]
+    sample = np.zeros(input_details['shape'], dtype=input_details['dtype'])
+    timings = []
+    for i in range(warmup + runs):
+        start = time.perf_counter()
+        interpreter.set_tensor(input_details['index'], sample)
+        interpreter.invoke()
+        if i >= warmup:
+            timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1e6)
+
+def load_dataset(source='synthetic', database_url=None, samples=2000):
+    """
+    Scaled (inputs, targets) for calibration and evaluation.
+    
+    'synthetic' is the held-out split train_model.py evaluates on;
+    'database' is up to `samples` stored readings with water_applied.
+    Both are scaled with models/scaler.pkl, as the deployed model sees them.
+    """
+    import train_model
+    with open('models/scaler.pkl', 'rb') as f:
+        scaler = pickle.load(f)
+    
+    if source == 'database':
+        from sqlalchemy import create_engine
+        engine = create_engine(database_url or train_model.DEFAULT_DATABASE_URL)
+        features, labels = [], []
+        for chunk_features, chunk_labels in train_model.iter_reading_chunks(
+                engine, min(samples, 50000)):
+            features.append(chunk_features)
+            labels.append(chunk_labels)
+            if sum(len(chunk) for chunk in features) >= samples:
+                break
+        if not features:
+            raise ValueError(f"No labelled readings in {engine.url}")
+        X = np.concatenate(features)[:samples]
+        y = np.concatenate(labels)[:samples]
+    else:
+        from sklearn.model_selection import train_test_split
+        X, y = train_model.generate_synthetic_data(n_samples=10000)
+        _, X, _, y = train_test_split(X, y, test_size=0.2, random_state=42)
+        X, y = X[:samples], y[:samples]
+    return scaler.transform(X).astype(np.float32), np.asarray(y, dtype=np.float32)
+
+def quantization_report(model, inputs, targets, quantizations=QUANTIZATIONS,
+                        calibration=None):
+    """MAE, size and latency of each conversion, with the Keras model's MAE as reference."""
+    keras_predictions = model.predict(inputs, verbose=0).reshape(-1)
+    report = {
+        'samples': len(inputs),
+        'keras_mae': float(np.mean(np.abs(keras_predictions - targets.reshape(-1)))),
+        'models': [],
+    }
+    for quantization in quantizations:
+        tflite_model = convert_model(model, quantization, calibration)
+        report['models'].append({
+            'quantization': quantization,
+            'mae': round(evaluate_tflite(tflite_model, inputs, targets), 4),
+            'bytes': len(tflite_model),
+            'latency_us': round(measure_latency(tflite_model), 2),
+        })
+    return report
+
+def print_report(report):
+    print(f"\nKeras model MAE: {report['keras_mae']:.2f} ml ({report['samples']} samples)")
+    print(f"{'quantization':>12} {'MAE (ml)':>9} {'size (B)':>9} {'latency (us)':>13}")
+    for row in report['models']:
+        print(f"{row['quantization']:>12} {row['mae']:>9.2f} {row['bytes']:>9} "
+              f"{row['latency_us']:>13.1f}")
+
+def convert_to_tflite(quantization='dynamic', calibration_source='synthetic',
+                      database_url=None, calibration_samples=500, report=False):
     """Convert Keras model to TensorFlow Lite."""
     
     # Load the trained model
@@ -18,15 +168,20 @@ def convert_to_tflite():
     print(f"Loading model from {model_path}...")
     model = tf.keras.models.load_model(model_path)
     
-    # Convert to TensorFlow Lite
-    print("Converting to TensorFlow Lite...")
-    converter = tf.lite.TFLiteConverter.from_keras_model(model)
-    
-    # Optimize for size and speed
-    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    # Calibration rows for int8, and held-out rows the report evaluates on:
+    # error measured on the calibration rows themselves would look smaller
+    calibration = evaluation = targets = None
+    if quantization == 'int8' or report:
+        print(f"Loading representative data ({calibration_source})...")
+        inputs, labels = load_dataset(calibration_source, database_url,
+                                      calibration_samples * 2)
+        split = min(calibration_samples, len(inputs) // 2)
+        calibration = inputs[:split]
+        evaluation, targets = inputs[split:], labels[split:]
     
-    # Convert
-    tflite_model = converter.convert()
+    # Convert to TensorFlow Lite, optimized for size and speed
+    print(f"Converting to TensorFlow Lite ({quantization})...")
+    tflite_model = convert_model(model, quantization, calibration)
     
     # Save TFLite model
     os.makedirs('firmware/models', exist_ok=True)
@@ -48,16 +203,46 @@ def convert_to_tflite():
     input_details = interpreter.get_input_details()
     output_details = interpreter.get_output_details()
     
-    print(f"Input shape: {input_details[0]['shape']}")
-    print(f"Output shape: {output_details[0]['shape']}")
+    print(f"Input shape: {input_details[0]['shape']} ({input_details[0]['dtype'].__name__})")
+    print(f"Output shape: {output_details[0]['shape']} ({output_details[0]['dtype'].__name__})")
+    if input_details[0]['dtype'] != np.float32:
+        scale, zero_point = input_details[0]['quantization']
+        print(f"Input quantization: scale={scale:.6f} zero_point={zero_point}")
+        scale, zero_point = output_details[0]['quantization']
+        print(f"Output quantization: scale={scale:.6f} zero_point={zero_point}")
     
     # Test with sample input
-    test_input = [[50, 25, 60, 0, 12]]  # soil_moisture, temp, humidity, zone, hour
-    interpreter.set_tensor(input_details[0]['index'], test_input)
+    test_input = np.array([[50, 25, 60, 0, 12]], dtype=np.float32)  # soil_moisture, temp, humidity, zone, hour
+    if calibration is not None:
+        test_input = calibration[:1]
+    interpreter.set_tensor(input_details[0]['index'], quantize_input(test_input, input_details[0]))
     interpreter.invoke()
-    output = interpreter.get_tensor(output_details[0]['index'])
+    output = dequantize_output(interpreter.get_tensor(output_details[0]['index']), output_details[0])
     print(f"Test prediction: {output[0][0]:.2f} ml")
+    
+    if report:
+        results = quantization_report(model, evaluation, targets, calibration=calibration)
+        results['calibration'] = calibration_source
+        results['calibration_samples'] = len(calibration)
+        print_report(results)
+        with open(REPORT_PATH, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nReport saved to {REPORT_PATH}")
 
 if __name__ == '__main__':
-    convert_to_tflite()
-
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description='Convert the model to TensorFlow Lite.')
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default='dynamic')
+    parser.add_argument('--calibration', choices=['synthetic', 'database'], default='synthetic',
+                        help='representative data for int8 calibration and, held out '
+                             'from it, the report')
+    parser.add_argument('--database-url', default=None,
+                        help='database for --calibration database (default: the backend\'s)')
+    parser.add_argument('--calibration-samples', type=int, default=500)
+    parser.add_argument('--report', action='store_true',
+                        help=f'compare all quantizations and write {REPORT_PATH}')
+    args = parser.parse_args()
+    
+    convert_to_tflite(args.quantization, args.calibration, args.database_url,
+                      args.calibration_samples, args.report)
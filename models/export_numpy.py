@@ -0,0 +1,119 @@
+"""
+Export the trained Keras model and scaler to a NumPy .npz for the backend.
+The backend can then run predictions without importing TensorFlow.
+"""
+
+import argparse
+import os
+import pickle
+
+import numpy as np
+
+MODEL_PATH = 'models/irrigation_model.h5'
+SCALER_PATH = 'models/scaler.pkl'
+NPZ_PATH = 'models/irrigation_model.npz'
+TFLITE_PATH = 'firmware/models/irrigation_model.tflite'
+
+def save_npz(output_path, mean, scale, layers):
+    """Write scaler mean/scale and (kernel, bias, activation) Dense layers to an .npz."""
+    arrays = {
+        'mean': np.asarray(mean, dtype=np.float32),
+        'scale': np.asarray(scale, dtype=np.float32),
+        'activations': np.array([activation for _, _, activation in layers]),
+    }
+    for index, (kernel, bias, _) in enumerate(layers):
+        arrays[f'kernel_{index}'] = np.asarray(kernel, dtype=np.float32)
+        arrays[f'bias_{index}'] = np.asarray(bias, dtype=np.float32)
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    np.savez_compressed(output_path, **arrays)
+    return output_path
+
+def export_numpy(model_path=MODEL_PATH, scaler_path=SCALER_PATH, output_path=NPZ_PATH):
+    """Write Dense layer weights, activations and scaler mean/scale to an .npz."""
+    import tensorflow as tf
+    
+    for path in (model_path, scaler_path):
+        if not os.path.exists(path):
+            print(f"Error: {path} not found!")
+            print("Please run train_model.py first.")
+            return None
+    
+    print(f"Loading model from {model_path}...")
+    model = tf.keras.models.load_model(model_path)
+    with open(scaler_path, 'rb') as f:
+        scaler = pickle.load(f)
+    
+    layers = []
+    # Dropout is a no-op at inference time; only Dense layers carry weights
+    for layer in model.layers:
+        if not isinstance(layer, tf.keras.layers.Dense):
+            continue
+        kernel, bias = layer.get_weights()
+        layers.append((kernel, bias, tf.keras.activations.serialize(layer.activation)))
+    
+    save_npz(output_path, scaler.mean_, scaler.scale_, layers)
+    print(f"NumPy model saved to {output_path} ({os.path.getsize(output_path) / 1024:.2f} KB)")
+    for kernel, _, activation in layers:
+        print(f"  Dense {kernel.shape} {activation}")
+    return output_path
+
+def verify(npz_path=NPZ_PATH, tflite_path=TFLITE_PATH, samples=1000, tolerance=0.01):
+    """Compare the NumPy forward pass with the TFLite model on random inputs.
+    
+    `tolerance` is relative to the largest TFLite output, since the default
+    TFLite optimization quantizes weights. Full-integer (int8) models lose
+    more precision and typically need a looser tolerance.
+    """
+    import sys
+    import tensorflow as tf
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+    from convert_to_tflite import dequantize_output, quantize_input
+    from inference import NumpyModel
+    
+    rng = np.random.default_rng(0)
+    features = np.column_stack([
+        rng.uniform(20, 80, samples),   # soil moisture
+        rng.uniform(15, 35, samples),   # temperature
+        rng.uniform(30, 90, samples),   # humidity
+        rng.integers(0, 4, samples),    # zone
+        rng.integers(0, 24, samples),   # hour
+    ]).astype(np.float32)
+    
+    model = NumpyModel(npz_path)
+    numpy_output = model.predict(features)
+    
+    interpreter = tf.lite.Interpreter(model_path=tflite_path)
+    input_details = interpreter.get_input_details()[0]
+    interpreter.resize_tensor_input(input_details['index'], list(features.shape))
+    interpreter.allocate_tensors()
+    input_details = interpreter.get_input_details()[0]
+    output_details = interpreter.get_output_details()[0]
+    interpreter.set_tensor(input_details['index'],
+                           quantize_input((features - model.mean) / model.scale, input_details))
+    interpreter.invoke()
+    tflite_output = dequantize_output(interpreter.get_tensor(output_details['index']),
+                                      output_details)[:, 0]
+    
+    error = np.abs(numpy_output - tflite_output)
+    allowed = tolerance * max(float(np.abs(tflite_output).max()), 1.0)
+    print(f"Max abs difference vs TFLite: {error.max():.5f} ml (mean {error.mean():.5f} ml)")
+    if error.max() > allowed:
+        print("Warning: NumPy and TFLite outputs differ more than expected")
+        return False
+    print("NumPy model matches TFLite within tolerance")
+    return True
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--scaler', default=SCALER_PATH)
+    parser.add_argument('--output', default=NPZ_PATH)
+    parser.add_argument('--verify', action='store_true',
+                        help=f'compare against the TFLite model ({TFLITE_PATH})')
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help='allowed difference, relative to the largest output')
+    args = parser.parse_args()
+    
+    if export_numpy(args.model, args.scaler, args.output) and args.verify:
+        verify(args.output, tolerance=args.tolerance)
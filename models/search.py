@@ -0,0 +1,164 @@
+"""
+Parallel architecture and quantization search for the edge model.
+Candidates are trained in a process pool across all cores; each is converted
+with every quantization setting and scored on test MAE, .tflite size and
+interpreter latency. The Pareto front is written to models/search_results.json
+and the chosen model to firmware/models/irrigation_model.tflite.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+ARCHITECTURES = [(8,), (16,), (8, 4), (16, 8), (32, 16), (32, 16, 8)]
+DROPOUTS = [0.0, 0.1, 0.2]
+RESULTS_PATH = 'models/search_results.json'
+CANDIDATE_DIR = 'models/search'
+TFLITE_PATH = 'firmware/models/irrigation_model.tflite'
+# Objectives of the Pareto front, all minimized
+OBJECTIVES = ('mae', 'bytes', 'latency_us')
+
+def _prepare_data(samples):
+    """Same synthetic data, split and scaling as train_model.py."""
+    from sklearn.model_selection import train_test_split
+    from sklearn.preprocessing import StandardScaler
+    from train_model import generate_synthetic_data
+    
+    X, y = generate_synthetic_data(n_samples=samples)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    scaler = StandardScaler()
+    return (scaler.fit_transform(X_train), scaler.transform(X_test), y_train, y_test, scaler)
+
+def _init_worker():
+    # Each process trains on one core; parallelism comes from the pool
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+def train_candidate(index, hidden_units, dropout, quantizations, epochs, samples):
+    """Train one architecture and score it under each quantization setting."""
+    import tensorflow as tf
+    from convert_to_tflite import convert_model, evaluate_tflite, measure_latency
+    from train_model import create_model
+    
+    X_train, X_test, y_train, y_test, _ = _prepare_data(samples)
+    tf.keras.utils.set_random_seed(index)
+    model = create_model(X_train.shape[1], hidden_units, dropout)
+    model.fit(X_train, y_train, batch_size=32, epochs=epochs, verbose=0)
+    keras_path = os.path.join(CANDIDATE_DIR, f'candidate_{index}.h5')
+    model.save(keras_path)
+    
+    results = []
+    for quantization in quantizations:
+        tflite_model = convert_model(model, quantization, X_train[:500])
+        tflite_path = os.path.join(CANDIDATE_DIR, f'candidate_{index}_{quantization}.tflite')
+        with open(tflite_path, 'wb') as f:
+            f.write(tflite_model)
+        results.append({
+            'id': f'{index}-{quantization}',
+            'hidden_units': list(hidden_units),
+            'dropout': dropout,
+            'quantization': quantization,
+            'mae': round(evaluate_tflite(tflite_model, X_test, y_test), 4),
+            'bytes': len(tflite_model),
+            'latency_us': round(measure_latency(tflite_model), 2),
+            'keras_path': keras_path,
+            'tflite_path': tflite_path,
+        })
+    return results
+
+def pareto_front(results, objectives=OBJECTIVES):
+    """Candidates that no other candidate beats on every objective."""
+    def dominates(a, b):
+        return (all(a[key] <= b[key] for key in objectives)
+                and any(a[key] < b[key] for key in objectives))
+    front = [r for r in results if not any(dominates(other, r) for other in results)]
+    return sorted(front, key=lambda r: r['mae'])
+
+def choose(front, max_bytes=None, max_latency_us=None):
+    """Most accurate front member within the limits, else the smallest one."""
+    eligible = [r for r in front
+                if (max_bytes is None or r['bytes'] <= max_bytes)
+                and (max_latency_us is None or r['latency_us'] <= max_latency_us)]
+    if eligible:
+        return min(eligible, key=lambda r: r['mae'])
+    print("Warning: no candidate meets the size/latency limits, using the smallest")
+    return min(front, key=lambda r: r['bytes'])
+
+def search(epochs=30, samples=10000, workers=None, quantizations=None,
+           max_bytes=None, max_latency_us=None):
+    """Run the search and install the chosen model."""
+    from convert_to_tflite import QUANTIZATIONS
+    quantizations = list(quantizations or QUANTIZATIONS)
+    os.makedirs(CANDIDATE_DIR, exist_ok=True)
+    candidates = list(itertools.product(ARCHITECTURES, DROPOUTS))
+    workers = workers or os.cpu_count()
+    print(f"Training {len(candidates)} architectures x {len(quantizations)} "
+          f"quantizations on {workers} processes...")
+    
+    results = []
+    # TensorFlow is not fork-safe, so workers are spawned
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker) as pool:
+        futures = [pool.submit(train_candidate, index, units, dropout,
+                               quantizations, epochs, samples)
+                   for index, (units, dropout) in enumerate(candidates)]
+        for future in as_completed(futures):
+            for result in future.result():
+                results.append(result)
+                print(f"  {result['id']:>12} {str(result['hidden_units']):>12} "
+                      f"dropout={result['dropout']:.1f} MAE={result['mae']:.2f} ml "
+                      f"{result['bytes']} B {result['latency_us']:.1f} us")
+    
+    front = pareto_front(results)
+    chosen = choose(front, max_bytes, max_latency_us)
+    
+    with open(RESULTS_PATH, 'w') as f:
+        json.dump({
+            'objectives': list(OBJECTIVES),
+            'constraints': {'max_bytes': max_bytes, 'max_latency_us': max_latency_us},
+            'candidates': sorted(results, key=lambda r: r['id']),
+            'pareto_front': [r['id'] for r in front],
+            'chosen': chosen['id'],
+        }, f, indent=2)
+    print(f"\nPareto front ({len(front)} of {len(results)}) written to {RESULTS_PATH}")
+    
+    # Install the chosen model where convert_model_to_header.py and
+    # export_numpy.py expect it
+    os.makedirs(os.path.dirname(TFLITE_PATH), exist_ok=True)
+    shutil.copyfile(chosen['tflite_path'], TFLITE_PATH)
+    shutil.copyfile(chosen['keras_path'], 'models/irrigation_model.h5')
+    with open('models/scaler.pkl', 'wb') as f:
+        pickle.dump(_prepare_data(samples)[4], f)
+    print(f"Chosen {chosen['id']}: {chosen['hidden_units']} dropout={chosen['dropout']} "
+          f"{chosen['quantization']}, MAE {chosen['mae']:.2f} ml, {chosen['bytes']} B, "
+          f"{chosen['latency_us']:.1f} us")
+    print(f"Saved to {TFLITE_PATH}; run convert_model_to_header.py to update the firmware")
+    return chosen
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description='Search edge model architectures.')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--samples', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='training processes (default: all cores)')
+    parser.add_argument('--quantizations', nargs='+', default=None,
+                        help='quantization settings to try (default: all)')
+    parser.add_argument('--max-bytes', type=int, default=None,
+                        help='largest acceptable .tflite size')
+    parser.add_argument('--max-latency-us', type=float, default=None,
+                        help='slowest acceptable single-sample invoke time')
+    args = parser.parse_args()
+    
+    search(args.epochs, args.samples, args.workers, args.quantizations,
+           args.max_bytes, args.max_latency_us)
@@ -1,8 +1,12 @@
 """
 AI Model Training Script for Irrigation Controller
 Trains a lightweight model to predict water requirements based on sensor data.
+
+By default the model is trained on synthetic data; with --source database it
+streams stored sensor history from the backend database instead.
 """
 
+import argparse
 import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
@@ -11,6 +15,12 @@ import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
 import os
+import pickle
+import sys
+import time
+
+# Default backend database (the backend runs from backend/)
+DEFAULT_DATABASE_URL = 'sqlite:///backend/irrigation.db'
 
 def generate_synthetic_data(n_samples=10000):
     """
@@ -56,14 +66,21 @@ def generate_synthetic_data(n_samples=10000):
     
     return X, water_requirement.reshape(-1, 1)
 
-def create_model(input_shape):
-    """Create a lightweight neural network for edge deployment."""
-    model = keras.Sequential([
-        layers.Dense(16, activation='relu', input_shape=(input_shape,)),
-        layers.Dropout(0.2),
-        layers.Dense(8, activation='relu'),
-        layers.Dense(1, activation='relu')  # Water requirement (0-100 ml)
-    ])
+def create_model(input_shape, hidden_units=(16, 8), dropout=0.2):
+    """
+    Create a lightweight neural network for edge deployment.
+    
+    `hidden_units` lists the ReLU layer widths; dropout follows the first
+    hidden layer.
+    """
+    model_layers = []
+    for i, units in enumerate(hidden_units):
+        kwargs = {'input_shape': (input_shape,)} if i == 0 else {}
+        model_layers.append(layers.Dense(units, activation='relu', **kwargs))
+        if i == 0 and dropout:
+            model_layers.append(layers.Dropout(dropout))
+    model_layers.append(layers.Dense(1, activation='relu'))  # Water requirement (0-100 ml)
+    model = keras.Sequential(model_layers)
     
     model.compile(
         optimizer='adam',
@@ -112,7 +129,140 @@ def train_model():
     print("Model saved to models/irrigation_model.h5")
     
     # Save scaler for preprocessing
-    import pickle
+    with open('models/scaler.pkl', 'wb') as f:
+        pickle.dump(scaler, f)
+    print("Scaler saved to models/scaler.pkl")
+    
+    return model, scaler
+
+def _sensor_readings_table():
+    """The backend's sensor_readings table definition."""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+    from persistence import sensor_readings
+    return sensor_readings
+
+def id_ranges(engine, shards):
+    """Split the readings' primary keys into `shards` contiguous [start, end) ranges."""
+    from sqlalchemy import func, select
+    readings = _sensor_readings_table().c
+    with engine.connect() as conn:
+        low, high = conn.execute(select(func.min(readings.id), func.max(readings.id))).one()
+    if low is None:
+        return []
+    bounds = np.linspace(low, high + 1, shards + 1).astype(np.int64)
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+def iter_reading_chunks(engine, chunk_size=50000, start_id=None, end_id=None):
+    """
+    Yield (features, labels) chunks of stored readings in [start_id, end_id).
+    
+    Rows are paged by primary key (keyset pagination), so each chunk is an
+    index range scan regardless of how deep into the table it is. Readings
+    without all three sensor values or without water_applied are skipped.
+    """
+    from sqlalchemy import select
+    readings = _sensor_readings_table().c
+    query = (select(readings.id, readings.soil_moisture, readings.temperature,
+                    readings.humidity, readings.zone_id, readings.timestamp,
+                    readings.water_applied)
+             .where(readings.soil_moisture.is_not(None))
+             .where(readings.temperature.is_not(None))
+             .where(readings.humidity.is_not(None))
+             .where(readings.water_applied.is_not(None))
+             .order_by(readings.id)
+             .limit(chunk_size))
+    if end_id is not None:
+        query = query.where(readings.id < end_id)
+    
+    # Hour of day in local time, as on the device
+    offset = time.localtime().tm_gmtoff
+    last_id = -1 if start_id is None else start_id - 1
+    with engine.connect() as conn:
+        while True:
+            rows = conn.execute(query.where(readings.id > last_id)).all()
+            if not rows:
+                return
+            table = np.array(rows, dtype=np.float64)
+            last_id = int(table[-1, 0])
+            hours = ((table[:, 5] + offset) // 3600) % 24
+            features = np.column_stack([table[:, 1:5], hours]).astype(np.float32)
+            yield features, table[:, 6:7].astype(np.float32)
+
+def fit_scaler_streaming(engine, chunk_size=50000):
+    """Fit the StandardScaler in one pass over the stored readings."""
+    scaler = StandardScaler()
+    rows = 0
+    for features, _ in iter_reading_chunks(engine, chunk_size):
+        scaler.partial_fit(features)
+        rows += len(features)
+    return scaler, rows
+
+def make_dataset(engine, scaler, validation, chunk_size=50000, shards=4,
+                 batch_size=256, shuffle_buffer=10000):
+    """
+    Build a tf.data pipeline streaming readings from the database.
+    
+    Every tenth reading of each chunk is held out for validation. Id-range
+    shards are read by parallel generators and interleaved, scaled in
+    parallel map calls and prefetched, so memory is bounded by chunk size
+    and buffers rather than dataset size.
+    """
+    mean = scaler.mean_.astype(np.float32)
+    scale = scaler.scale_.astype(np.float32)
+    ranges = id_ranges(engine, shards)
+    
+    def generate(shard):
+        start_id, end_id = ranges[int(shard)]
+        for features, labels in iter_reading_chunks(engine, chunk_size, start_id, end_id):
+            # Hold out by row order within the chunk, stable across epochs
+            held_out = np.arange(len(features)) % 10 == 0
+            keep = held_out if validation else ~held_out
+            yield features[keep], labels[keep]
+    
+    signature = (tf.TensorSpec(shape=(None, 5), dtype=tf.float32),
+                 tf.TensorSpec(shape=(None, 1), dtype=tf.float32))
+    dataset = tf.data.Dataset.range(len(ranges)).interleave(
+        lambda shard: tf.data.Dataset.from_generator(generate, output_signature=signature,
+                                                     args=(shard,)),
+        cycle_length=max(len(ranges), 1),
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=False)
+    dataset = dataset.map(lambda x, y: ((x - mean) / scale, y),
+                          num_parallel_calls=tf.data.AUTOTUNE)
+    dataset = dataset.unbatch()
+    if not validation:
+        dataset = dataset.shuffle(shuffle_buffer)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+def train_model_streaming(database_url=DEFAULT_DATABASE_URL, epochs=50, batch_size=256,
+                          chunk_size=50000, shards=4):
+    """Train on the backend's stored sensor history, with water_applied as the label."""
+    from sqlalchemy import create_engine
+    engine = create_engine(database_url)
+    
+    print(f"Computing scaler statistics from {database_url}...")
+    scaler, rows = fit_scaler_streaming(engine, chunk_size)
+    if not rows:
+        print("Error: no usable readings in the database!")
+        return None, None
+    print(f"Scaler fitted on {rows} readings")
+    
+    train_ds = make_dataset(engine, scaler, False, chunk_size, shards, batch_size)
+    val_ds = make_dataset(engine, scaler, True, chunk_size, shards, batch_size)
+    
+    print("Creating model...")
+    model = create_model(5)
+    model.summary()
+    
+    print("Training model...")
+    model.fit(train_ds, epochs=epochs, validation_data=val_ds, verbose=1)
+    
+    test_loss, test_mae = model.evaluate(val_ds, verbose=0)
+    print(f"\nValidation MAE: {test_mae:.2f} ml")
+    
+    os.makedirs('models', exist_ok=True)
+    model.save('models/irrigation_model.h5')
+    print("Model saved to models/irrigation_model.h5")
     with open('models/scaler.pkl', 'wb') as f:
         pickle.dump(scaler, f)
     print("Scaler saved to models/scaler.pkl")
@@ -120,5 +270,22 @@ def train_model():
     return model, scaler
 
 if __name__ == '__main__':
-    train_model()
+    parser = argparse.ArgumentParser(description='Train the irrigation prediction model.')
+    parser.add_argument('--source', choices=['synthetic', 'database'], default='synthetic',
+                        help='train on synthetic data or stream stored sensor history')
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL))
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--chunk-size', type=int, default=50000,
+                        help='rows fetched from the database per query')
+    parser.add_argument('--shards', type=int, default=4,
+                        help='parallel database readers')
+    args = parser.parse_args()
+    
+    if args.source == 'database':
+        train_model_streaming(args.database_url, args.epochs, args.batch_size,
+                              args.chunk_size, args.shards)
+    else:
+        train_model()
 